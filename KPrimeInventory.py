@@ -6,6 +6,7 @@ import fitz  # PyMuPDF
 import os
 import io
 import base64
+import uuid
 import cv2
 # from pyzbar.pyzbar import decode
 import datetime
@@ -34,15 +35,34 @@ from db_supabase import (
     delete_item,
     delete_all_inventory,
     get_total_qty,
-    record_sale,
-    get_tiered_price,
+    record_order,
+    get_tiered_prices,
     get_po_sequence,
     get_customer,
     get_pricing_tiers, save_pricing_tier, delete_pricing_tier,
     upload_tiered_pricing_to_db,
     get_customers, save_customer, delete_customer,
-    get_sales_by_customer
+    get_sales_by_customer,
+    near_expiry_report,
+    view_price_history,
+    save_lead_time,
+    receive_stock_bulk, receipt_lines, save_barcode, get_item_costs,
+    record_payment, get_statement_of_account, view_receivables_summary,
+    BRANCHES, DEFAULT_BRANCH, view_branch_rollup, view_branch_stock,
+    PNL_GROUPS, pnl_report,
+    stock_at, stock_drift, take_stock_snapshot, ensure_stock_snapshot, view_stock_snapshots,
+    OFFLINE_ACK, pending_writes, view_offline_journal, resolve_offline_entry, release_offline_entry, sync_offline_writes
 )
+from audit_archive import query_audit_log, archive_audit_log, AUDIT_RETENTION_DAYS
+from table_dtypes import memory_report
+from resilience import resilience_stats
+from forecasting import reorder_suggestions, DEFAULT_LEAD_TIME_DAYS
+from chart_data import stock_by_category_figure, profit_trend_figure, TREND_FREQS
+from price_impact import price_change_impact, IMPACT_FREQS
+from barcode_receiving import scan_uploads, barcode_index
+from invoice_ingest import ingest_invoice
+from documents import build_po_pdf, build_soa_pdf, po_number, po_filename, soa_filename
+from excel_export import export_sales, export_audit_log, export_soa, export_jobs, XLSX_MIME
 
 # ---------------- SESSION STATE INIT ----------------
 if 'logged_in' not in st.session_state:
@@ -51,6 +71,8 @@ if 'menu' not in st.session_state:
     st.session_state.menu = "Landing"
 if 'username' not in st.session_state:
     st.session_state.username = ""
+if 'branch' not in st.session_state:
+    st.session_state.branch = DEFAULT_BRANCH
 
 if "item_name" not in st.session_state:
     st.session_state.item_name = ""
@@ -60,6 +82,14 @@ if "quantity" not in st.session_state:
     st.session_state.quantity = 1
 if "fridge_no" not in st.session_state:
     st.session_state.fridge_no = ""
+if "cart" not in st.session_state:
+    st.session_state.cart = []
+# ✅ Identifies one checkout attempt; a double-clicked or retried "Record Sale"
+# reuses it so stock is deducted once. Renewed whenever the cart changes.
+if "cart_key" not in st.session_state:
+    st.session_state.cart_key = str(uuid.uuid4())
+if "export_jobs" not in st.session_state:
+    st.session_state.export_jobs = []  # ids of this session's Excel exports
 
 # ---------------- Pagination Utility ----------------
 def paginate_dataframe(df, page_size=20):
@@ -72,6 +102,29 @@ def paginate_dataframe(df, page_size=20):
     end_idx = start_idx + page_size
     return df.iloc[start_idx:end_idx], total_pages
 
+# ---------------- Excel Export Jobs ----------------
+def excel_export(label, kind, start):
+    """
+    Button that starts an Excel export in the background (start() returns the job),
+    followed by this session's exports of that kind: progress while running,
+    a download button once done.
+    """
+    if st.button(label, key=f"export_{kind}"):
+        st.session_state.export_jobs.append(start().id)
+    jobs = export_jobs(st.session_state.export_jobs, kind)
+    for job in jobs:
+        if job.status == "running":
+            st.info(f"⏳ {job.label}: {job.rows:,} rows written so far...")
+        elif job.status == "done":
+            st.download_button(
+                f"Download {job.filename} ({job.rows:,} rows)", data=job.data(),
+                file_name=job.filename, mime=XLSX_MIME, key=f"xlsx_{job.id}"
+            )
+        else:
+            st.error(f"{job.label} failed: {job.error}")
+    if any(job.status == "running" for job in jobs):
+        st.button("🔄 Refresh Export Status", key=f"refresh_{kind}")
+
 # ---------------- LOGOUT FUNCTION ----------------
 def logout():
     st.session_state.logged_in = False
@@ -114,7 +167,7 @@ def manage_pricing_tiers():
         label = st.text_input("Tier Label (optional)", value=item_name)
 
         if st.button("Save Tier"):
-            result = save_pricing_tier(item_id, min_qty, max_qty, price_per_unit, label)
+            result = save_pricing_tier(item_id, min_qty, max_qty, price_per_unit, label, st.session_state.username)
             if result == "updated":
                 st.success(f"Updated existing pricing tier for {item_name}.")
             else:
@@ -266,7 +319,7 @@ def upload_tiered_pricing(uploaded_file):
     else:
         raise ValueError("Unsupported file format. Please upload a CSV or Excel file.")
 
-    skipped_rows = upload_tiered_pricing_to_db(df)
+    skipped_rows = upload_tiered_pricing_to_db(df, st.session_state.username)
 
     if skipped_rows:
         st.warning(f"Skipped rows with invalid item_id(s): {skipped_rows}")
@@ -356,19 +409,30 @@ if not st.session_state.logged_in:
     st.write("Your choice for premium quality meat")
     username = st.text_input("Username")
     password = st.text_input("Password", type="password")
+    # ✅ Every query, cache and PO number is scoped to the branch picked here
+    branch = st.selectbox("Branch", list(BRANCHES), format_func=lambda code: BRANCHES[code]["name"])
     if st.button("Login"):
         if username == "admin" and password == "1234":
             st.session_state.logged_in = True
             st.session_state.menu = "Home"
             st.session_state.username = username
+            st.session_state.branch = branch
             st.rerun()
         else:
             st.error("Invalid credentials")
 
 # ---------------- MAIN APP ----------------
 elif st.session_state.logged_in:
-    if os.path.exists("KPrime.jpg"):
-        st.sidebar.image("KPrime.jpg", width=150)
+    branch_info = BRANCHES[st.session_state.branch]
+    if os.path.exists(branch_info["logo"]):
+        st.sidebar.image(branch_info["logo"], width=150)
+    st.sidebar.caption(f"Branch: {branch_info['name']}")
+    if resilience_stats()["circuit"] != "closed":
+        st.sidebar.warning("Database is not responding; lists may show cached data.")
+    # ✅ Writes made offline are journaled locally and replayed in order
+    waiting = pending_writes()
+    if waiting:
+        st.sidebar.info(f"{waiting} change(s) saved offline, waiting to sync.")
     st.sidebar.title("Menu")
     st.sidebar.button("Logout", on_click=logout)
     st.sidebar.header("Settings")
@@ -390,8 +454,11 @@ elif st.session_state.logged_in:
                 "View Inventory",
                 "Manage Stock",
                 "File Upload (Items)",
+                "Receive Stock (Scan)",
+                "Supplier Invoice Import",
+                "Reorder Suggestions",
                 "Delete All Inventory"
-            ], icons=["plus-circle", "list", "pencil", "upload", "trash"])
+            ], icons=["plus-circle", "list", "pencil", "upload", "upc-scan", "file-earmark-pdf", "cart-check", "trash"])
         elif main_menu == "Pricing":
             menu = option_menu("Pricing", [
                 "View Pricing Tiers",
@@ -412,8 +479,12 @@ elif st.session_state.logged_in:
                 "Profit/Loss Report",
                 "View Audit Log",
                 "Generate Purchase Order",
-                "Price Change Impact Report"
-            ], icons=["graph-up", "book", "file-earmark-text", "bar-chart"])
+                "Price Change Impact Report",
+                "Near-Expiry Stock",
+                "Stock History",
+                "Receivables Summary",
+                "Consolidated Branch Report"
+            ], icons=["graph-up", "book", "file-earmark-text", "bar-chart", "hourglass-split", "clock-history", "cash-stack", "diagram-3"])
 
     st.session_state.menu = menu
     st.write(f"Selected: {main_menu} → {menu}")
@@ -426,11 +497,13 @@ elif st.session_state.logged_in:
         if not items_df.empty:
             st.subheader("Inventory Summary")
             st.metric("Total Items", len(items_df))
-            fig = px.bar(items_df, x='category', y='quantity', color='category', title="Stock by Category")
+            # ✅ Aggregated per category and cached per data version
+            fig = stock_by_category_figure(items_df)
             st.plotly_chart(fig)
         if not sales_df.empty:
             st.subheader("Sales Summary")
-            fig2 = px.line(sales_df, x='date', y='profit', title="Profit Trend Over Time")
+            period = st.radio("Group profit by", list(TREND_FREQS), index=0, horizontal=True)
+            fig2 = profit_trend_figure(sales_df, period)
             st.plotly_chart(fig2)
 
     # ---------------- VIEW INVENTORY ----------------
@@ -462,7 +535,7 @@ elif st.session_state.logged_in:
             st.warning("No items found.")
         else:
             st.subheader("Current Inventory")
-            st.dataframe(items_df[['item_id','item_name','category','quantity','fridge_no']])
+            st.dataframe(items_df[['item_id','item_name','category','quantity','fridge_no','lot_no','expiry_date']])
 
         with st.expander("➕ Add or Update Stock", expanded=False):
             existing_categories = sorted(items_df['category'].dropna().unique()) if not items_df.empty else []
@@ -483,9 +556,10 @@ elif st.session_state.logged_in:
                     st.session_state.selected_category = item_rows.iloc[0]['category']
                     category_name = st.session_state.selected_category
                     current_stock = item_rows['quantity'].sum()
-                    st.info(f"Stock Currently On Hand: {current_stock}")
+                    avg_cost = get_item_costs([selected_item_name]).get(selected_item_name, 0.0)
+                    st.info(f"Stock Currently On Hand: {current_stock} (average cost PHP {avg_cost:,.2f})")
                     st.write("Per-Fridge Breakdown:")
-                    st.dataframe(item_rows[['fridge_no','quantity']])
+                    st.dataframe(item_rows[['fridge_no','lot_no','expiry_date','quantity']])
                 else:
                     st.warning(f"No records found for item '{selected_item}'.")
                 item_id = selected_item_id
@@ -500,10 +574,13 @@ elif st.session_state.logged_in:
 
             quantity = st.number_input("Quantity to Add", min_value=1, value=st.session_state.quantity)
             fridge_no = st.text_input("Fridge No", value=st.session_state.fridge_no)
+            lot_no = st.text_input("Lot No (optional)")
+            expiry_date = st.date_input("Expiry Date (optional)", value=None)
+            unit_cost = st.number_input("Unit Cost (optional)", min_value=0.0, value=None, format="%.2f")
 
             if st.button("Save"):
                 if item_name and category_name:
-                    add_or_update_item(item_id, item_name.strip().upper(), category_name.strip().upper(), quantity, fridge_no, st.session_state.username)
+                    add_or_update_item(item_id, item_name.strip().upper(), category_name.strip().upper(), quantity, fridge_no, st.session_state.username, lot_no, expiry_date, unit_cost)
                     st.success(f"Item '{item_name}' in category '{category_name}' updated successfully!")
                     st.rerun()
                 else:
@@ -534,11 +611,167 @@ elif st.session_state.logged_in:
             required_cols = ["item_name", "category", "quantity", "fridge_no"]
             if all(col in df.columns for col in required_cols):
                 for _, row in df.iterrows():
-                    add_or_update_item(None, row["item_name"].strip().upper(), row["category"].strip().upper(), row["quantity"], row["fridge_no"], st.session_state.username)
+                    # Optional lot_no / expiry_date / unit_cost columns
+                    lot_no = row.get("lot_no")
+                    expiry_date = row.get("expiry_date")
+                    unit_cost = row.get("unit_cost")
+                    add_or_update_item(
+                        None, row["item_name"].strip().upper(), row["category"].strip().upper(), row["quantity"], row["fridge_no"], st.session_state.username,
+                        None if pd.isna(lot_no) else str(lot_no),
+                        None if pd.isna(expiry_date) else pd.to_datetime(expiry_date).date(),
+                        None if pd.isna(unit_cost) else float(unit_cost)
+                    )
                 st.success("Items updated or inserted successfully!")
             else:
                 st.error(f"Missing required columns: {required_cols}")
 
+    # ---------------- RECEIVE STOCK (SCAN) ----------------
+    elif menu == "Receive Stock (Scan)":
+        st.title("Receive Stock (Scan)")
+        st.write("Upload photos or a short video of the carton labels on a pallet.")
+        uploaded_files = st.file_uploader(
+            "Carton label photos / video",
+            type=["jpg", "jpeg", "png", "mp4", "mov", "avi", "mkv", "webm"],
+            accept_multiple_files=True
+        )
+        if uploaded_files and st.button("Decode Barcodes"):
+            try:
+                received, unresolved, stats = scan_uploads(uploaded_files)
+            except RuntimeError as e:
+                st.error(str(e))
+            else:
+                st.session_state.scan_result = (received, unresolved, stats)
+
+        if "scan_result" in st.session_state:
+            received, unresolved, stats = st.session_state.scan_result
+            st.info(f"Decoded {stats['labels']} labels from {stats['frames_decoded']} frames in {stats['seconds']} s.")
+
+            if received.empty:
+                st.warning("No known barcodes found.")
+            else:
+                st.subheader("Review Received Stock")
+                st.write("Check the carton counts against the pallet and fill in unit_cost where known; blank lines are received at the item's average cost.")
+                units_per_carton = received["quantity"] // received["cartons"]
+                received = st.data_editor(
+                    received.assign(unit_cost=float("nan")),
+                    column_config={
+                        "cartons": st.column_config.NumberColumn("cartons", min_value=0, step=1),
+                        "unit_cost": st.column_config.NumberColumn("unit_cost", min_value=0.0, format="%.2f")
+                    },
+                    disabled=["barcode", "item_name", "category", "quantity"],
+                    width='stretch'
+                )
+                received["quantity"] = received["cartons"] * units_per_carton
+                fridge_no = st.text_input("Fridge No")
+                lot_no = st.text_input("Lot No (blank = auto)")
+                expiry_date = st.date_input("Expiry Date (optional)", value=None)
+                if st.button("Receive All"):
+                    if not fridge_no:
+                        st.error("Please enter a fridge number.")
+                    else:
+                        rows = receive_stock_bulk(receipt_lines(received), fridge_no, st.session_state.username, lot_no, expiry_date)
+                        del st.session_state.scan_result
+                        if rows is None:
+                            st.info(OFFLINE_ACK)
+                        else:
+                            st.success(f"Received {len(rows)} item(s) into fridge {fridge_no}.")
+
+            if unresolved:
+                with st.expander(f"⚠️ {len(unresolved)} unknown barcode(s)", expanded=False):
+                    items_df = view_items()
+                    code = st.selectbox("Barcode", unresolved)
+                    products = items_df[["item_name", "category"]].drop_duplicates() if not items_df.empty else pd.DataFrame(columns=["item_name", "category"])
+                    product = st.selectbox("Item", products.apply(lambda r: f"{r['item_name']} | {r['category']}", axis=1).tolist())
+                    units = st.number_input("Units per carton", min_value=1, value=1)
+                    if st.button("Save Barcode") and product:
+                        item_name, category = product.split(" | ")
+                        save_barcode(code, item_name, category, units)
+                        barcode_index(refresh=True)
+                        st.success(f"Barcode {code} saved for {item_name}. Decode again to include it.")
+
+    # ---------------- SUPPLIER INVOICE IMPORT ----------------
+    elif menu == "Supplier Invoice Import":
+        st.title("Supplier Invoice Import")
+        uploaded_pdf = st.file_uploader("Upload supplier invoice PDF", type=["pdf"])
+        items_df = view_items()
+        if uploaded_pdf is not None and st.button("Extract Line Items"):
+            review_df, timings_df = ingest_invoice(uploaded_pdf.getvalue(), items_df)
+            st.session_state.invoice_result = (uploaded_pdf.name, review_df, timings_df)
+
+        if "invoice_result" in st.session_state:
+            invoice_name, review_df, timings_df = st.session_state.invoice_result
+            with st.expander("⏱️ Page Timings", expanded=False):
+                st.dataframe(timings_df, width='stretch')
+                st.write(f"Total extraction time: {timings_df['seconds'].sum():.2f} s over {len(timings_df)} page(s)")
+
+            if review_df.empty:
+                st.warning("No line items found in this invoice.")
+            else:
+                st.subheader("Review Line Items")
+                st.write("Unmatched lines are skipped. Pick the catalogue item to include them.")
+                item_names = sorted(items_df["item_name"].unique()) if not items_df.empty else []
+                edited_df = st.data_editor(
+                    review_df,
+                    column_config={"item_name": st.column_config.SelectboxColumn("item_name", options=item_names)},
+                    disabled=["page", "description", "category", "match_score", "amount"],
+                    width='stretch'
+                )
+                fridge_no = st.text_input("Fridge No")
+                lot_no = st.text_input("Lot No", value=os.path.splitext(invoice_name)[0])
+                expiry_date = st.date_input("Expiry Date (optional)", value=None)
+                if st.button("Apply to Stock"):
+                    to_receive = edited_df.dropna(subset=["item_name"])
+                    if not fridge_no:
+                        st.error("Please enter a fridge number.")
+                    elif to_receive.empty:
+                        st.error("No matched line items to receive.")
+                    else:
+                        # Categories follow the (possibly re-picked) catalogue item
+                        categories = items_df.drop_duplicates("item_name").set_index("item_name")["category"]
+                        to_receive = to_receive.assign(category=to_receive["item_name"].map(categories))
+                        rows = receive_stock_bulk(receipt_lines(to_receive), fridge_no, st.session_state.username, lot_no, expiry_date)
+                        del st.session_state.invoice_result
+                        if rows is None:
+                            st.info(OFFLINE_ACK)
+                        else:
+                            st.success(f"Received {len(rows)} item(s) from {invoice_name}.")
+
+    # ---------------- REORDER SUGGESTIONS ----------------
+    elif menu == "Reorder Suggestions":
+        st.title("Reorder Suggestions")
+        # ✅ Demand history is cached and only new sales are folded in
+        suggestions_df = reorder_suggestions()
+        if suggestions_df.empty:
+            st.warning("No items or sales data available.")
+        else:
+            to_order = suggestions_df[suggestions_df["suggested_qty"] > 0]
+            col1, col2 = st.columns(2)
+            col1.metric("Items to Reorder", len(to_order))
+            col2.metric("Units Suggested", f"{int(to_order['suggested_qty'].sum()):,}")
+
+            show_all = st.checkbox("Show all items", value=False)
+            shown_df = suggestions_df if show_all else to_order
+            st.dataframe(shown_df.style.format({
+                "on_hand": "{:,.0f}",
+                "daily_rate": "{:,.2f}",
+                "lead_demand": "{:,.1f}",
+                "safety_stock": "{:,.1f}",
+                "reorder_point": "{:,.1f}",
+                "days_of_cover": "{:,.1f}"
+            }), width='stretch')
+            csv_reorder = shown_df.to_csv(index=False)
+            st.download_button("Download Reorder CSV", data=csv_reorder, file_name="reorder_suggestions.csv", mime="text/csv")
+
+        with st.expander("🚚 Supplier Lead Times", expanded=False):
+            items_df = view_items()
+            if not items_df.empty:
+                lead_item = st.selectbox("Item", sorted(items_df["item_name"].unique()))
+                lead_days = st.number_input("Lead Time (days)", min_value=1, value=DEFAULT_LEAD_TIME_DAYS)
+                if st.button("Save Lead Time"):
+                    save_lead_time(lead_item, lead_days)
+                    st.success(f"Lead time for {lead_item} set to {lead_days} day(s).")
+                    st.rerun()
+
     # ---------------- DELETE ALL INVENTORY ----------------
     elif menu == "Delete All Inventory":
         st.title("Delete All Inventory")
@@ -585,10 +818,12 @@ elif st.session_state.logged_in:
         start_date = st.date_input("Start Date")
         end_date = st.date_input("End Date")
 
+        # ✅ Date-range filters also read the archived (cold) partitions
         if st.button("Filter"):
-            audit_df = view_audit_log(start_date, end_date)
+            audit_df = query_audit_log(start_date, end_date)
         else:
-            audit_df = view_audit_log()
+            audit_df = query_audit_log()
+            st.caption(f"Showing entries from the last {AUDIT_RETENTION_DAYS} days. Use the date filter to include archived entries.")
 
         if audit_df.empty:
             st.warning("No audit records found.")
@@ -599,6 +834,197 @@ elif st.session_state.logged_in:
             csv_audit = audit_df.to_csv(index=False)
             st.download_button("Download Audit Log CSV", data=csv_audit, file_name="audit_log.csv", mime="text/csv")
 
+        # ✅ Streams the live and archived rows for the dates above into a workbook in the background
+        excel_export("📊 Export Audit Log to Excel", "audit", lambda: export_audit_log(start_date, end_date))
+
+        # ✅ Columns load as compact dtypes (categories, int32, datetime64)
+        with st.expander("📉 Memory Use of Loaded Tables", expanded=False):
+            st.dataframe(memory_report())
+
+        with st.expander("📶 Database Request Health", expanded=False):
+            st.json(resilience_stats())
+
+        with st.expander("🔁 Offline Changes", expanded=False):
+            journal_df = view_offline_journal()
+            if journal_df.empty:
+                st.info("No offline changes waiting or needing review.")
+            else:
+                st.dataframe(journal_df)
+                col1, col2 = st.columns(2)
+                if col1.button("Sync Now"):
+                    settled = sync_offline_writes()
+                    st.success(f"Sent {settled} change(s).")
+                    st.rerun()
+                review = journal_df[journal_df["status"].isin(["conflict", "held", "failed"])]
+                if not review.empty:
+                    st.caption("Held changes were not saved: the stock they assumed changed while offline.")
+                    seq = col2.selectbox("Entry to review", review["seq"].tolist())
+                    held = review.loc[review["seq"] == seq, "status"].iloc[0] == "held"
+                    if held and col2.button("Apply Anyway"):
+                        release_offline_entry(int(seq))
+                        st.rerun()
+                    if col2.button("Discard" if held else "Mark Reviewed"):
+                        resolve_offline_entry(int(seq))
+                        st.rerun()
+
+        with st.expander("🗄️ Archive Old Entries", expanded=False):
+            st.caption("Stock movements stay in the live log: Stock History replays them.")
+            retention_days = st.number_input("Keep entries newer than (days)", min_value=1, value=AUDIT_RETENTION_DAYS)
+            if st.button("Archive Now"):
+                result = archive_audit_log(retention_days)
+                st.success(f"Archived {result['archived']} entries into {result['partitions']} partition file(s).")
+
+    # ---------------- PRICE CHANGE IMPACT REPORT ----------------
+    elif menu == "Price Change Impact Report":
+        st.title("Price Change Impact Report")
+        history_df = view_price_history()
+        sales_df = view_sales()
+        if history_df.empty:
+            st.warning("No price changes recorded")
+        elif sales_df.empty:
+            st.warning("No sales data available.")
+        else:
+            period = st.radio("Group by", list(IMPACT_FREQS), index=2, horizontal=True)
+            impact_df = price_change_impact(sales_df, history_df, period)
+
+            item_names = sorted(impact_df["item_name"].unique())
+            selected_items = st.multiselect("Filter by Item", item_names)
+            if selected_items:
+                impact_df = impact_df[impact_df["item_name"].isin(selected_items)]
+
+            st.metric("Revenue Impact", f"PHP {impact_df['revenue_delta'].sum():,.2f}")
+
+            by_period = impact_df.groupby("period", as_index=False)["revenue_delta"].sum()
+            fig = px.bar(by_period, x="period", y="revenue_delta", title=f"Price Change Impact per {period}")
+            st.plotly_chart(fig)
+
+            paged_impact, total_pages = paginate_dataframe(impact_df, page_size=20)
+            st.write(f"Showing {len(paged_impact)} rows (Page size: 20)")
+            st.dataframe(paged_impact.style.format({
+                "revenue": "{:,.2f}",
+                "revenue_delta": "{:,.2f}",
+                "price_in_effect": "{:,.2f}"
+            }), width='stretch')
+            csv_impact = impact_df.to_csv(index=False)
+            st.download_button("Download Impact Report CSV", data=csv_impact, file_name="impact_report.csv", mime="text/csv")
+
+    # ---------------- RECEIVABLES SUMMARY ----------------
+    elif menu == "Receivables Summary":
+        st.title("Receivables Summary")
+        receivables_df = view_receivables_summary()
+        if receivables_df.empty:
+            st.warning("No customer balances recorded.")
+        else:
+            totals = receivables_df[["balance", "current", "days_30", "days_60", "days_90"]].sum()
+            col1, col2, col3, col4, col5 = st.columns(5)
+            col1.metric("Total Receivables", f"{totals['balance']:,.2f}")
+            col2.metric("Current", f"{totals['current']:,.2f}")
+            col3.metric("31-60 Days", f"{totals['days_30']:,.2f}")
+            col4.metric("61-90 Days", f"{totals['days_60']:,.2f}")
+            col5.metric("Over 90 Days", f"{totals['days_90']:,.2f}")
+            st.dataframe(receivables_df.style.format({
+                "balance": "{:,.2f}",
+                "current": "{:,.2f}",
+                "days_30": "{:,.2f}",
+                "days_60": "{:,.2f}",
+                "days_90": "{:,.2f}"
+            }), width='stretch')
+            csv_receivables = receivables_df.to_csv(index=False)
+            st.download_button("Download Receivables CSV", data=csv_receivables, file_name="receivables.csv", mime="text/csv")
+
+    # ---------------- CONSOLIDATED BRANCH REPORT ----------------
+    elif menu == "Consolidated Branch Report":
+        st.title("Consolidated Branch Report")
+        today = date.today()
+        start_date = st.date_input("Start Date", value=today.replace(day=1))
+        end_date = st.date_input("End Date", value=today)
+
+        # ✅ Aggregated from the per-branch daily rollups, not raw sales rows
+        rollup_df = view_branch_rollup(start_date, end_date)
+        if rollup_df.empty:
+            st.warning("No sales in the selected period.")
+        else:
+            rollup_df["branch"] = rollup_df["branch"].map(lambda code: BRANCHES.get(code, {}).get("name", code))
+            by_branch = rollup_df.groupby("branch", as_index=False)[["lines", "units", "total_sale", "cost", "profit"]].sum()
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Total Sales", f"PHP {by_branch['total_sale'].sum():,.2f}")
+            col2.metric("Total Cost", f"PHP {by_branch['cost'].sum():,.2f}")
+            col3.metric("Total Profit", f"PHP {by_branch['profit'].sum():,.2f}")
+            st.dataframe(by_branch.style.format({
+                "units": "{:,.0f}",
+                "total_sale": "{:,.2f}",
+                "cost": "{:,.2f}",
+                "profit": "{:,.2f}"
+            }), width='stretch')
+            fig = px.bar(rollup_df, x="day", y="total_sale", color="branch", title="Daily Sales per Branch")
+            st.plotly_chart(fig)
+            csv_rollup = rollup_df.to_csv(index=False)
+            st.download_button("Download Branch Rollup CSV", data=csv_rollup, file_name="branch_rollup.csv", mime="text/csv")
+
+        stock_df = view_branch_stock()
+        if not stock_df.empty:
+            st.subheader("Stock on Hand per Branch")
+            stock_df["branch"] = stock_df["branch"].map(lambda code: BRANCHES.get(code, {}).get("name", code))
+            st.dataframe(stock_df.pivot_table(index="category", columns="branch", values="units", aggfunc="sum", fill_value=0), width='stretch')
+
+    # ---------------- NEAR-EXPIRY STOCK ----------------
+    elif menu == "Near-Expiry Stock":
+        st.title("Near-Expiry Stock")
+        days = st.number_input("Expiring within (days)", min_value=0, value=7)
+        expiring_df = near_expiry_report(days)
+        if expiring_df.empty:
+            st.info(f"No lots expire within {days} days.")
+        else:
+            expiring_df = expiring_df[['expiry_date','days_left','item_name','category','lot_no','fridge_no','quantity']]
+            st.dataframe(expiring_df, width='stretch')
+            csv_expiring = expiring_df.to_csv(index=False)
+            st.download_button("Download Near-Expiry CSV", data=csv_expiring, file_name="near_expiry.csv", mime="text/csv")
+
+    # ---------------- STOCK HISTORY ----------------
+    elif menu == "Stock History":
+        st.title("Stock History")
+        # ✅ Replayed from the nearest daily snapshot, never from the start of the audit log
+        ensure_stock_snapshot()
+        col1, col2 = st.columns(2)
+        as_of_date = col1.date_input("As of Date", value=date.today())
+        as_of_time = col2.time_input("As of Time", value=datetime.now().time().replace(second=0, microsecond=0))
+        as_of = datetime.combine(as_of_date, as_of_time)
+
+        history_df = stock_at(as_of)
+        if history_df.empty:
+            st.info("No stock on record at that time (history starts with the first snapshot).")
+        else:
+            st.caption(f"Replayed from snapshot #{history_df['snapshot_id'].iloc[0]} taken {history_df['snapshot_at'].iloc[0]}.")
+            view = st.radio("Show", ["Per Item and Fridge", "Per Stock Row"], horizontal=True)
+            if view == "Per Item and Fridge":
+                shown_df = history_df.groupby(["item_name", "category", "fridge_no"], as_index=False, dropna=False)["quantity"].sum()
+            else:
+                shown_df = history_df[["item_id", "item_name", "category", "fridge_no", "lot_no", "quantity"]]
+            item_filter = st.text_input("Filter by item name")
+            if item_filter:
+                shown_df = shown_df[shown_df["item_name"].str.contains(item_filter.strip(), case=False, na=False)]
+            st.dataframe(shown_df, width='stretch')
+            st.download_button(
+                "Download Stock History CSV", data=shown_df.to_csv(index=False),
+                file_name=f"stock_{as_of:%Y%m%d_%H%M}.csv", mime="text/csv"
+            )
+
+        with st.expander("🔎 Drift Check", expanded=False):
+            st.write("Compares the live stock with the latest snapshot plus every logged change since.")
+            if st.button("Check Drift"):
+                drift_df = stock_drift()
+                if drift_df.empty:
+                    st.success("Live stock matches the replayed history.")
+                else:
+                    st.warning(f"{len(drift_df)} stock row(s) changed without a matching audit entry.")
+                    st.dataframe(drift_df, width='stretch')
+
+        with st.expander("📸 Snapshots", expanded=False):
+            if st.button("Take Snapshot Now"):
+                snap = take_stock_snapshot()
+                st.success(f"Snapshot #{snap['id']} saved ({snap['item_rows']} stock rows).")
+            st.dataframe(view_stock_snapshots(), width='stretch')
+
     # ---------------- ADD CUSTOMER ----------------
     elif menu == "Add Customer":
         st.title("Add New Customer")
@@ -609,13 +1035,7 @@ elif st.session_state.logged_in:
             st.error("Please enter a valid email address.")
         address = st.text_area("Address")
         if st.button("Save Customer"):
-            from db_supabase import supabase
-            supabase.table("customers").insert({
-                "name": name.upper(),
-                "phone": phone,
-                "email": email.upper(),
-                "address": address.upper()
-            }).execute()
+            save_customer(None, name, phone, email, address)
             st.success(f"Customer '{name}' added successfully!")
 
     # ---------------- MANAGE CUSTOMERS ----------------
@@ -661,7 +1081,9 @@ elif st.session_state.logged_in:
 
             if st.button("Save Customer"):
                 result = save_customer(customer_id, name, phone, email, address)
-                if result == "updated":
+                if result == "queued":
+                    st.info(OFFLINE_ACK)
+                elif result == "updated":
                     st.success(f"Customer '{name}' updated successfully!")
                 else:
                     st.success(f"Customer '{name}' added successfully!")
@@ -800,7 +1222,6 @@ elif st.session_state.logged_in:
    # ---------------- GENERATE PURCHASE ORDER ----------------
     elif menu == "Generate Purchase Order":
         st.title("Generate Purchase Order (PO)")
-        from fpdf.enums import XPos, YPos
         customers_df = view_customers()
         if customers_df.empty:
             st.warning("No customers found.")
@@ -814,8 +1235,15 @@ elif st.session_state.logged_in:
             if sales_df.empty:
                 st.warning("No sales records found for this customer.")
             else:
-                order_dates = sales_df['date'].unique()
-                order_date = st.selectbox("Select Order Date", order_dates)
+                # Cart sales share an order_id; older rows are grouped by date
+                sales_df["order_ref"] = sales_df["order_id"].fillna(sales_df["date"].astype(str))
+                orders = sales_df.groupby("order_ref", sort=False)["date"].first()
+                order_ref = st.selectbox(
+                    "Select Order",
+                    orders.index.tolist(),
+                    format_func=lambda ref: f"{orders[ref]} (order {ref[:8]})" if ref != str(orders[ref]) else str(ref)
+                )
+                order_date = orders[order_ref]
                 if isinstance(order_date, date):
                     order_date_sql = order_date.strftime("%Y-%m-%d")
                 else:
@@ -825,20 +1253,9 @@ elif st.session_state.logged_in:
                 pickup_date_sql = pickup_date.strftime("%Y-%m-%d")
 
                 if st.button("Generate PO"):
-                    from fpdf import FPDF
-                    from db_supabase import get_po_sequence, get_customer
-
                     # --- Generate PO Number ---
                     seq = get_po_sequence(order_date_sql)
-                    po_number = f"PO-{order_date_sql.replace('-', '')}-{seq:03d}"
-
-                    # --- Vendor Info ---
-                    vendor = {
-                        "name": "KPrime Food Solutions",
-                        "address": "Blk 3 Lot 5 West Wing Villas, North Belton QC",
-                        "phone": "+63 995 744 9953",
-                        "email": "kprimefoodinc@gmail.com"
-                    }
+                    number = po_number(order_date_sql, seq)
 
                     # --- Buyer Info ---
                     customer = get_customer(customer_id)
@@ -848,76 +1265,16 @@ elif st.session_state.logged_in:
                         "phone": customer.get("phone", ""),
                         "email": customer.get("email", "")
                     }
-                    safe_name = buyer["name"].replace(" ", "_").replace("/", "_")
-                    filename = f"PO_{order_date_sql.replace('-', '')}_{safe_name}.pdf"
-
-                    # --- Build PDF ---
-                    pdf = FPDF()
-                    pdf.add_page()
-                    pdf.image("KPrime.jpg", x=10, y=8, w=30)
-
-                    pdf.set_font("Helvetica", 'B', 14)
-                    pdf.cell(0, 10, vendor["name"], new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="C")
-                    pdf.set_font("Helvetica", size=10)
-                    pdf.multi_cell(0, 5, f"{vendor['address']}\nPhone: {vendor['phone']}\nEmail: {vendor['email']}", align="C")
-                    pdf.ln(10)
-
-                    pdf.set_font("Helvetica", 'B', 12)
-                    pdf.cell(0, 10, "Purchase Order", new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="C")
-                    pdf.set_font("Helvetica", size=10)
-                    pdf.cell(0, 10, f"PO Number: {po_number}", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-                    pdf.cell(0, 10, f"Order Date: {order_date_sql}", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-                    #pdf.cell(0, 10, f"Pickup Date: {pickup_date_sql}", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-                    pdf.ln(10)
-
-                    # Table header
-                    pdf.set_font("Helvetica", 'B', 10)
-                    pdf.cell(20, 10, "No.", 1, align="C")
-                    pdf.cell(80, 10, "Description", 1, align="L")
-                    pdf.cell(30, 10, "Qty", 1, align="C")
-                    pdf.cell(30, 10, "Unit Price", 1, align="R")
-                    pdf.cell(30, 10, "Total", 1, align="R")
-                    pdf.ln()
-
-                    # Table rows
-                    pdf.set_font("Helvetica", size=10)
-                    subtotal = 0
-                    for idx, row in sales_df[sales_df['date'] == order_date].iterrows():
-                        total = row["quantity"] * row["selling_price"]
-                        subtotal += total
-                        pdf.cell(20, 10, str(idx+1), 1, align="C")
-                        pdf.cell(80, 10, str(row.get("item_name", "")), 1, align="L")
-                        pdf.cell(30, 10, str(row.get("quantity", "")), 1, align="C")
-                        pdf.cell(30, 10, f"{row.get('selling_price', 0):,.2f}", 1, align="R")
-                        pdf.cell(30, 10, f"{total:,.2f}", 1, align="R")
-                        pdf.ln()
-
-                    pdf.ln(5)
-                    pdf.cell(0, 10, f"Subtotal: PHP {subtotal:,.2f}", new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="R")
-                    pdf.cell(0, 10, "GST: PHP 0.00 (No GST)", new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="R")
-                    pdf.cell(0, 10, f"Total Amount: PHP {subtotal:,.2f}", new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="R")
-                    pdf.ln(10)
-
-                    pdf.cell(0, 10, f"Pickup Date: {pickup_date_sql}", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-                    pdf.ln(20)
-                    pdf.cell(0, 10, "Authorized By: ____________________", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-
-                    #pdf_bytes = bytes(pdf.output(dest="S"))
 
-                    #pdf_bytes = pdf.output(dest="bytes")
-                    #pdf_bytes = bytes(pdf_bytes)   # Convert bytearray → bytes
-                    #st.download_button(
-                    #    "Download PO PDF",
-                    #    data=pdf_bytes,
-                    #    file_name=filename,
-                    #    mime="application/pdf"
-                    #)
-
-                    pdf_bytes = bytes(pdf.output())  # no dest argument
+                    # ✅ Same PDF builder as the batch CLI (documents.py)
+                    pdf_bytes = build_po_pdf(
+                        number, order_date_sql, pickup_date_sql, buyer,
+                        sales_df[sales_df["order_ref"] == order_ref]
+                    )
                     st.download_button(
                         "Download PO PDF",
                         data=pdf_bytes,
-                        file_name=filename,
+                        file_name=po_filename(order_date_sql, buyer["name"]),
                         mime="application/pdf"
                     )
 
@@ -936,17 +1293,6 @@ elif st.session_state.logged_in:
                 lambda row: f"{row['item_id']} - {row['item_name']}", axis=1
             )
 
-            # Item selection
-            item_display = st.selectbox(
-                "Select Item",
-                ["Select item"] + items_df["display"].tolist()
-            )
-
-            selected_item_id, selected_item_name = None, None
-            if item_display != "Select item":
-                selected_item_id = int(item_display.split(" - ")[0])
-                selected_item_name = item_display.split(" - ")[1]
-
             # Customer selection
             customer_label = st.selectbox(
                 "Select Customer",
@@ -960,86 +1306,153 @@ elif st.session_state.logged_in:
                 customer_name = customer_label.split(" - ")[1]
                 st.success(f"Selected customer: ID={customer_id}, Name={customer_name}")
 
-                # Quantity input
-                quantity = st.number_input("Quantity Sold", min_value=1)
-
-                if item_display != "Select item":
-                    # Get stock on hand
-                    total_qty = get_total_qty(selected_item_name)
-                    st.info(f"Stock Currently On Hand: {total_qty}")
-
-                    if total_qty < quantity and quantity != 0:
-                        st.error("Not enough stock")
-
-                    # ✅ Call helper function from db_supabase.py
-                    price_per_unit = get_tiered_price(selected_item_id, quantity)
-
-                    if price_per_unit is None:
-                        st.warning("No pricing tier found for this item/quantity.")
-                        price_per_unit = 0.00
-
-                    auto_total = quantity * price_per_unit
-                    if total_qty >= quantity:
-                        st.info(f"Tiered Price per Unit: PHP {price_per_unit:,.2f}")
-                        st.info(f"Calculated Total Sale: PHP {auto_total:,.2f}")
+                # ---- Add a line to the cart ----
+                with st.expander("➕ Add Item to Cart", expanded=True):
+                    item_display = st.selectbox(
+                        "Select Item",
+                        ["Select item"] + items_df["display"].tolist()
+                    )
+                    quantity = st.number_input("Quantity Sold", min_value=1)
+
+                    if item_display != "Select item":
+                        selected_item_id = int(item_display.split(" - ")[0])
+                        selected_item_name = item_display.split(" - ")[1]
+
+                        # Stock on hand, less what is already in the cart for this item
+                        total_qty = items_df.loc[items_df["item_name"] == selected_item_name, "quantity"].sum()
+                        in_cart = sum(l["quantity"] for l in st.session_state.cart if l["item_name"] == selected_item_name)
+                        st.info(f"Stock Currently On Hand: {total_qty} (in cart: {in_cart})")
+                        if total_qty - in_cart < quantity:
+                            st.error("Not enough stock")
+
+                        # Override option
+                        use_override = st.checkbox("Override Per Unit amount?")
+                        override_price = None
+                        if use_override:
+                            override_price = st.number_input("Enter custom per unit price", min_value=0.0, format="%.2f")
+
+                        if st.button("Add to Cart"):
+                            st.session_state.cart.append({
+                                "item_id": selected_item_id,
+                                "item_name": selected_item_name,
+                                "quantity": int(quantity),
+                                "override_price": override_price
+                            })
+                            st.session_state.cart_key = str(uuid.uuid4())
+                            st.rerun()
 
-                    # Override option
-                    use_override = st.checkbox("Override Per Unit amount?")
-                    override_total = None
-                    if use_override:
-                        override_total = st.number_input("Enter custom per unit price", min_value=0.0, format="%.2f")
+                # ---- Cart ----
+                st.subheader("Cart")
+                if not st.session_state.cart:
+                    st.info("Cart is empty.")
+                else:
+                    # ✅ One pricing query for every line in the cart
+                    prices = get_tiered_prices([(l["item_id"], l["quantity"]) for l in st.session_state.cart])
+                    cart_df = pd.DataFrame(st.session_state.cart)
+                    cart_df["price_per_unit"] = [
+                        l["override_price"] if l["override_price"] else (prices[(l["item_id"], l["quantity"])] or 0.00)
+                        for l in st.session_state.cart
+                    ]
+                    cart_df["line_total"] = cart_df["quantity"] * cart_df["price_per_unit"]
+                    cart_df["overridden"] = cart_df["override_price"].notna()
+                    st.dataframe(
+                        cart_df[["item_id", "item_name", "quantity", "price_per_unit", "line_total", "overridden"]]
+                        .style.format({"price_per_unit": "{:,.2f}", "line_total": "{:,.2f}"}),
+                        width='stretch'
+                    )
+                    if any(prices[(l["item_id"], l["quantity"])] is None and not l["override_price"] for l in st.session_state.cart):
+                        st.warning("Some lines have no pricing tier for their quantity.")
+                    st.info(f"Order Total: PHP {cart_df['line_total'].sum():,.2f}")
+
+                    line_labels = [f"{i + 1}. {l['item_name']} x {l['quantity']}" for i, l in enumerate(st.session_state.cart)]
+                    line_to_remove = st.selectbox("Remove a line", ["Select line"] + line_labels)
+                    col1, col2 = st.columns(2)
+                    if col1.button("Remove Line") and line_to_remove != "Select line":
+                        st.session_state.cart.pop(line_labels.index(line_to_remove))
+                        st.session_state.cart_key = str(uuid.uuid4())
+                        st.rerun()
+                    if col2.button("Clear Cart"):
+                        st.session_state.cart = []
+                        st.session_state.cart_key = str(uuid.uuid4())
+                        st.rerun()
 
                     if st.button("Record Sale"):
-                        msg = record_sale(
-                            selected_item_id,
-                            quantity,
+                        order_id, consumed, msg = record_order(
+                            st.session_state.cart,
                             st.session_state.username,
                             customer_id,
-                            override_total
+                            idempotency_key=st.session_state.cart_key
                         )
-                        st.subheader("Sales Records")
-                        sales_df = view_sales_by_customer(customer_id)
-                        if not sales_df.empty:
-                            paged_sales, total_pages = paginate_dataframe(sales_df, page_size=100)
-                            st.write(f"Showing {len(paged_sales)} rows (Page size: 100)")
-
-                            styled_sales = paged_sales.style.format({
-                                "selling_price": "{:,.2f}",
-                                "total_sale": "{:,.2f}",
-                                "cost": "{:,.2f}",
-                                "profit": "{:,.2f}"
-                            })
-                            st.dataframe(styled_sales, width='stretch')
-
-                            csv_sales = sales_df.to_csv(index=False)
-                            st.download_button("Download Sales CSV", data=csv_sales, file_name="sales.csv", mime="text/csv")
+                        if order_id is None:
+                            st.error(msg)
+                        elif consumed is None:
+                            st.session_state.cart = []
+                            st.session_state.cart_key = str(uuid.uuid4())
+                            st.info(f"Order {order_id}: {msg}")
                         else:
-                            st.info("No sales recorded yet.")
-                        st.success(msg)
+                            st.session_state.cart = []
+                            st.session_state.cart_key = str(uuid.uuid4())
+                            st.success(f"Order {order_id} recorded.")
+                            st.subheader("Sales Records")
+                            sales_df = view_sales_by_customer(customer_id)
+                            if not sales_df.empty:
+                                paged_sales, total_pages = paginate_dataframe(sales_df, page_size=100)
+                                st.write(f"Showing {len(paged_sales)} rows (Page size: 100)")
+
+                                styled_sales = paged_sales.style.format({
+                                    "selling_price": "{:,.2f}",
+                                    "total_sale": "{:,.2f}",
+                                    "cost": "{:,.2f}",
+                                    "profit": "{:,.2f}"
+                                })
+                                st.dataframe(styled_sales, width='stretch')
+
+                                csv_sales = sales_df.to_csv(index=False)
+                                st.download_button("Download Sales CSV", data=csv_sales, file_name="sales.csv", mime="text/csv")
+                            else:
+                                st.info("No sales recorded yet.")
+                            st.success(msg)
 
     # ---------------- PROFIT/LOSS REPORT ----------------
     elif menu == "Profit/Loss Report":
         st.title("Profit/Loss Report")
-        sales_df = view_sales()
-        if sales_df.empty:
-            st.warning("No sales data available.")
+        today = date.today()
+        col1, col2 = st.columns(2)
+        start_date = col1.date_input("Start Date", value=today.replace(day=1))
+        end_date = col2.date_input("End Date", value=today)
+        group_by = st.radio("Group by", PNL_GROUPS, index=0, horizontal=True, format_func=str.title)
+        if start_date > end_date:
+            st.error("Start date must be on or before end date.")
         else:
-            total_sales = sales_df['total_sale'].sum()
-            total_cost = sales_df['cost'].sum()
-            total_profit = sales_df['profit'].sum()
-            st.metric("Total Sales", f"${total_sales:,.2f}")
-            st.metric("Total Cost", f"${total_cost:,.2f}")
-            st.metric("Total Profit", f"${total_profit:,.2f}")
-            paged_sales, total_pages = paginate_dataframe(sales_df, page_size=20)
-            st.write(f"Showing {len(paged_sales)} rows (Page size: 20)")
-            st.dataframe(paged_sales)
-            csv_sales = sales_df.to_csv(index=False)
-            st.download_button("Download Sales CSV", data=csv_sales, file_name="sales.csv", mime="text/csv")
+            # ✅ Aggregated in the database; only one row per group is downloaded
+            pnl_df = pnl_report(start_date, end_date, group_by)
+            if pnl_df.empty:
+                st.warning("No sales in this period.")
+            else:
+                col1, col2, col3 = st.columns(3)
+                col1.metric("Total Sales", f"PHP {pnl_df['total_sale'].sum():,.2f}")
+                col2.metric("Total Cost", f"PHP {pnl_df['cost'].sum():,.2f}")
+                col3.metric("Total Profit", f"PHP {pnl_df['profit'].sum():,.2f}")
+                report_df = pnl_df.drop(columns=["key"]).rename(columns={"label": group_by})
+                if group_by in ("day", "week", "month"):
+                    st.bar_chart(report_df.set_index(group_by)[["total_sale", "profit"]])
+                st.dataframe(report_df.style.format({
+                    "units": "{:,.0f}",
+                    "total_sale": "{:,.2f}",
+                    "cost": "{:,.2f}",
+                    "profit": "{:,.2f}"
+                }), width='stretch')
+                st.download_button(
+                    "Download P&L CSV",
+                    data=report_df.to_csv(index=False),
+                    file_name=f"pnl_{group_by}_{start_date}_{end_date}.csv",
+                    mime="text/csv"
+                )
+                excel_export("📊 Export Sales Lines to Excel", "sales", lambda: export_sales(start_date, end_date))
 
     # ---------------- CUSTOMER SOA ----------------
     elif menu == "Customer Statement of Account":
         st.title("Customer Statement of Account")
-        from fpdf.enums import XPos, YPos
         customers_df = view_customers()
 
         if customers_df.empty:
@@ -1060,6 +1473,35 @@ elif st.session_state.logged_in:
             start_date = st.date_input("Start Date", value=start_of_month)
             end_date = st.date_input("End Date", value=end_of_month)
 
+            # ✅ Balance and aging come precomputed from the customer ledger
+            aging_df = view_receivables_summary(customer_id)
+            aging = aging_df.iloc[0] if not aging_df.empty else pd.Series({"balance": 0, "current": 0, "days_30": 0, "days_60": 0, "days_90": 0})
+            col1, col2, col3, col4, col5 = st.columns(5)
+            col1.metric("Balance Due", f"{aging['balance']:,.2f}")
+            col2.metric("Current", f"{aging['current']:,.2f}")
+            col3.metric("31-60 Days", f"{aging['days_30']:,.2f}")
+            col4.metric("61-90 Days", f"{aging['days_60']:,.2f}")
+            col5.metric("Over 90 Days", f"{aging['days_90']:,.2f}")
+
+            opening_balance, ledger_df = get_statement_of_account(customer_id, start_date, end_date)
+            closing_balance = ledger_df["balance"].iloc[-1] if not ledger_df.empty else opening_balance
+            st.subheader("Account Activity")
+            st.write(f"Opening Balance: PHP {opening_balance:,.2f} | Closing Balance: PHP {closing_balance:,.2f}")
+            if not ledger_df.empty:
+                st.dataframe(ledger_df.style.format({
+                    "amount": "{:,.2f}",
+                    "open_amount": "{:,.2f}",
+                    "balance": "{:,.2f}"
+                }), width='stretch')
+
+            with st.expander("💵 Record Payment", expanded=False):
+                payment_amount = st.number_input("Payment Amount", min_value=0.0, format="%.2f")
+                payment_reference = st.text_input("Reference (OR / check no.)")
+                if st.button("Save Payment") and payment_amount > 0:
+                    record_payment(customer_id, payment_amount, payment_reference)
+                    st.success(f"Payment of PHP {payment_amount:,.2f} recorded.")
+                    st.rerun()
+
             # ✅ Use helper function from db_supabase.py
             sales_customer = get_sales_by_customer(customer_id, start_date, end_date)
 
@@ -1086,54 +1528,16 @@ elif st.session_state.logged_in:
                 st.download_button("Download Sales CSV", data=csv_sales, file_name="sales_customer.csv", mime="text/csv")
 
                 if st.button("Generate SOA"):
-                    from fpdf import FPDF
-
-                    filename = f"SOA_{customer_id}_{start_date}_{end_date}.pdf"
-                    pdf = FPDF()
-                    pdf.add_page()
-
-                    # --- Logo ---
-                    pdf.image("KPrime.jpg", x=10, y=8, w=30)
-
-                    # --- Company Name & Address ---
-                    pdf.set_font("Helvetica", 'B', 14)
-                    pdf.cell(0, 10, "KPrime Food Solutions", new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="C")
-
-                    pdf.set_font("Helvetica", size=10)
-                    pdf.multi_cell(0, 5, "Blk 3 Lot 5 West Wing Villas, North Belton QC\nPhone: +63 995 744 9953\nEmail: kprimefoodinc@gmail.com", align="C")
-                    pdf.ln(10)
-
-                    pdf.set_font("Helvetica", size=12)
-                    pdf.cell(200, 10, text=f"Statement of Account", new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="C")
-                    pdf.cell(200, 10, text=f"Customer: {customer_name} (ID: {customer_id})", new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="C")
-                    pdf.cell(200, 10, text=f"Period: {start_date} to {end_date}", new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="C")
-                    pdf.ln(10)
-
-                    # Table header
-                    pdf.set_font("Helvetica", 'B', 10)
-                    pdf.cell(20, 10, "Date", 1, align="C")
-                    pdf.cell(60, 10, "Item", 1, align="L")
-                    pdf.cell(20, 10, "Qty", 1, align="C")
-                    pdf.cell(40, 10, "Total Sale", 1, align="R")
-                    pdf.cell(40, 10, "Profit", 1, align="R")
-                    pdf.ln()
-
-                    # Table rows
-                    pdf.set_font("Helvetica", size=10)
-                    for _, row in sales_customer.iterrows():
-                        pdf.cell(20, 10, str(row.get("date", "")), 1, align="C")
-                        pdf.cell(60, 10, str(row.get("item_name", "")), 1, align="L")
-                        pdf.cell(20, 10, str(row.get("quantity", "")), 1, align="C")
-                        pdf.cell(40, 10, f"{row.get('total_sale', 0):,.2f}", 1, align="R")
-                        pdf.cell(40, 10, f"{row.get('profit', 0):,.2f}", 1, align="R")
-                        pdf.ln()
-
-                    # ✅ Save PDF properly
-                    pdf.output(filename)
+                    pdf_bytes = build_soa_pdf(
+                        customer_id, customer_name, start_date, end_date, sales_customer,
+                        opening_balance, closing_balance, aging
+                    )
+                    st.download_button(
+                        "Download SOA PDF", data=pdf_bytes,
+                        file_name=soa_filename(customer_id, start_date, end_date), mime="application/pdf"
+                    )
 
-                    # ✅ Get bytes without deprecated dest
-                    pdf_bytes = bytes(pdf.output())
-                    st.download_button("Download SOA PDF", data=pdf_bytes, file_name=filename, mime="application/pdf")
+            excel_export("📊 Export SOA to Excel", "soa", lambda: export_soa(customer_id, customer_name, start_date, end_date))
 
 
     elif menu == "Customer Statement of Account2":
@@ -0,0 +1,147 @@
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from db_supabase import DEFAULT_BRANCH, current_branch, supabase, view_audit_log
+
+# ---------------- SETTINGS ----------------
+AUDIT_ARCHIVE_DIR = os.environ.get(
+    "KPRIME_AUDIT_ARCHIVE_DIR", os.path.join(os.path.expanduser("~"), ".kprime", "audit_archive")
+)
+AUDIT_RETENTION_DAYS = 90   # rows older than this move to the cold archive
+ARCHIVE_PAGE_SIZE = 1000    # rows fetched (and deleted) per round trip
+INDEX_FILE = "_index.json"
+
+# ---------------- PARTITION INDEX ----------------
+def _index_path():
+    return os.path.join(AUDIT_ARCHIVE_DIR, INDEX_FILE)
+
+def load_archive_index() -> list:
+    """List of partition files with their month, row count and timestamp bounds."""
+    try:
+        with open(_index_path(), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+def _save_archive_index(index):
+    # Write to a temp file first so a crash never leaves a half-written index
+    tmp_path = _index_path() + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=1)
+    os.replace(tmp_path, _index_path())
+
+def _to_utc(value):
+    ts = pd.Timestamp(value)
+    return ts.tz_localize("UTC") if ts.tzinfo is None else ts.tz_convert("UTC")
+
+# ---------------- ARCHIVING ----------------
+def _write_partitions(df, index):
+    """Write one page of audit rows as one Parquet file per month."""
+    df = df.copy()
+    df["timestamp"] = pd.to_datetime(df["timestamp"], utc=True, format="ISO8601")
+    for month, part in df.groupby(df["timestamp"].dt.strftime("%Y-%m")):
+        month_dir = os.path.join(AUDIT_ARCHIVE_DIR, month)
+        os.makedirs(month_dir, exist_ok=True)
+        filename = f"part-{int(part['id'].min())}-{int(part['id'].max())}.parquet"
+        table = pa.Table.from_pandas(part.reset_index(drop=True), preserve_index=False)
+        pq.write_table(table, os.path.join(month_dir, filename), compression="zstd")
+        index.append({
+            "path": f"{month}/{filename}",
+            "month": month,
+            "rows": len(part),
+            "min_ts": part["timestamp"].min().isoformat(),
+            "max_ts": part["timestamp"].max().isoformat()
+        })
+
+def archive_audit_log(retention_days: int = AUDIT_RETENTION_DAYS) -> dict:
+    """
+    Move audit rows older than retention_days into monthly Parquet partitions.
+    Each page is written to disk and indexed before it is deleted from the
+    database, so an interrupted run can only leave duplicates (dropped on read),
+    never lose rows. This is maintenance over every branch; archived rows keep
+    their branch column and reads filter on it.
+    Rows that moved stock (qty_delta set) stay in the table whatever their
+    age: stock_at replays them from the snapshots in the database.
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=retention_days)).isoformat()
+    os.makedirs(AUDIT_ARCHIVE_DIR, exist_ok=True)
+    index = load_archive_index()
+    archived = 0
+    partitions_before = len(index)
+
+    while True:
+        res = (
+            supabase.table("audit_log")
+            .select("*")
+            .lt("timestamp", cutoff)
+            .is_("qty_delta", "null")
+            .order("id")
+            .limit(ARCHIVE_PAGE_SIZE)
+            .execute()
+        )
+        if not res.data:
+            break
+        page = pd.DataFrame(res.data)
+        _write_partitions(page, index)
+        _save_archive_index(index)
+
+        # Rows are ordered by id, so this range covers exactly the page we wrote
+        (
+            supabase.table("audit_log")
+            .delete()
+            .gte("id", int(page["id"].min()))
+            .lte("id", int(page["id"].max()))
+            .lt("timestamp", cutoff)
+            .is_("qty_delta", "null")
+            .execute()
+        )
+        archived += len(page)
+        if len(page) < ARCHIVE_PAGE_SIZE:
+            break
+
+    return {"archived": archived, "partitions": len(index) - partitions_before, "cutoff": cutoff}
+
+# ---------------- QUERYING ----------------
+def read_archived_audit_log(start_date, end_date) -> pd.DataFrame:
+    """
+    Read the current branch's cold audit rows in [start_date, end_date],
+    opening only overlapping partitions.
+    """
+    start, end = _to_utc(start_date), _to_utc(end_date)
+    paths = [
+        os.path.join(AUDIT_ARCHIVE_DIR, p["path"])
+        for p in load_archive_index()
+        if _to_utc(p["max_ts"]) >= start and _to_utc(p["min_ts"]) <= end
+    ]
+    if not paths:
+        return pd.DataFrame()
+    filters = [("timestamp", ">=", start), ("timestamp", "<=", end)]
+    frames = [pq.read_table(path, filters=filters).to_pandas() for path in paths]
+    cold_df = pd.concat(frames, ignore_index=True)
+    # Partitions written before branches existed hold only default-branch rows
+    if "branch" not in cold_df:
+        cold_df["branch"] = DEFAULT_BRANCH
+    return cold_df[cold_df["branch"].fillna(DEFAULT_BRANCH) == current_branch()].reset_index(drop=True)
+
+def query_audit_log(start_date=None, end_date=None) -> pd.DataFrame:
+    """
+    Audit rows from the live table plus, for a date range, the cold archive.
+    Without a range only the live (retention-window) rows are returned.
+    """
+    hot_df = view_audit_log(start_date, end_date)
+    if not (start_date and end_date):
+        return hot_df
+
+    cold_df = read_archived_audit_log(start_date, end_date)
+    if cold_df.empty:
+        return hot_df
+    if not hot_df.empty:
+        hot_df["timestamp"] = pd.to_datetime(hot_df["timestamp"], utc=True, format="ISO8601")
+    audit_df = pd.concat([hot_df, cold_df], ignore_index=True)
+    audit_df = audit_df.drop_duplicates(subset="id", keep="first")
+    return audit_df.sort_values("timestamp", ascending=False, ignore_index=True)
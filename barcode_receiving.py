@@ -0,0 +1,219 @@
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+import pandas as pd
+
+try:
+    from pyzbar.pyzbar import decode as zbar_decode
+except ImportError:  # pyzbar needs the zbar shared library (libzbar0 in packages.txt)
+    zbar_decode = None
+
+from db_supabase import current_branch, view_barcodes
+
+# ---------------- SETTINGS ----------------
+DECODE_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+VIDEO_FRAME_STEP = 5        # decode every Nth frame of a video
+DUPLICATE_FRAME_BITS = 6    # frames whose dHash differs by fewer bits are treated as the same view
+BARCODE_INDEX_TTL = 300     # seconds before the barcode → item index is reloaded
+TRACK_RADIUS = 0.1          # fraction of the frame diagonal a label may be off its predicted spot
+TRACK_MAX_GAP = 3           # kept frames a label may go undecoded before it counts as a new carton
+MOTION_WIDTH = 320          # frames are shrunk to this width to estimate the camera's pan
+VIDEO_TYPES = {".mp4", ".mov", ".avi", ".mkv", ".webm"}
+
+# ---------------- DECODING (runs in worker processes) ----------------
+def _decode_frame(gray):
+    """Decode every barcode in one grayscale frame; returns the payload strings."""
+    return [symbol.data.decode("utf-8", errors="replace") for symbol in zbar_decode(gray)]
+
+def _decode_frame_labels(gray):
+    """Decode one video frame; returns (payload, x, y) per label, at the label's centre."""
+    return [
+        (symbol.data.decode("utf-8", errors="replace"), symbol.rect.left + symbol.rect.width / 2, symbol.rect.top + symbol.rect.height / 2)
+        for symbol in zbar_decode(gray)
+    ]
+
+def _decode_image_bytes(data):
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return []
+    return _decode_frame(image)
+
+# ---------------- FRAME DE-DUPLICATION ----------------
+def _dhash(gray) -> int:
+    """64-bit difference hash: compares neighbouring pixels of a 9x8 thumbnail."""
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def _distinct_video_frames(path):
+    """Yield sampled grayscale frames, skipping ones that look like the last kept frame."""
+    capture = cv2.VideoCapture(path)
+    last_hash = None
+    index = 0
+    try:
+        while True:
+            ok = capture.grab()
+            if not ok:
+                break
+            if index % VIDEO_FRAME_STEP == 0:
+                ok, frame = capture.retrieve()
+                if ok:
+                    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                    frame_hash = _dhash(gray)
+                    if last_hash is None or bin(frame_hash ^ last_hash).count("1") >= DUPLICATE_FRAME_BITS:
+                        last_hash = frame_hash
+                        yield gray
+            index += 1
+    finally:
+        capture.release()
+
+# ---------------- CARTON TRACKING ----------------
+def _pan(previous, gray):
+    """Shift (dx, dy) of the picture between two frames, in full-size pixels."""
+    scale = gray.shape[1] / MOTION_WIDTH
+    size = (MOTION_WIDTH, max(1, round(gray.shape[0] / scale)))
+    (dx, dy), _ = cv2.phaseCorrelate(
+        np.float32(cv2.resize(previous, size, interpolation=cv2.INTER_AREA)),
+        np.float32(cv2.resize(gray, size, interpolation=cv2.INTER_AREA))
+    )
+    return dx * scale, dy * scale
+
+def count_video_cartons(frames, labels) -> dict:
+    """
+    Count cartons in a video from the labels decoded in its kept frames.
+    The camera's pan between consecutive frames is estimated, so every label
+    can be placed on one pallet-wide map; a label found near where a label
+    with the same payload was seen in the last few frames is the same carton,
+    otherwise it is another one. Identical cartons side by side therefore
+    count separately, while a carton seen in many frames counts once.
+    Returns {payload: cartons}.
+    """
+    tracks = []  # [payload, x, y, last frame seen] on the map
+    counts = {}
+    offset_x = offset_y = 0.0
+    previous = None
+    for n, (gray, found) in enumerate(zip(frames, labels)):
+        if previous is not None:
+            dx, dy = _pan(previous, gray)
+            offset_x, offset_y = offset_x + dx, offset_y + dy
+        previous = gray
+        radius = TRACK_RADIUS * float(np.hypot(*gray.shape))
+
+        # Closest pairs first; each track takes at most one label per frame
+        spots = [(payload, x - offset_x, y - offset_y) for payload, x, y in found]
+        pairs = sorted(
+            (np.hypot(track[1] - x, track[2] - y), s, t)
+            for s, (payload, x, y) in enumerate(spots)
+            for t, track in enumerate(tracks)
+            if track[0] == payload and 0 < n - track[3] <= TRACK_MAX_GAP + 1
+        )
+        matched_spots, matched_tracks = set(), set()
+        for distance, s, t in pairs:
+            if distance > radius or s in matched_spots or t in matched_tracks:
+                continue
+            matched_spots.add(s)
+            matched_tracks.add(t)
+            tracks[t][1:] = [spots[s][1], spots[s][2], n]
+        for s, (payload, x, y) in enumerate(spots):
+            if s not in matched_spots:
+                tracks.append([payload, x, y, n])
+                counts[payload] = counts.get(payload, 0) + 1
+    return counts
+
+# ---------------- BARCODE INDEX ----------------
+_index_lock = threading.Lock()
+_indexes = {}  # branch -> {"loaded_at", "codes"}
+
+def barcode_index(refresh: bool = False) -> dict:
+    """Cached {barcode: {item_name, category, units_per_carton}} of the current branch."""
+    with _index_lock:
+        index = _indexes.setdefault(current_branch(), {"loaded_at": 0.0, "codes": {}})
+        if refresh or time.monotonic() - index["loaded_at"] > BARCODE_INDEX_TTL:
+            df = view_barcodes()
+            index["codes"] = {} if df.empty else df.set_index("barcode")[["item_name", "category", "units_per_carton"]].to_dict("index")
+            index["loaded_at"] = time.monotonic()
+        return index["codes"]
+
+def _product_code(payload, codes):
+    """Exact match first, then the GTIN inside a GS1 payload starting with AI (01)."""
+    if payload in codes:
+        return payload
+    if payload.startswith("01") and len(payload) >= 16 and payload[2:16].isdigit():
+        gtin = payload[2:16]
+        for candidate in (gtin, gtin.lstrip("0")):
+            if candidate in codes:
+                return candidate
+    return None
+
+# ---------------- PIPELINE ----------------
+def scan_uploads(files):
+    """
+    Decode a batch of uploaded photos and/or videos in a process pool.
+    Photos count every label found; a video counts each carton once however
+    many frames it shows up in (see count_video_cartons).
+    Returns (received DataFrame, list of unresolved payloads, stats dict).
+    """
+    if zbar_decode is None:
+        raise RuntimeError("Barcode scanning needs pyzbar and the zbar library (libzbar0).")
+
+    started = time.perf_counter()
+    photo_payloads, video_cartons = [], {}
+    frames = 0
+    with ProcessPoolExecutor(max_workers=DECODE_WORKERS) as pool:
+        photos = [f for f in files if os.path.splitext(f.name)[1].lower() not in VIDEO_TYPES]
+        videos = [f for f in files if os.path.splitext(f.name)[1].lower() in VIDEO_TYPES]
+
+        for payloads in pool.map(_decode_image_bytes, [f.getvalue() for f in photos], chunksize=4):
+            photo_payloads.extend(payloads)
+        frames += len(photos)
+
+        for video in videos:
+            # OpenCV reads videos from a path, not from memory
+            suffix = os.path.splitext(video.name)[1]
+            with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+                tmp.write(video.getvalue())
+            try:
+                kept = list(_distinct_video_frames(tmp.name))
+            finally:
+                os.remove(tmp.name)
+            frames += len(kept)
+            labels = list(pool.map(_decode_frame_labels, kept, chunksize=8))
+            for payload, count in count_video_cartons(kept, labels).items():
+                video_cartons[payload] = video_cartons.get(payload, 0) + count
+
+    codes = barcode_index()
+    cartons = {}
+    unresolved = []
+    sightings = [(payload, 1) for payload in photo_payloads] + sorted(video_cartons.items())
+    for payload, count in sightings:
+        code = _product_code(payload, codes)
+        if code is None:
+            unresolved.append(payload)
+        else:
+            cartons[code] = cartons.get(code, 0) + count
+
+    received = pd.DataFrame(
+        [
+            {
+                "barcode": code,
+                "item_name": codes[code]["item_name"],
+                "category": codes[code]["category"],
+                "cartons": count,
+                "quantity": count * int(codes[code]["units_per_carton"] or 1)
+            }
+            for code, count in cartons.items()
+        ],
+        columns=["barcode", "item_name", "category", "cartons", "quantity"]
+    )
+    stats = {
+        "files": len(files),
+        "frames_decoded": frames,
+        "labels": len(photo_payloads) + sum(video_cartons.values()),
+        "seconds": round(time.perf_counter() - started, 2)
+    }
+    return received, sorted(set(unresolved)), stats
@@ -0,0 +1,55 @@
+"""
+Time the JSON and CSV bulk read paths against a live table:
+
+    python bench_transfer.py sales --repeats 3
+
+Both paths page through the whole table and end in the same compact dtypes,
+so the difference is transfer + decoding only.
+"""
+import argparse
+import time
+
+import pandas as pd
+
+from db_supabase import supabase, read_table_csv, primary_key, CSV_PAGE_SIZE
+from table_dtypes import to_frame
+
+def read_table_json(table: str) -> pd.DataFrame:
+    """The supabase-py path: JSON rows -> list of dicts -> DataFrame."""
+    rows, start = [], 0
+    while True:
+        page = (
+            supabase.table(table).select("*").order(primary_key(table))
+            .range(start, start + CSV_PAGE_SIZE - 1).execute().data
+        )
+        rows.extend(page)
+        if len(page) < CSV_PAGE_SIZE:
+            break
+        start += CSV_PAGE_SIZE
+    return to_frame(table, rows)
+
+def benchmark(table: str, repeats: int = 3) -> pd.DataFrame:
+    results = []
+    for name, reader in (("json", read_table_json), ("csv", read_table_csv)):
+        for run in range(1, repeats + 1):
+            started = time.perf_counter()
+            df = reader(table)
+            results.append({
+                "format": name,
+                "run": run,
+                "rows": len(df),
+                "seconds": round(time.perf_counter() - started, 3),
+                "memory_mb": round(df.memory_usage(deep=True).sum() / 1e6, 2)
+            })
+    return pd.DataFrame(results)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark JSON vs CSV table reads")
+    parser.add_argument("table", nargs="?", default="sales")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    report = benchmark(args.table, args.repeats)
+    print(report.to_string(index=False))
+    print()
+    print(report.groupby("format")["seconds"].median().rename("median_seconds").to_string())
@@ -0,0 +1,95 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+# ---------------- SETTINGS ----------------
+TREND_MAX_POINTS = 500   # LTTB target for long time series
+FIGURE_CACHE_SIZE = 32   # figure specs kept per process
+TREND_FREQS = {"Day": "D", "Week": "W-MON", "Month": "MS"}
+
+_figure_cache = OrderedDict()
+_figure_cache_lock = threading.Lock()
+
+# ---------------- AGGREGATION ----------------
+def data_version(df: pd.DataFrame, columns) -> int:
+    """Cheap fingerprint of the columns a chart depends on."""
+    if df.empty:
+        return 0
+    return int(pd.util.hash_pandas_object(df[list(columns)], index=False).sum())
+
+def stock_by_category(items_df: pd.DataFrame) -> pd.DataFrame:
+    """One row per category instead of one per fridge row."""
+    return items_df.groupby("category", as_index=False)["quantity"].sum()
+
+def sales_trend(sales_df: pd.DataFrame, freq: str = "D") -> pd.DataFrame:
+    """Total sales and profit per day/week/month (freq is a pandas offset alias)."""
+    df = sales_df[["date", "total_sale", "profit"]].copy()
+    df["date"] = pd.to_datetime(df["date"], format="ISO8601", utc=True).dt.tz_localize(None)
+    return (
+        df.set_index("date")
+        .resample(freq)[["total_sale", "profit"]]
+        .sum()
+        .reset_index()
+    )
+
+def lttb(x, y, threshold: int):
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+    Keeps the first and last points and, from each bucket in between, the point
+    forming the largest triangle with the previous pick and the next bucket's mean.
+    Returns the indices of the kept points.
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    kept = np.empty(threshold, dtype=int)
+    kept[0], kept[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        areas = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(areas.argmax())
+        kept[i + 1] = a
+    return kept
+
+# ---------------- FIGURE CACHE ----------------
+def cached_figure(name: str, version, build):
+    """Return the figure for (name, version), building it only on a cache miss."""
+    key = (name, version)
+    with _figure_cache_lock:
+        if key in _figure_cache:
+            _figure_cache.move_to_end(key)
+            return _figure_cache[key]
+    fig = build()
+    with _figure_cache_lock:
+        _figure_cache[key] = fig
+        while len(_figure_cache) > FIGURE_CACHE_SIZE:
+            _figure_cache.popitem(last=False)
+    return fig
+
+def stock_by_category_figure(items_df: pd.DataFrame):
+    def build():
+        agg = stock_by_category(items_df)
+        return px.bar(agg, x='category', y='quantity', color='category', title="Stock by Category")
+    return cached_figure("stock_by_category", data_version(items_df, ["category", "quantity"]), build)
+
+def profit_trend_figure(sales_df: pd.DataFrame, period: str = "Day", max_points: int = TREND_MAX_POINTS):
+    def build():
+        trend = sales_trend(sales_df, TREND_FREQS[period])
+        if max_points and len(trend) > max_points:
+            kept = lttb(trend["date"].astype("int64"), trend["profit"], max_points)
+            trend = trend.iloc[kept]
+        return px.line(trend, x='date', y='profit', title=f"Profit Trend Over Time (per {period.lower()})")
+    version = (data_version(sales_df, ["date", "total_sale", "profit"]), period, max_points)
+    return cached_figure("profit_trend", version, build)
@@ -1,52 +1,354 @@
 import streamlit as st
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
+from postgrest.exceptions import APIError
 import pandas as pd
-from datetime import datetime
+import httpx
+import functools
+import heapq
+import inspect
+import io
+import random
+import threading
+import time
+import uuid
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, date, timedelta
+
+from offline_journal import OFFLINE_ENABLED, OfflineJournal, Replayer
+from resilience import BackendUnavailable, transport, with_idempotency_key
+from snapshot_cache import snapshots
+from table_dtypes import TABLE_DTYPES, compact_frame, to_frame
 
 # ---------------- SUPABASE CONNECTION ----------------
 SUPABASE_URL = st.secrets["supabase"]["url"]
 SUPABASE_KEY = st.secrets["supabase"]["service_role_key"]  # server-side only
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# ✅ Every request goes through the resilient transport: deadlines, retries,
+# hedged reads and a circuit breaker (see resilience.py)
+supabase: Client = create_client(
+    SUPABASE_URL, SUPABASE_KEY,
+    options=ClientOptions(httpx_client=httpx.Client(transport=transport, timeout=60))
+)
+
+# ---------------- BRANCHES ----------------
+BRANCHES = {
+    "kprime": {"name": "KPrime Food Solutions", "logo": "KPrime.jpg"},
+    "steakhaven": {"name": "Steak Haven", "logo": "SteakHaven.jpg"}
+}
+DEFAULT_BRANCH = "kprime"
+
+_branch_override = contextvars.ContextVar("branch_override", default=None)
+
+def current_branch() -> str:
+    """Branch every query is scoped to: use_branch() if active, else the one picked at login."""
+    branch = _branch_override.get()
+    if branch is None:
+        branch = st.session_state.get("branch", DEFAULT_BRANCH)
+    return branch
+
+@contextmanager
+def use_branch(branch: str):
+    """Scope the queries in a with-block to branch (scripts and background jobs)."""
+    token = _branch_override.set(branch)
+    try:
+        yield
+    finally:
+        _branch_override.reset(token)
+
+# Query builders that keep every read and write inside the current branch
+def _scoped(table, columns="*"):
+    return supabase.table(table).select(columns).eq("branch", current_branch())
+
+def _stamp(rows):
+    branch = current_branch()
+    if isinstance(rows, list):
+        return [{**row, "branch": branch} for row in rows]
+    return {**rows, "branch": branch}
+
+def _insert(table, rows):
+    return supabase.table(table).insert(_stamp(rows))
+
+def _upsert(table, rows, **kwargs):
+    return supabase.table(table).upsert(_stamp(rows), **kwargs)
+
+def _update(table, values):
+    return supabase.table(table).update(values).eq("branch", current_branch())
+
+def _delete(table):
+    return supabase.table(table).delete().eq("branch", current_branch())
+
+def _cache_key(table):
+    return f"{table}:{current_branch()}"
+
+# ---------------- OFFLINE WRITES ----------------
+# Sales, stock updates and customer edits made while the database is
+# unreachable go to a local SQLite journal and are acknowledged at once;
+# a background thread replays them in order when the database answers again.
+OFFLINE_ACK = "Saved offline; it will be sent to the database when the connection returns."
+
+offline_journal = OfflineJournal() if OFFLINE_ENABLED else None
+_offline_handlers = {}  # operation -> replay handler
+_offline_call = contextvars.ContextVar("offline_call", default=False)
+_replay_seen = {}  # item_id -> (quantity, when) as the replayer last left the row
+
+def _cached_quantities(item_ids):
+    """Quantities of item rows as last loaded (however old); None if never loaded."""
+    snapshot = snapshots.peek(_cache_key("items"))
+    if snapshot is None or snapshot.frame.empty or not item_ids:
+        return None
+    frame = snapshot.frame
+    rows = frame[frame["item_id"].isin(item_ids)]
+    return {str(int(r.item_id)): int(r.quantity) for r in rows.itertuples()} or None
+
+def _quantities(item_ids):
+    rows = _scoped("items", "item_id,quantity").in_("item_id", [int(i) for i in item_ids]).execute().data
+    return {str(r["item_id"]): r["quantity"] for r in rows}
+
+def _stock_drift(expected, queued_at):
+    """
+    Describe item rows changed by someone else since the write was queued.
+    Changes made by replaying earlier journal entries are not drift: for rows
+    the replayer touched after this entry was queued, the baseline is the
+    quantity it left them at.
+    """
+    if not expected:
+        return None
+    now = _quantities(expected)
+    changed = []
+    for item_id, quantity in expected.items():
+        seen = _replay_seen.get(item_id)
+        baseline = seen[0] if seen and seen[1] > queued_at else quantity
+        if now.get(item_id) != baseline:
+            changed.append(f"item {item_id}: {baseline} expected, {now.get(item_id, 'deleted')} found")
+    return "Stock changed while offline (" + "; ".join(changed) + ")" if changed else None
+
+def _already_applied(idempotency_key) -> bool:
+    """Whether a keyed write reached the database (its key row committed with it)."""
+    if not idempotency_key:
+        return False
+    return bool(supabase.table("idempotency_keys").select("key").eq("key", str(idempotency_key)).execute().data)
+
+def _keyed_rpc(name, params, idempotency_key):
+    """Call a write RPC that dedupes on p_idempotency_key; the transport may retry it."""
+    return with_idempotency_key(
+        supabase.rpc(name, {**params, "p_idempotency_key": idempotency_key}), idempotency_key
+    ).execute().data
+
+def _note_replayed(item_ids):
+    if item_ids:
+        now, stamp = _quantities(item_ids), datetime.now().isoformat()
+        for item_id in item_ids:
+            _replay_seen[item_id] = (now.get(item_id), stamp)
+    # A baseline only matters to pending entries queued before it was noted
+    oldest = offline_journal.pending(limit=1)
+    if not oldest:
+        _replay_seen.clear()
+        return
+    for item_id, (_, when) in list(_replay_seen.items()):
+        if when <= oldest[0]["queued_at"]:
+            del _replay_seen[item_id]
+
+def offline_capable(ack, watch=None, verify=None, keyed=False):
+    """
+    Journal a write instead of failing when the database is unavailable.
+      ack(params)     - what the function returns when the write was queued
+      watch(params)   - item ids whose cached quantities are recorded with the
+                        entry; if they moved by replay time the entry is held
+                        for review instead of being written
+      verify(params, result) - (status, detail) for a replayed result, or None if fine
+      keyed           - fill in idempotency_key before the first attempt; the
+                        function passes it to an RPC that records it with the write
+    A live call that fails with BackendUnavailable may still have been applied
+    (the response was lost), so it is journaled and replayed with the same key;
+    the database then returns the first result instead of writing again.
+    Unkeyed writes must be idempotent by themselves (a delete, an update to
+    fixed values). Writes also queue while older entries are still pending,
+    to keep their order.
+    """
+    def decorate(fn):
+        signature = inspect.signature(fn)
+
+        def replay(branch, params, expected, queued_at):
+            with use_branch(branch):
+                token = _offline_call.set(True)
+                try:
+                    # A write that already landed is repeated (a no-op) to get its result
+                    if not _already_applied(params.get("idempotency_key")):
+                        drift = _stock_drift(expected, queued_at)
+                        if drift:
+                            return "held", drift
+                    result = fn(**params)
+                    _note_replayed(expected or ())
+                finally:
+                    _offline_call.reset(token)
+            return (verify(params, result) if verify else None) or ("done", None)
+
+        _offline_handlers[fn.__name__] = replay
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if offline_journal is None or _offline_call.get():
+                return fn(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            params = dict(bound.arguments)
+            if keyed and not params.get("idempotency_key"):
+                params["idempotency_key"] = str(uuid.uuid4())
+
+            if not offline_journal.pending_count():
+                token = _offline_call.set(True)
+                try:
+                    return fn(**params)
+                except BackendUnavailable:
+                    pass
+                finally:
+                    _offline_call.reset(token)
+            expected = _cached_quantities(watch(params)) if watch else None
+            offline_journal.enqueue(fn.__name__, current_branch(), params, expected)
+            replayer.wake()
+            return ack(params)
+        return wrapper
+    return decorate
+
+def pending_writes() -> int:
+    """Writes waiting in the offline journal."""
+    return offline_journal.pending_count() if offline_journal is not None else 0
+
+def view_offline_journal() -> pd.DataFrame:
+    """Journal entries that are pending or need review."""
+    return offline_journal.entries() if offline_journal is not None else pd.DataFrame()
+
+def resolve_offline_entry(seq: int):
+    offline_journal.resolve(seq)
+
+def release_offline_entry(seq: int):
+    """Apply a held entry as it was queued, despite the stock having changed."""
+    offline_journal.release(seq)
+    replayer.wake()
+
+def sync_offline_writes() -> int:
+    """Replay pending writes now; returns how many were settled."""
+    return replayer.replay() if offline_journal is not None else 0
+
+replayer = Replayer(offline_journal, _offline_handlers) if offline_journal is not None else None
+if replayer is not None:
+    replayer.start()
+
+# ---------------- COLUMNAR (CSV) READS ----------------
+BULK_READ_FORMAT = "csv"  # "json" goes back to the supabase-py row-dict path
+CSV_PAGE_SIZE = 1000      # PostgREST max-rows on Supabase
+PRIMARY_KEYS = {"items": "item_id"}  # tables not keyed by id
+
+def primary_key(table: str) -> str:
+    return PRIMARY_KEYS.get(table, "id")
+
+_rest = httpx.Client(
+    base_url=f"{SUPABASE_URL}/rest/v1",
+    headers={"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}", "Accept": "text/csv"},
+    timeout=60,
+    transport=transport
+)
+
+def _rows_in(content_range: str) -> int:
+    # "0-999/*" -> 1000; an empty page comes back as "*/0" or "*/*"
+    span = content_range.split("/")[0]
+    if "-" not in span:
+        return 0
+    first, last = span.split("-")
+    return int(last) - int(first) + 1
+
+def stream_table_csv(table: str, params=(), order=None):
+    """
+    Yield the CSV text of every matching row, one Range page at a time; only
+    the first chunk carries the header line, so the chunks concatenate into one file.
+    params are PostgREST filters, e.g. [("timestamp", "gte.2026-01-01")].
+    Pages are ordered by order (default the primary key), with the primary
+    key as tie-breaker: without a total order Postgres may skip or repeat
+    rows between Range pages.
+    """
+    key = primary_key(table)
+    order = order or key
+    if key not in [term.split(".")[0] for term in order.split(",")]:
+        order = f"{order},{key}"
+    query = [("select", "*"), ("branch", f"eq.{current_branch()}"), *params, ("order", order)]
+    start = 0
+    while True:
+        res = _rest.get(
+            f"/{table}",
+            params=query,
+            headers={"Range-Unit": "items", "Range": f"{start}-{start + CSV_PAGE_SIZE - 1}"}
+        )
+        res.raise_for_status()
+        rows = _rows_in(res.headers.get("content-range", "*/*"))
+        if rows:
+            content = res.content
+            if start:
+                content = content.split(b"\n", 1)[1]  # every page repeats the header line
+            yield content if content.endswith(b"\n") else content + b"\n"
+        if rows < CSV_PAGE_SIZE:
+            break
+        start += CSV_PAGE_SIZE
+
+def read_table_csv(table: str, params=(), order=None) -> pd.DataFrame:
+    """
+    Read every matching row of a table as CSV and parse the pages once with
+    read_csv into the table's compact dtypes.
+    """
+    body = io.BytesIO()
+    for chunk in stream_table_csv(table, params, order):
+        body.write(chunk)
+
+    if not body.tell():
+        return pd.DataFrame()
+    body.seek(0)
+    # Categories are built while parsing; everything else is narrowed afterwards
+    categories = {c: "category" for c, kind in TABLE_DTYPES.get(table, {}).items() if kind == "category"}
+    return compact_frame(pd.read_csv(body, dtype=categories), table)
 
 # ---------------- DATABASE FUNCTIONS ----------------
-def view_items():
-    res = supabase.table("items").select("*").execute()
+def _load_table(table):
+    res = _scoped(table).execute()
     return pd.DataFrame(res.data)
 
+def table_snapshot(table):
+    """The shared snapshot of a branch table; its version changes on every reload."""
+    return snapshots.get(_cache_key(table), lambda: _load_table(table))
+
+def view_items():
+    # ✅ Shared across sessions; concurrent loads collapse into one query
+    return snapshots.get(_cache_key("items"), lambda: _load_table("items")).df()
+
 def delete_all_inventory():
-    supabase.table("items").delete().gte("item_id", 0).execute()
-    supabase.table("audit_log").insert({
-        "item_name": "ALL ITEMS",
-        "category": "ALL CATEGORIES",
-        "action": "Delete All Inventory",
-        "quantity": 0,
-        "unit_cost": 0.00,
-        "selling_price": 0.00,
-        "username": "System"
-    }).execute()    
+    # One audit row per stock row removed, in the same transaction as the delete,
+    # so stock history can be replayed across the wipe
+    supabase.rpc("delete_all_stock", {"p_branch": current_branch(), "p_username": "System"}).execute()
+    _lots().invalidate()
+    snapshots.invalidate(_cache_key("items"))
 
 def view_pricing():
-    res = supabase.table("pricing_tiers").select("*").execute()
-    return pd.DataFrame(res.data)
+    return snapshots.get(_cache_key("pricing_tiers"), lambda: _load_table("pricing_tiers")).df()
 
 def view_sales():
-    res = supabase.table("sales").select("*").execute()
-    return pd.DataFrame(res.data)
+    if BULK_READ_FORMAT == "csv":
+        return read_table_csv("sales", order="id")
+    res = _scoped("sales").execute()
+    return to_frame("sales", res.data)
 
 def view_sales_by_customer(customer_id):
-    res = supabase.table("sales").select("*").eq("customer_id", customer_id).execute()
-    return pd.DataFrame(res.data)
+    res = _scoped("sales").eq("customer_id", customer_id).execute()
+    return to_frame("sales", res.data)
 
 def view_customers():
-    res = supabase.table("customers").select("*").execute()
-    return pd.DataFrame(res.data)
+    return snapshots.get(_cache_key("customers"), lambda: _load_table("customers")).df()
 
 def delete_all_customers():
     # Explicitly delete all rows by using a condition that matches everything
-    supabase.table("customers").delete().gte("id", 0).execute()
+    _delete("customers").gte("id", 0).execute()
+    snapshots.invalidate(_cache_key("customers"))
 
     # Log the action
-    supabase.table("audit_log").insert({
+    _insert("audit_log", {
         "item_name": "ALL CUSTOMERS",
         "category": "N/A",
         "action": "Delete All Customers",
@@ -57,121 +359,430 @@ def delete_all_customers():
     }).execute()
 
 def view_sales_by_customers(customer_id=None):
-    query = supabase.table("sales").select("*")
+    query = _scoped("sales")
     if customer_id:
         query = query.eq("customer_id", customer_id)
     res = query.execute()
-    return pd.DataFrame(res.data)
+    return to_frame("sales", res.data)
 
 def view_audit_log(start_date=None, end_date=None):
-    query = supabase.table("audit_log").select("*").order("timestamp", desc=True)
+    if BULK_READ_FORMAT == "csv":
+        params = [("timestamp", f"gte.{start_date}"), ("timestamp", f"lte.{end_date}")] if start_date and end_date else []
+        return read_table_csv("audit_log", params, order="timestamp.desc,id.desc")
+    query = _scoped("audit_log").order("timestamp", desc=True)
     if start_date and end_date:
         query = query.gte("timestamp", str(start_date)).lte("timestamp", str(end_date))
     res = query.execute()
-    return pd.DataFrame(res.data)
+    return to_frame("audit_log", res.data)
+
+def view_price_history(item_id=None):
+    """Price changes in time order, optionally for one item."""
+    query = _scoped("price_history").order("timestamp")
+    if item_id:
+        query = query.eq("item_id", item_id)
+    res = query.execute()
+    return to_frame("price_history", res.data)
 
 def get_po_sequence(order_date_sql: str) -> int:
-    """Fetch or increment PO sequence for a given date."""
-    result = supabase.table("po_sequence").select("seq").eq("date", order_date_sql).execute()
-    if result.data:
-        seq = result.data[0]["seq"] + 1
-        supabase.table("po_sequence").update({"seq": seq}).eq("date", order_date_sql).execute()
-    else:
-        seq = 1
-        supabase.table("po_sequence").insert({"date": order_date_sql, "seq": seq}).execute()
-    return seq
+    """Next PO sequence number for a given date (see PoSequenceAllocator)."""
+    return po_sequence.next(order_date_sql)
+
+def reserve_po_block(order_date_sql: str, count: int) -> list:
+    """
+    Reserve count PO numbers for a date in one round trip, for batch PO runs.
+    Following get_po_sequence() calls hand them out without touching the server.
+    """
+    return po_sequence.prefetch(order_date_sql, count)
 
 def get_customer(customer_id: int) -> dict:
     """Fetch customer details by ID."""
-    result = supabase.table("customers").select("*").eq("id", customer_id).execute()
+    result = _scoped("customers").eq("id", customer_id).execute()
     if result.data:
         return result.data[0]
     return {}
 
+# ---------------- PO SEQUENCE ----------------
+PO_SEQUENCE_BLOCK_SIZE = 1  # numbers reserved per round trip when the local block runs out
+
+class PoSequenceAllocator:
+    """
+    Hands out per-branch, per-date PO numbers from blocks reserved atomically
+    on the server. Numbers left in a block when the process exits are skipped,
+    never reused.
+    """
+
+    def __init__(self, block_size=PO_SEQUENCE_BLOCK_SIZE):
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._held = {}  # (branch, date) -> deque of reserved, unused numbers
+
+    def _reserve(self, key, count):
+        branch, order_date_sql = key
+        last = supabase.rpc("reserve_po_sequence", {"p_branch": branch, "p_date": order_date_sql, "p_count": count}).execute().data
+        self._held.setdefault(key, deque()).extend(range(last - count + 1, last + 1))
+
+    def next(self, order_date_sql: str) -> int:
+        key = (current_branch(), order_date_sql)
+        with self._lock:
+            if not self._held.get(key):
+                self._reserve(key, self.block_size)
+            return self._held[key].popleft()
+
+    def prefetch(self, order_date_sql: str, count: int) -> list:
+        """Make sure at least count numbers are held locally; return the held numbers."""
+        key = (current_branch(), order_date_sql)
+        with self._lock:
+            held = len(self._held.get(key, ()))
+            if held < count:
+                self._reserve(key, count - held)
+            return list(self._held[key])
+
+po_sequence = PoSequenceAllocator()
+
+# ---------------- STOCK CONCURRENCY ----------------
+STOCK_CAS_MAX_RETRIES = 5
+STOCK_CAS_BACKOFF = 0.02  # seconds, multiplied by the attempt number
+
+_stock_cas_lock = threading.Lock()
+_stock_cas_metrics = {"attempts": 0, "conflicts": 0, "exhausted": 0}
+
+class StockConflictError(Exception):
+    """Raised when a stock row keeps changing under us and retries run out."""
+
+def _count_cas(key, n=1):
+    with _stock_cas_lock:
+        _stock_cas_metrics[key] += n
+
+def get_stock_cas_metrics() -> dict:
+    """Return a copy of this process's stock compare-and-swap counters."""
+    with _stock_cas_lock:
+        return dict(_stock_cas_metrics)
+
+def adjust_item_quantity(item_id, delta, current=None, clamp=False):
+    """
+    Add delta to an item row's quantity with a compare-and-swap on its version.
+    If clamp is set, a deduction is limited to what the row holds.
+    Returns (applied_delta, updated_row); updated_row is None if the row is gone.
+    Raises StockConflictError once STOCK_CAS_MAX_RETRIES attempts have conflicted.
+    """
+    for attempt in range(STOCK_CAS_MAX_RETRIES):
+        if current is None:
+            res = _scoped("items").eq("item_id", item_id).execute()
+            if not res.data:
+                return 0, None
+            current = res.data[0]
+
+        applied = delta
+        if clamp and current["quantity"] + delta < 0:
+            applied = -current["quantity"]
+        if applied == 0:
+            return 0, current
+
+        version = current.get("version", 0)
+        _count_cas("attempts")
+        res = _update("items", {
+            "quantity": current["quantity"] + applied,
+            "version": version + 1
+        }).eq("item_id", item_id).eq("version", version).execute()
+        if res.data:
+            snapshots.invalidate(_cache_key("items"))
+            return applied, res.data[0]
+
+        # Someone else changed the row since we read it → re-read and retry
+        _count_cas("conflicts")
+        current = None
+        time.sleep(random.uniform(0, STOCK_CAS_BACKOFF * (attempt + 1)))
+
+    _count_cas("exhausted")
+    raise StockConflictError(
+        f"Stock for item {item_id} kept changing; gave up after {STOCK_CAS_MAX_RETRIES} attempts."
+    )
+
+# ---------------- LOT / EXPIRY (FEFO) ----------------
+LOT_INDEX_TTL = 60  # seconds before an item's lots are reloaded from the database
+NO_EXPIRY = "9999-12-31"  # sorts undated lots after every dated one
+
+class LotIndex:
+    """
+    Per-item min-heaps of one branch's stock rows keyed by (expiry_date, item_id).
+    Heaps are loaded lazily per item name and kept in step with our own writes;
+    rows that have run out are dropped lazily when they reach the top of a heap.
+    A row has at most one live heap entry (the one in _queued); entries left
+    behind by a changed expiry or a re-push are skipped and dropped.
+    """
+
+    def __init__(self, branch, ttl=LOT_INDEX_TTL):
+        self.branch = branch
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._heaps = {}      # item_name -> [(expiry, item_id)]
+        self._rows = {}       # item_id -> latest known row
+        self._loaded_at = {}  # item_name -> time.monotonic() of last load
+        self._queued = {}     # item_id -> (item_name, heap entry) of its live entry
+        self._all_loaded_at = 0.0
+
+    @staticmethod
+    def _key(row):
+        return (row.get("expiry_date") or NO_EXPIRY, row["item_id"])
+
+    def _build(self, item_name, rows):
+        heap = []
+        for row in rows:
+            self._rows[row["item_id"]] = row
+            self._queued[row["item_id"]] = (item_name, self._key(row))
+            heap.append(self._key(row))
+        heapq.heapify(heap)
+        self._heaps[item_name] = heap
+        self._loaded_at[item_name] = time.monotonic()
+
+    def _heap_for(self, item_name):
+        if time.monotonic() - self._loaded_at.get(item_name, 0.0) > self.ttl:
+            rows = (
+                supabase.table("items").select("*")
+                .eq("branch", self.branch).eq("item_name", item_name).gt("quantity", 0)
+                .execute().data
+            )
+            self._build(item_name, rows)
+        return self._heaps[item_name]
+
+    def _load_all(self):
+        if time.monotonic() - self._all_loaded_at <= self.ttl:
+            return
+        rows = supabase.table("items").select("*").eq("branch", self.branch).gt("quantity", 0).execute().data
+        by_name = {}
+        for row in rows:
+            by_name.setdefault(row["item_name"], []).append(row)
+        self._heaps.clear()
+        self._loaded_at.clear()
+        self._queued.clear()
+        for item_name, item_rows in by_name.items():
+            self._build(item_name, item_rows)
+        self._all_loaded_at = time.monotonic()
+
+    def _live(self, entry, item_name, overlay=None):
+        row = (overlay or {}).get(entry[1]) or self._rows.get(entry[1])
+        if row is None or row["quantity"] <= 0 or row["item_name"] != item_name:
+            return None
+        return row
+
+    def plan(self, item_name, quantity, overlay=None):
+        """
+        Pick lots for quantity in first-expiry-first-out order without writing.
+        Returns a list of (row, take) pairs; pops k lots and pushes back the
+        live ones, so a plan costs O(k log n). overlay maps item_id to rows
+        that replace the known ones (stock a pending batch will leave).
+        """
+        with self._lock:
+            heap = self._heap_for(item_name)
+            kept, picks = [], []
+            remaining = quantity
+            while heap and remaining > 0:
+                entry = heapq.heappop(heap)
+                if self._queued.get(entry[1]) != (item_name, entry):
+                    continue  # superseded by the row's newer entry
+                row = self._live(entry, item_name, overlay)
+                if row is None:
+                    if overlay and entry[1] in overlay:
+                        kept.append(entry)  # used up by the batch only, still live here
+                    else:
+                        self._queued.pop(entry[1], None)  # exhausted or moved → drop for good
+                    continue
+                kept.append(entry)
+                take = min(row["quantity"], remaining)
+                picks.append((row, take))
+                remaining -= take
+            for entry in kept:
+                heapq.heappush(heap, entry)
+            return picks
+
+    def update(self, row):
+        """Record the latest state of a row after we wrote it."""
+        with self._lock:
+            self._rows[row["item_id"]] = row
+            heap = self._heaps.get(row["item_name"])
+            if heap is None or row["quantity"] <= 0:
+                return
+            queued = (row["item_name"], self._key(row))
+            if self._queued.get(row["item_id"]) != queued:
+                heapq.heappush(heap, queued[1])
+                self._queued[row["item_id"]] = queued
+
+    def row(self, item_id):
+        with self._lock:
+            return self._rows.get(item_id)
+
+    def refresh(self, item_names):
+        """Force the given items to be reloaded on their next plan()."""
+        with self._lock:
+            for item_name in item_names:
+                self._loaded_at.pop(item_name, None)
+
+    def discard(self, item_id):
+        with self._lock:
+            self._rows.pop(item_id, None)
+            self._queued.pop(item_id, None)
+
+    def invalidate(self):
+        with self._lock:
+            self._heaps.clear()
+            self._rows.clear()
+            self._loaded_at.clear()
+            self._queued.clear()
+            self._all_loaded_at = 0.0
+
+    def near_expiry(self, days: int):
+        """
+        Lots expiring within the given number of days, soonest first.
+        Walks each heap from the root and stops descending at the first node
+        past the cutoff, so only matching lots (and their direct children) are visited.
+        """
+        cutoff = (date.today() + timedelta(days=days)).isoformat()
+        found = []
+        with self._lock:
+            self._load_all()
+            for item_name, heap in self._heaps.items():
+                stack = [0] if heap else []
+                while stack:
+                    i = stack.pop()
+                    entry = heap[i]
+                    if entry[0] > cutoff:
+                        continue
+                    row = self._live(entry, item_name) if self._queued.get(entry[1]) == (item_name, entry) else None
+                    if row is not None:
+                        found.append(row)
+                    for child in (2 * i + 1, 2 * i + 2):
+                        if child < len(heap):
+                            stack.append(child)
+        return sorted(found, key=self._key)
+
+_lot_indexes = {}  # branch -> LotIndex
+_lot_indexes_lock = threading.Lock()
+
+def _lots() -> LotIndex:
+    """The FEFO index of the current branch."""
+    branch = current_branch()
+    with _lot_indexes_lock:
+        if branch not in _lot_indexes:
+            _lot_indexes[branch] = LotIndex(branch)
+        return _lot_indexes[branch]
+
+def near_expiry_report(days: int = 7) -> pd.DataFrame:
+    """Stock lots expiring within the next `days` days, soonest first."""
+    df = pd.DataFrame(_lots().near_expiry(days))
+    if not df.empty:
+        df["days_left"] = (pd.to_datetime(df["expiry_date"]) - pd.Timestamp(date.today())).dt.days
+    return df
+
+# ---------------- MOVING-AVERAGE COST ----------------
+# item_costs holds units on hand and their average unit cost per item_name;
+# a trigger on items keeps on_hand current and receive_stock folds each
+# receipt into the average in the same transaction, so sales can price their
+# cost when written. Only units received with a cost (costed_units) weigh in
+# the average; stock of unknown cost does not drag it towards zero.
+def _unit_cost(line):
+    value = line.get("unit_cost")
+    if value is None or value != value or value == "":  # blank / NaN
+        return None
+    return float(value)
+
+def get_item_costs(item_names=None) -> dict:
+    """Average unit cost per item_name (0.0 where nothing was received with a cost)."""
+    query = _scoped("item_costs", "item_name,avg_cost")
+    if item_names is not None:
+        if not item_names:
+            return {}
+        query = query.in_("item_name", sorted(item_names))
+    return {r["item_name"]: float(r["avg_cost"] or 0.0) for r in query.execute().data}
+
+def view_item_costs():
+    res = _scoped("item_costs", "item_name,on_hand,costed_units,avg_cost,updated_at").order("item_name").execute()
+    return pd.DataFrame(res.data, columns=["item_name", "on_hand", "costed_units", "avg_cost", "updated_at"])
+
 # ---------------- CRUD FUNCTIONS ----------------
-def add_or_update_item(item_id, item_name, category, quantity, fridge_no, user):
+def _stock_move(row, delta) -> dict:
+    """Audit fields saying which stock row moved and by how much (replayed by stock_at)."""
+    return {"item_id": row["item_id"], "fridge_no": str(row["fridge_no"]), "qty_delta": int(delta)}
+
+def _same_lot(row, lot_no, expiry_date):
+    return (row.get("lot_no") or None) == (lot_no or None) and \
+        (row.get("expiry_date") or None) == (expiry_date or None)
+
+@offline_capable(
+    ack=lambda params: None,
+    watch=lambda params: [int(params["item_id"])] if str(params["item_id"]).isdigit() else [],
+    keyed=True
+)
+def add_or_update_item(item_id, item_name, category, quantity, fridge_no, user, lot_no=None, expiry_date=None,
+                       unit_cost=None, idempotency_key=None):
     # Normalize fridge_no to int if possible
     try:
         fridge_no = int(fridge_no)
     except:
         pass
+    lot_no = lot_no.strip().upper() if lot_no else None
+    expiry_date = str(expiry_date) if expiry_date else None
 
     action = None
+    target = None  # existing row the quantity is added to; None → new row
 
     if item_id and item_id != "Add New":
         # Case 1: Existing item selected
-        existing = supabase.table("items").select("*").eq("item_id", item_id).execute()
+        existing = _scoped("items").eq("item_id", item_id).execute()
         if existing.data:
             current_record = existing.data[0]
-            current_qty = current_record["quantity"]
             current_fridge = current_record["fridge_no"]
 
-            if str(current_fridge) == str(fridge_no):
-                # Same fridge → add to existing quantity
-                new_qty = current_qty + quantity
-                supabase.table("items").update({
-                    "quantity": new_qty
-                }).eq("item_id", item_id).execute()
+            if str(current_fridge) == str(fridge_no) and _same_lot(current_record, lot_no, expiry_date):
+                # Same fridge and lot → add to existing quantity
+                target = current_record["item_id"]
                 action = "Update"
             else:
-                # Different fridge → create new item row
-                supabase.table("items").insert({
-                    "item_name": item_name,
-                    "category": category,
-                    "quantity": quantity,
-                    "fridge_no": fridge_no
-                }).execute()
-                action = "Add (New Fridge)"
+                # Different fridge or lot → create new item row
+                action = "Add (New Fridge)" if str(current_fridge) != str(fridge_no) else "Add (New Lot)"
         else:
             # No record found → insert new
-            supabase.table("items").insert({
-                "item_name": item_name,
-                "category": category,
-                "quantity": quantity,
-                "fridge_no": fridge_no
-            }).execute()
             action = "Add"
     else:
         # Case 2: New item/category entered
-        # ✅ Check if same item/category/fridge already exists
-        existing = (
-            supabase.table("items")
-            .select("*")
+        # ✅ Check if same item/category/fridge/lot already exists
+        query = (
+            _scoped("items")
             .eq("item_name", item_name)
             .eq("category", category)
             .eq("fridge_no", fridge_no)
-            .execute()
         )
+        query = query.eq("lot_no", lot_no) if lot_no else query.is_("lot_no", None)
+        query = query.eq("expiry_date", expiry_date) if expiry_date else query.is_("expiry_date", None)
+        existing = query.execute()
 
         if existing.data:
             # Update quantity instead of inserting duplicate
-            current_record = existing.data[0]
-            new_qty = current_record["quantity"] + quantity
-            supabase.table("items").update({
-                "quantity": new_qty
-            }).eq("item_id", current_record["item_id"]).execute()
+            target = existing.data[0]["item_id"]
             action = "Update Existing (Duplicate Prevented)"
         else:
             # Insert new record
-            supabase.table("items").insert({
-                "item_name": item_name,
-                "category": category,
-                "quantity": quantity,
-                "fridge_no": fridge_no
-            }).execute()
             action = "Add"
 
-    # Audit log entry
-    supabase.table("audit_log").insert({
-        "item_name": item_name,
-        "category": category,
-        "action": action,
-        "quantity": quantity,
-        "unit_cost": 0.0,
-        "selling_price": 0.0,
-        "username": user,
-        "timestamp": datetime.now().isoformat()
-    }).execute()
+    # ✅ Stock row and audit row in one keyed RPC: a retry or replay cannot add twice
+    unit_cost = _unit_cost({"unit_cost": unit_cost})
+    updated = _keyed_rpc("receive_stock", {
+        "p_lines": [{
+            "item_id": target,
+            "item_name": item_name,
+            "category": category,
+            "quantity": int(quantity),
+            "fridge_no": fridge_no,
+            "lot_no": lot_no,
+            "expiry_date": expiry_date,
+            "action": action,
+            "unit_cost": unit_cost,
+            "username": user
+        }],
+        "p_branch": current_branch()
+    }, idempotency_key or str(uuid.uuid4()))
+    for row in updated:
+        _lots().update(row)
+    snapshots.invalidate(_cache_key("items"))
 
 
 def add_or_update_item2(item_id, item_name, category, quantity, fridge_no, user):
@@ -183,22 +794,18 @@ def add_or_update_item2(item_id, item_name, category, quantity, fridge_no, user)
 
     # Case 1: If item_id provided, check if record exists
     if item_id and item_id != "Add New":
-        existing = supabase.table("items").select("*").eq("item_id", item_id).execute()
+        existing = _scoped("items").eq("item_id", item_id).execute()
         if existing.data:
             current_record = existing.data[0]
-            current_qty = current_record["quantity"]
             current_fridge = current_record["fridge_no"]
 
             if str(current_fridge) == str(fridge_no):
                 # Same fridge → add to existing quantity
-                new_qty = current_qty + quantity
-                supabase.table("items").update({
-                    "quantity": new_qty
-                }).eq("item_id", item_id).execute()
+                adjust_item_quantity(item_id, quantity, current=current_record)
                 action = "Update"
             else:
                 # Different fridge → create new item row
-                supabase.table("items").insert({
+                _insert("items", {
                     "item_name": item_name,
                     "category": category,
                     "quantity": quantity,
@@ -207,7 +814,7 @@ def add_or_update_item2(item_id, item_name, category, quantity, fridge_no, user)
                 action = "Add (New Fridge)"
         else:
             # No record found → insert new
-            supabase.table("items").insert({
+            _insert("items", {
                 "item_name": item_name,
                 "category": category,
                 "quantity": quantity,
@@ -216,7 +823,7 @@ def add_or_update_item2(item_id, item_name, category, quantity, fridge_no, user)
             action = "Add"
     else:
         # Case 2: New item
-        supabase.table("items").insert({
+        _insert("items", {
             "item_name": item_name,
             "category": category,
             "quantity": quantity,
@@ -225,7 +832,7 @@ def add_or_update_item2(item_id, item_name, category, quantity, fridge_no, user)
         action = "Add"
 
     # Audit log entry
-    supabase.table("audit_log").insert({
+    _insert("audit_log", {
         "item_name": item_name,
         "category": category,
         "action": action,
@@ -236,91 +843,401 @@ def add_or_update_item2(item_id, item_name, category, quantity, fridge_no, user)
         "timestamp": datetime.now().isoformat()
     }).execute()
 
-def delete_item(item_id, user):
-    res = supabase.table("items").select("*").eq("item_id", item_id).execute()
-    if res.data:
-        item_details = res.data[0]
-        supabase.table("audit_log").insert({
-            "item_name": item_details["item_name"],
-            "category": item_details["category"],
-            "action": "Delete",
-            "quantity": item_details["quantity"],
-            "unit_cost": 0.00,
-            "selling_price": 0.00,
+@offline_capable(ack=lambda params: None, keyed=True)
+def receive_stock_bulk(lines, fridge_no, user, lot_no=None, expiry_date=None, idempotency_key=None):
+    """
+    Receive many items at once as new lots in one fridge.
+    lines is a list of dicts with item_name, category, quantity and an optional
+    unit_cost (blank = received at the current average cost).
+    All stock rows and their audit rows go in one keyed receive_stock call.
+    Returns the inserted rows, or None if the receipt was saved offline.
+    """
+    try:
+        fridge_no = int(fridge_no)
+    except:
+        pass
+    lot_no = lot_no.strip().upper() if lot_no else f"RCV-{datetime.now():%Y%m%d-%H%M%S}"
+    expiry_date = str(expiry_date) if expiry_date else None
+    lines = [l for l in lines if int(l["quantity"]) > 0]
+    if not lines:
+        return []
+
+    inserted = _keyed_rpc("receive_stock", {
+        "p_lines": [{
+            "item_id": None,
+            "item_name": l["item_name"],
+            "category": l["category"],
+            "quantity": int(l["quantity"]),
+            "fridge_no": fridge_no,
+            "lot_no": lot_no,
+            "expiry_date": expiry_date,
+            "action": "Receive",
+            "unit_cost": _unit_cost(l),
             "username": user
-        }).execute()
-        supabase.table("items").delete().eq("item_id", item_id).execute()
+        } for l in lines],
+        "p_branch": current_branch()
+    }, idempotency_key or str(uuid.uuid4()))
+    for row in inserted:
+        _lots().update(row)
+    snapshots.invalidate(_cache_key("items"))
+    return inserted
+
+def receipt_lines(frame: pd.DataFrame) -> list:
+    """
+    Lines for receive_stock_bulk from a reviewed table (scan, invoice, file):
+    one per item_name and category, quantities summed and an optional
+    unit_cost column weighted by quantity across the rows that have one.
+    """
+    cost = pd.to_numeric(frame["unit_cost"], errors="coerce") if "unit_cost" in frame else pd.Series(float("nan"), index=frame.index)
+    quantity = pd.to_numeric(frame["quantity"])
+    grouped = frame.assign(
+        quantity=quantity,
+        costed=quantity.where(cost.notna(), 0),
+        amount=(quantity * cost).fillna(0)
+    ).groupby(["item_name", "category"], as_index=False)[["quantity", "costed", "amount"]].sum()
+    return [{
+        "item_name": r.item_name,
+        "category": r.category,
+        "quantity": int(r.quantity),
+        "unit_cost": r.amount / r.costed if r.costed > 0 else None
+    } for r in grouped.itertuples()]
+
+def view_barcodes():
+    res = _scoped("barcodes").execute()
+    return pd.DataFrame(res.data)
+
+def save_barcode(barcode: str, item_name: str, category: str, units_per_carton: int = 1):
+    """Map a barcode to a catalogue item (insert or replace)."""
+    _upsert("barcodes", {
+        "barcode": barcode.strip(),
+        "item_name": item_name,
+        "category": category,
+        "units_per_carton": units_per_carton
+    }, on_conflict="branch,barcode").execute()
+    return True
+
+def view_lead_times():
+    res = _scoped("lead_times", "item_name,lead_time_days").execute()
+    return pd.DataFrame(res.data, columns=["item_name", "lead_time_days"])
+
+def save_lead_time(item_name: str, lead_time_days: int):
+    """Set the supplier lead time (in days) for a catalogue item."""
+    _upsert("lead_times", {
+        "item_name": item_name,
+        "lead_time_days": int(lead_time_days),
+        "updated_at": datetime.now().isoformat()
+    }, on_conflict="branch,item_name").execute()
+    return True
+
+def delete_item(item_id, user):
+    # The row and its audit entry go together; deleting twice is a no-op
+    removed = supabase.rpc("delete_stock", {
+        "p_item_id": int(item_id), "p_username": user, "p_branch": current_branch()
+    }).execute().data
+    if removed:
+        _lots().discard(int(item_id))
+        snapshots.invalidate(_cache_key("items"))
 
 def get_total_qty(selected_item_name):
-    res = supabase.table("items").select("*").eq("item_name", selected_item_name).execute()
+    res = _scoped("items").eq("item_name", selected_item_name).execute()
     if not res.data:
         return "Item not found."
     total_quantity = sum(r["quantity"] for r in res.data)
     return total_quantity
 
 def record_sale(item_id, quantity, user, customer_id, override_total=None):
-    res = supabase.table("items").select("*").eq("item_id", item_id).execute()
-    if not res.data:
-        return "Item not found."
-    item = res.data[0]
-    item_name = item["item_name"]
-    category = item["category"]
+    """Record a single-item sale as a one-line order."""
+    _, _, msg = record_order(
+        [{"item_id": item_id, "quantity": quantity, "override_price": override_total}],
+        user,
+        customer_id
+    )
+    return msg
 
-    tier_res = supabase.table("pricing_tiers").select("price_per_unit").eq("item_id", item_id).lte("min_qty", quantity).order("min_qty", desc=True).limit(1).execute()
-    if tier_res.data:
-        price_per_unit = tier_res.data[0]["price_per_unit"]
-    else:
-        price_per_unit = 0.00
+# ---------------- ORDERS ----------------
+def get_tiered_prices(lines) -> dict:
+    """
+    Price many (item_id, quantity) pairs with a single pricing_tiers query.
+    Returns {(item_id, quantity): price_per_unit}, with None where no tier applies.
+    """
+    keys = {(int(item_id), int(qty)) for item_id, qty in lines}
+    if not keys:
+        return {}
+    item_ids = sorted({item_id for item_id, _ in keys})
+    tiers = (
+        _scoped("pricing_tiers", "item_id,min_qty,max_qty,price_per_unit")
+        .in_("item_id", item_ids)
+        .execute()
+        .data
+    )
+    tiers_by_item = {}
+    for tier in tiers:
+        tiers_by_item.setdefault(tier["item_id"], []).append(tier)
+
+    prices = {}
+    for item_id, qty in keys:
+        best = None
+        for tier in tiers_by_item.get(item_id, []):
+            if tier["min_qty"] <= qty and (tier["max_qty"] is None or tier["max_qty"] >= qty):
+                if best is None or tier["min_qty"] > best["min_qty"]:
+                    best = tier
+        prices[(item_id, qty)] = best["price_per_unit"] if best else None
+    return prices
+
+def _verify_order(params, result):
+    # A sale made offline may find less stock than the shop had when it was rung up
+    order_id, consumed, msg = result
+    if order_id is None:
+        return "failed", msg
+    requested = sum(int(line["quantity"]) for line in params["lines"])
+    if sum(lot["deducted"] for lot in consumed) < requested:
+        return "conflict", msg
+    return None
+
+def _order_rows(lines, user, customer_id, order_id, items, prices, costs):
+    """
+    Sale lines, audit rows and total quantity per item_name for one order.
+    Each line's cost is its quantity at the item's current average cost.
+    """
+    sales_rows, audit_rows = [], []
+    demand = {}  # item_name -> total quantity across lines
+    for line in lines:
+        item = items[int(line["item_id"])]
+        quantity = int(line["quantity"])
+        override_price = line.get("override_price")
+        selling_price = override_price if override_price else (prices[(item["item_id"], quantity)] or 0.00)
+        unit_cost = costs.get(item["item_name"], 0.0)
+        cost = quantity * unit_cost
+        profit = quantity * selling_price - cost
+        sales_rows.append({
+            "order_id": order_id,
+            "item_id": item["item_id"],
+            "item_name": item["item_name"],
+            "quantity": quantity,
+            "selling_price": selling_price,
+            "total_sale": quantity * selling_price,
+            "cost": cost,
+            "profit": profit,
+            "customer_id": customer_id,
+            "overridden": 1 if override_price else 0
+        })
+        audit_rows.append({
+            "item_name": item["item_name"],
+            "category": item["category"],
+            "action": "Sale",
+            "quantity": quantity,
+            "unit_cost": unit_cost,
+            "selling_price": selling_price,
+            "username": user
+        })
+        demand[item["item_name"]] = demand.get(item["item_name"], 0) + quantity
+    return sales_rows, audit_rows, demand
+
+def _plan_order(demand, overlay=None):
+    """
+    FEFO deductions for an order: (deductions, consumed lots, shortfall per item_name).
+    A shortfall is planned again on lots reloaded from the database, since
+    stock added by another process (the POS API, CLI imports, the offline
+    replayer) is not in the cached index until it expires.
+    """
+    deductions, consumed, shortfall = _plan_lots(demand, overlay)
+    if shortfall:
+        _lots().refresh(shortfall)
+        deductions, consumed, shortfall = _plan_lots(demand, overlay)
+    return deductions, consumed, shortfall
+
+def _plan_lots(demand, overlay=None):
+    deductions, consumed, shortfall = [], [], {}
+    for item_name, quantity in demand.items():
+        taken = 0
+        for row, take in _lots().plan(item_name, quantity, overlay):
+            deductions.append({"item_id": row["item_id"], "version": row.get("version", 0), "quantity": take})
+            consumed.append({
+                "item_id": row["item_id"],
+                "item_name": item_name,
+                "lot_no": row.get("lot_no"),
+                "expiry_date": row.get("expiry_date"),
+                "fridge_no": row["fridge_no"],
+                "deducted": take
+            })
+            taken += take
+        if taken < quantity:
+            shortfall[item_name] = quantity - taken
+    return deductions, consumed, shortfall
 
-    selling_price = override_total if override_total else price_per_unit
-    total_sale = quantity * selling_price
-    overridden_flag = 1 if override_total else 0
-    cost = 0.0
-    profit = 0.0
+def _audit_by_lot(audit_rows, consumed):
+    """
+    Split an order's audit rows (one per line) across the lots the plan takes
+    from, so each row names the stock row it moved. Lines of the same item
+    take lots in plan order; a shortfall keeps a row with no stock move.
+    """
+    lots = {}
+    for lot in consumed:
+        lots.setdefault(lot["item_name"], []).append([lot, lot["deducted"]])
+    split = []
+    for audit in audit_rows:
+        wanted = audit["quantity"]
+        queue = lots.get(audit["item_name"], [])
+        while wanted and queue:
+            lot, left = queue[0]
+            take = min(wanted, left)
+            split.append({**audit, "quantity": take, **_stock_move(lot, -take)})
+            wanted -= take
+            if take == left:
+                queue.pop(0)
+            else:
+                queue[0][1] -= take
+        if wanted:
+            split.append({**audit, "quantity": wanted})
+    return split
 
-    rows = supabase.table("items").select("*").eq("item_name", item_name).execute().data
-    qty_to_deduct = quantity
+def _order_recorded(consumed, shortfall, updated):
+    """Fold the RPC's updated rows into the lot index and describe the deductions."""
+    remaining = {}
+    for row in updated:
+        _lots().update(row)
+        remaining[row["item_id"]] = row["quantity"]
     deduction_log = []
-    for r in rows:
-        if qty_to_deduct <= 0:
-            break
-        available = r["quantity"]
-        deduct = min(available, qty_to_deduct)
-        new_qty = available - deduct
-        supabase.table("items").update({"quantity": new_qty}).eq("item_id", r["item_id"]).execute()
-        qty_to_deduct -= deduct
-        deduction_log.append(f"Fridge {r['fridge_no']}: deducted {deduct}, new qty={new_qty}")
-
-    supabase.table("sales").insert({
-        "item_id": item_id,
-        "item_name": item_name,
-        "quantity": quantity,
-        "selling_price": selling_price,
-        "total_sale": total_sale,
-        "cost": cost,
-        "profit": profit,
-        "customer_id": customer_id,
-        "overridden": overridden_flag
-    }).execute()
+    for lot in consumed:
+        lot["remaining"] = remaining.get(lot["item_id"])
+        deduction_log.append(
+            f"{lot['item_name']} – Fridge {lot['fridge_no']} lot {lot['lot_no'] or '-'} "
+            f"(exp {lot['expiry_date'] or 'n/a'}): deducted {lot['deducted']}, new qty={lot['remaining']}"
+        )
+    for item_name, short in shortfall.items():
+        deduction_log.append(f"{item_name} short by {short}: not enough stock on hand")
+    return "Sale recorded. Deduction details:\n" + "\n".join(deduction_log)
 
-    supabase.table("audit_log").insert({
-        "item_name": item_name,
-        "category": category,
-        "action": "Sale",
-        "quantity": quantity,
-        "unit_cost": cost,
-        "selling_price": selling_price,
-        "username": user
-    }).execute()
+def _order_items(item_ids):
+    return {
+        r["item_id"]: r
+        for r in _scoped("items", "item_id,item_name,category").in_("item_id", sorted(item_ids)).execute().data
+    }
+
+@offline_capable(
+    ack=lambda params: (params["idempotency_key"], None, OFFLINE_ACK),
+    verify=_verify_order,
+    keyed=True
+)
+def record_order(lines, user, customer_id, idempotency_key=None):
+    """
+    Record a multi-line order under one order id.
+    lines is a list of dicts with item_id, quantity and an optional override_price.
+    Stock is taken first-expiring first; all deductions, sale lines and audit rows
+    go to the record_order RPC in one call, which is retried if any lot changed.
+    idempotency_key identifies the checkout: calling again with the same key (a
+    double click, a retried request) returns without deducting stock twice.
+    Returns (order_id, consumed lots, message); order_id is None if nothing was written,
+    consumed is None if the order was saved offline.
+    """
+    if not lines:
+        return None, [], "Cart is empty."
+
+    item_ids = {int(line["item_id"]) for line in lines}
+    items = _order_items(item_ids)
+    if any(item_id not in items for item_id in item_ids):
+        return None, [], "Item not found."
 
-    return f"Sale recorded. Deduction details:\n" + "\n".join(deduction_log)
+    prices = get_tiered_prices([(line["item_id"], line["quantity"]) for line in lines])
+    costs = get_item_costs({item["item_name"] for item in items.values()})
+    order_id = str(idempotency_key or uuid.uuid4())  # one key per order
+    sales_rows, audit_rows, demand = _order_rows(lines, user, customer_id, order_id, items, prices, costs)
+
+    for attempt in range(STOCK_CAS_MAX_RETRIES):
+        deductions, consumed, shortfall = _plan_order(demand)
+        _count_cas("attempts")
+        try:
+            updated = with_idempotency_key(supabase.rpc("record_order", {
+                "p_deductions": deductions,
+                "p_sales": sales_rows,
+                "p_audit": _audit_by_lot(audit_rows, consumed),
+                "p_branch": current_branch(),
+                "p_idempotency_key": order_id
+            }), order_id).execute().data
+        except APIError as e:
+            if e.code != "40001":
+                raise
+            # A lot changed since we planned → reload those items and re-plan
+            _count_cas("conflicts")
+            _lots().refresh(demand)
+            time.sleep(random.uniform(0, STOCK_CAS_BACKOFF * (attempt + 1)))
+            continue
+
+        snapshots.invalidate(_cache_key("items"))
+        return order_id, consumed, _order_recorded(consumed, shortfall, updated)
+
+    _count_cas("exhausted")
+    return None, [], f"Sale not recorded: stock kept changing; gave up after {STOCK_CAS_MAX_RETRIES} attempts."
+
+def record_orders(orders) -> list:
+    """
+    Record many orders in one round trip (group commit for the POS API).
+    orders is a list of dicts with lines, user, customer_id and idempotency_key.
+    Item details, prices and costs are read once for the whole batch. Orders are
+    planned in sequence, each on top of the stock the earlier ones will leave,
+    and sent to the record_orders RPC, which applies each in its own
+    subtransaction. Orders that hit a changed lot are re-run one by one
+    through record_order; an order the database rejects otherwise fails alone.
+    Returns one (order_id, consumed, message) per order.
+    """
+    results = [None] * len(orders)
+    item_ids = {int(line["item_id"]) for order in orders for line in order["lines"]}
+    items = _order_items(item_ids) if item_ids else {}
+    prices = get_tiered_prices([(line["item_id"], line["quantity"]) for order in orders for line in order["lines"]])
+    costs = get_item_costs({item["item_name"] for item in items.values()})
+
+    batch, overlay = [], {}  # overlay: item_id -> row as the earlier orders will leave it
+    for i, order in enumerate(orders):
+        if not order["lines"]:
+            results[i] = (None, [], "Cart is empty.")
+            continue
+        if any(int(line["item_id"]) not in items for line in order["lines"]):
+            results[i] = (None, [], "Item not found.")
+            continue
+        order_id = str(order.get("idempotency_key") or uuid.uuid4())
+        sales_rows, audit_rows, demand = _order_rows(
+            order["lines"], order["user"], order.get("customer_id"), order_id, items, prices, costs
+        )
+        deductions, consumed, shortfall = _plan_order(demand, overlay)
+        for d in deductions:
+            row = overlay.get(d["item_id"]) or _lots().row(d["item_id"])
+            overlay[d["item_id"]] = {**row, "quantity": row["quantity"] - d["quantity"], "version": row.get("version", 0) + 1}
+        batch.append((i, order_id, consumed, shortfall, {
+            "idempotency_key": order_id,
+            "deductions": deductions,
+            "sales": sales_rows,
+            "audit": _audit_by_lot(audit_rows, consumed)
+        }))
+
+    if batch:
+        _count_cas("attempts", len(batch))
+        outcomes = supabase.rpc("record_orders", {
+            "p_orders": [payload for *_, payload in batch],
+            "p_branch": current_branch()
+        }).execute().data
+        retry = []
+        for (i, order_id, consumed, shortfall, _), outcome in zip(batch, outcomes):
+            if outcome["ok"]:
+                results[i] = (order_id, consumed, _order_recorded(consumed, shortfall, outcome["rows"]))
+            elif outcome["code"] == "40001":
+                retry.append((i, order_id))
+            else:
+                results[i] = (None, [], f"Order rejected by the database: {outcome.get('error') or outcome['code']}")
+        snapshots.invalidate(_cache_key("items"))
+        if retry:
+            _count_cas("conflicts", len(retry))
+            _lots().refresh({items[int(line["item_id"])]["item_name"] for i, _ in retry for line in orders[i]["lines"]})
+        for i, order_id in retry:
+            order = orders[i]
+            results[i] = record_order(order["lines"], order["user"], order.get("customer_id"), idempotency_key=order_id)
+    return results
 
 def get_tiered_price(item_id: int, quantity: int):
     """
     Fetch the correct tiered price per unit for an item/quantity.
     Returns None if no tier is found.
     """
-    response = supabase.table("pricing_tiers").select("price_per_unit") \
+    response = _scoped("pricing_tiers", "price_per_unit") \
         .eq("item_id", item_id) \
         .lte("min_qty", quantity) \
         .or_(f"max_qty.is.null,max_qty.gte.{quantity}") \
@@ -334,15 +1251,36 @@ def get_tiered_price(item_id: int, quantity: int):
 
 def get_pricing_tiers(item_id: int):
     """Fetch pricing tiers for a given item_id, ordered by min_qty."""
-    res = supabase.table("pricing_tiers").select("*").eq("item_id", item_id).order("min_qty").execute()
+    res = _scoped("pricing_tiers").eq("item_id", item_id).order("min_qty").execute()
     return pd.DataFrame(res.data)
 
-def save_pricing_tier(item_id: int, min_qty: int, max_qty: int, price_per_unit: float, label: str):
-    """Insert or update a pricing tier."""
+def _price_history_rows(changes: pd.DataFrame, user) -> list:
+    """
+    Build price_history rows from a frame of tier changes with columns
+    id, item_id, min_qty, max_qty, old_price and new_price.
+    Only rows whose price actually changed are kept.
+    """
+    changed = changes[changes["old_price"].round(2) != changes["new_price"].round(2)]
+    if changed.empty:
+        return []
+    history = pd.DataFrame({
+        "tier_id": changed["id"].astype("int64"),
+        "item_id": changed["item_id"].astype("int64"),
+        "min_qty": changed["min_qty"].astype("int64"),
+        "max_qty": changed["max_qty"].astype("Int64"),
+        "old_selling_price": changed["old_price"].astype(float),
+        "new_selling_price": changed["new_price"].astype(float),
+        "changed_by": user or "System",
+        "timestamp": datetime.now().isoformat()
+    })
+    history = history.astype(object).where(history.notna(), None)
+    return history.to_dict("records")
+
+def save_pricing_tier(item_id: int, min_qty: int, max_qty: int, price_per_unit: float, label: str, user=None):
+    """Insert or update a pricing tier, logging price changes to price_history."""
     if max_qty == 0:
         existing = (
-            supabase.table("pricing_tiers")
-            .select("*")
+            _scoped("pricing_tiers")
             .eq("item_id", item_id)
             .eq("min_qty", min_qty)
             .is_("max_qty", None)
@@ -350,8 +1288,7 @@ def save_pricing_tier(item_id: int, min_qty: int, max_qty: int, price_per_unit:
         )
     else:
         existing = (
-            supabase.table("pricing_tiers")
-            .select("*")
+            _scoped("pricing_tiers")
             .eq("item_id", item_id)
             .eq("min_qty", min_qty)
             .eq("max_qty", max_qty)
@@ -359,97 +1296,117 @@ def save_pricing_tier(item_id: int, min_qty: int, max_qty: int, price_per_unit:
         )
 
     if existing.data:
+        history_rows = _price_history_rows(pd.DataFrame([{
+            "id": existing.data[0]["id"],
+            "item_id": item_id,
+            "min_qty": min_qty,
+            "max_qty": None if max_qty == 0 else max_qty,
+            "old_price": existing.data[0]["price_per_unit"],
+            "new_price": price_per_unit
+        }]), user)
         if max_qty == 0:
-            supabase.table("pricing_tiers").update({
+            _update("pricing_tiers", {
                 "price_per_unit": price_per_unit,
                 "label": label.strip().upper()
             }).eq("item_id", item_id).eq("min_qty", min_qty).is_("max_qty", None).execute()
         else:
-            supabase.table("pricing_tiers").update({
+            _update("pricing_tiers", {
                 "price_per_unit": price_per_unit,
                 "label": label.strip().upper()
             }).eq("item_id", item_id).eq("min_qty", min_qty).eq("max_qty", max_qty).execute()
+        if history_rows:
+            _insert("price_history", history_rows).execute()
+        snapshots.invalidate(_cache_key("pricing_tiers"))
         return "updated"
     else:
-        supabase.table("pricing_tiers").insert({
+        _insert("pricing_tiers", {
             "item_id": item_id,
             "min_qty": min_qty,
             "max_qty": None if max_qty == 0 else max_qty,
             "price_per_unit": price_per_unit,
             "label": label.strip().upper()
         }).execute()
+        snapshots.invalidate(_cache_key("pricing_tiers"))
         return "inserted"
 
 def delete_pricing_tier(tier_id: int):
     """Delete a pricing tier by ID."""
-    supabase.table("pricing_tiers").delete().eq("id", tier_id).execute()
+    _delete("pricing_tiers").eq("id", tier_id).execute()
+    snapshots.invalidate(_cache_key("pricing_tiers"))
     return True
 
-def upload_tiered_pricing_to_db(df: pd.DataFrame):
+def upload_tiered_pricing_to_db(df: pd.DataFrame, user=None):
     """
     Process a DataFrame of tiered pricing and update/insert into Supabase.
-    Returns a list of skipped item_ids.
+    Existing tiers are matched in one pass against a single read of the
+    affected items' tiers; updates, inserts and price_history rows are each
+    written as one batch. Returns a list of skipped item_ids.
     """
-    skipped_rows = []
+    upload = pd.DataFrame({
+        "item_id": df["item_id"].astype("int64"),
+        "min_qty": df["min_qty"].astype("int64"),
+        "max_qty": pd.to_numeric(df["max_qty"]).astype("Int64"),
+        "price_per_unit": df["price_per_unit"].astype(float),
+        "label": df["label"].astype(str).str.strip().str.upper()
+    })
 
-    for _, row in df.iterrows():
-        item_id = int(row['item_id'])
-        min_qty = int(row['min_qty'])
-        max_qty = None if pd.isna(row['max_qty']) else int(row['max_qty'])
-        price_per_unit = float(row['price_per_unit'])
-        label = str(row['label']).strip().upper()
+    # ✅ Check which items exist in one query
+    item_ids = upload["item_id"].unique().tolist()
+    known = _scoped("items", "item_id").in_("item_id", item_ids).execute().data
+    known_ids = {r["item_id"] for r in known}
+    valid = upload["item_id"].isin(known_ids)
+    skipped_rows = upload.loc[~valid, "item_id"].tolist()
+    upload = upload[valid]
+    if upload.empty:
+        return skipped_rows
 
-        # ✅ Check if item exists in items table
-        item_check = supabase.table("items").select("item_id").eq("item_id", item_id).execute()
-        if not item_check.data:
-            skipped_rows.append(item_id)
-            continue
+    # Match against existing tiers on (item_id, min_qty, max_qty, label); -1 stands in for "no max"
+    key = ["item_id", "min_qty", "max_key", "label"]
+    upload["max_key"] = upload["max_qty"].fillna(-1)
+    upload = upload.drop_duplicates(subset=key, keep="last")
+    existing = pd.DataFrame(
+        _scoped("pricing_tiers", "id,item_id,min_qty,max_qty,label,price_per_unit")
+        .in_("item_id", upload["item_id"].unique().tolist())
+        .execute()
+        .data,
+        columns=["id", "item_id", "min_qty", "max_qty", "label", "price_per_unit"]
+    )
+    existing["max_key"] = pd.to_numeric(existing["max_qty"]).astype("Int64").fillna(-1)
+    existing["min_qty"] = existing["min_qty"].astype("int64")
+    existing["item_id"] = existing["item_id"].astype("int64")
+    merged = upload.merge(
+        existing[key + ["id", "price_per_unit"]].rename(columns={"price_per_unit": "old_price"}),
+        on=key, how="left"
+    )
+    merged["new_price"] = merged["price_per_unit"]
 
-        # Check if pricing tier exists
-        if max_qty is None:
-            existing = (
-                supabase.table("pricing_tiers")
-                .select("id")
-                .eq("item_id", item_id)
-                .eq("min_qty", min_qty)
-                .is_("max_qty", None)
-                .eq("label", label)
-                .execute()
-            )
-        else:
-            existing = (
-                supabase.table("pricing_tiers")
-                .select("id")
-                .eq("item_id", item_id)
-                .eq("min_qty", min_qty)
-                .eq("max_qty", max_qty)
-                .eq("label", label)
-                .execute()
-            )
+    tier_columns = ["item_id", "min_qty", "max_qty", "price_per_unit", "label"]
+    matched = merged["id"].notna()
+    updates = merged[matched & (merged["old_price"].round(2) != merged["new_price"].round(2))]
+    inserts = merged[~matched]
 
-        if existing.data:
-            tier_id = existing.data[0]["id"]
-            supabase.table("pricing_tiers").update({
-                "price_per_unit": price_per_unit
-            }).eq("id", tier_id).execute()
-        else:
-            supabase.table("pricing_tiers").insert({
-                "item_id": item_id,
-                "min_qty": min_qty,
-                "max_qty": max_qty,
-                "price_per_unit": price_per_unit,
-                "label": label
-            }).execute()
+    def records(frame, columns):
+        out = frame[columns].astype(object)
+        return out.where(frame[columns].notna(), None).to_dict("records")
+
+    if not updates.empty:
+        _upsert("pricing_tiers", records(updates.assign(id=updates["id"].astype("int64")), ["id"] + tier_columns)).execute()
+    if not inserts.empty:
+        _insert("pricing_tiers", records(inserts, tier_columns)).execute()
+    history_rows = _price_history_rows(updates, user)
+    if history_rows:
+        _insert("price_history", history_rows).execute()
+    snapshots.invalidate(_cache_key("pricing_tiers"))
 
     return skipped_rows
 
 def get_customers():
     """Fetch all customers from Supabase."""
-    res = supabase.table("customers").select("*").execute()
-    return pd.DataFrame(res.data)
+    return view_customers()
 
-def save_customer(customer_id: int, name: str, phone: str, email: str, address: str):
-    """Insert or update a customer record."""
+@offline_capable(ack=lambda params: "queued", keyed=True)
+def save_customer(customer_id: int, name: str, phone: str, email: str, address: str, idempotency_key=None):
+    """Insert or update a customer record; an insert is keyed so it cannot happen twice."""
     data = {
         "name": name.strip().upper(),
         "phone": phone.strip(),
@@ -458,15 +1415,19 @@ def save_customer(customer_id: int, name: str, phone: str, email: str, address:
     }
 
     if customer_id:  # Update existing
-        supabase.table("customers").update(data).eq("id", customer_id).execute()
+        _update("customers", data).eq("id", customer_id).execute()
+        snapshots.invalidate(_cache_key("customers"))
         return "updated"
     else:  # Insert new
-        supabase.table("customers").insert(data).execute()
+        _keyed_rpc("insert_customer", {"p_customer": data, "p_branch": current_branch()}, idempotency_key or str(uuid.uuid4()))
+        snapshots.invalidate(_cache_key("customers"))
         return "inserted"
 
+@offline_capable(ack=lambda params: True)
 def delete_customer(customer_id: int):
     """Delete a customer by ID."""
-    supabase.table("customers").delete().eq("id", customer_id).execute()
+    _delete("customers").eq("id", customer_id).execute()
+    snapshots.invalidate(_cache_key("customers"))
     return True
 
 def get_sales_by_customer(customer_id: int, start_date: str, end_date: str):
@@ -475,12 +1436,150 @@ def get_sales_by_customer(customer_id: int, start_date: str, end_date: str):
     Returns a DataFrame.
     """
     query = (
-        supabase.table("sales")
-        .select("*")
+        _scoped("sales")
         .eq("customer_id", customer_id)
         .gte("date", str(start_date))
         .lte("date", str(end_date))
         .execute()
     )
-    return pd.DataFrame(query.data)
+    return to_frame("sales", query.data)
+
+# ---------------- CUSTOMER LEDGER ----------------
+def record_payment(customer_id: int, amount: float, reference: str = ""):
+    """Post a customer payment; it settles the oldest open charges first."""
+    res = supabase.rpc("ledger_post", {
+        "p_customer_id": customer_id,
+        "p_kind": "payment",
+        "p_amount": -abs(amount),
+        "p_reference": reference.strip().upper() or None
+    }).execute()
+    return res.data
+
+def get_statement_of_account(customer_id: int, start_date, end_date):
+    """
+    Ledger entries for a customer in [start_date, end_date] with the opening
+    balance carried in from before the period. Returns (opening_balance, DataFrame).
+    """
+    opening = (
+        supabase.table("customer_ledger")
+        .select("balance")
+        .eq("customer_id", customer_id)
+        .lt("entry_date", str(start_date))
+        .order("entry_date", desc=True)
+        .order("id", desc=True)
+        .limit(1)
+        .execute()
+    )
+    opening_balance = opening.data[0]["balance"] if opening.data else 0.0
+    res = (
+        supabase.table("customer_ledger")
+        .select("entry_date,kind,reference,amount,open_amount,balance")
+        .eq("customer_id", customer_id)
+        .gte("entry_date", str(start_date))
+        .lt("entry_date", str(pd.Timestamp(end_date) + pd.Timedelta(days=1)))
+        .order("entry_date")
+        .order("id")
+        .execute()
+    )
+    return opening_balance, to_frame("customer_ledger", res.data)
+
+def view_receivables_summary(customer_id=None):
+    """Balance and 30/60/90-day aging per customer from one query."""
+    query = _scoped("customer_receivables").order("balance", desc=True)
+    if customer_id:
+        query = query.eq("customer_id", customer_id)
+    res = query.execute()
+    return pd.DataFrame(res.data)
+
+# ---------------- PROFIT/LOSS ----------------
+PNL_GROUPS = ("day", "week", "month", "item", "category", "customer")
+PNL_COLUMNS = ["key", "label", "lines", "units", "total_sale", "cost", "profit"]
+
+def pnl_report(start_date, end_date, group_by="day") -> pd.DataFrame:
+    """
+    Sales, cost and profit for an inclusive date range, one row per period,
+    item, category or customer. The grouping runs in the pnl_report RPC;
+    only the aggregated rows come back.
+    """
+    if group_by not in PNL_GROUPS:
+        raise ValueError(f"group_by must be one of {PNL_GROUPS}")
+    res = supabase.rpc("pnl_report", {
+        "p_branch": current_branch(),
+        "p_start": str(start_date),
+        "p_end": str(end_date),
+        "p_group": group_by
+    }).execute()
+    df = pd.DataFrame(res.data, columns=PNL_COLUMNS)
+    for column in ["units", "total_sale", "cost", "profit"]:
+        df[column] = pd.to_numeric(df[column]).astype(float)
+    return df
+
+# ---------------- STOCK HISTORY ----------------
+# Stock at a past time is the nearest compact snapshot of items plus the
+# audit deltas (qty_delta per item_id) logged between it and that time, so a
+# query never replays more than one snapshot interval of audit rows. Stock
+# rows and their audit rows are always written in one transaction, and a
+# snapshot waits for those in flight (see 20261019001800_stock_history_lock.sql).
+STOCK_SNAPSHOT_INTERVAL = timedelta(hours=24)
+STOCK_AT_COLUMNS = ["item_id", "item_name", "category", "fridge_no", "lot_no", "quantity", "snapshot_id", "snapshot_at"]
+STOCK_DRIFT_COLUMNS = ["item_id", "item_name", "fridge_no", "replayed", "live", "difference"]
+
+def take_stock_snapshot() -> dict:
+    """Snapshot the branch's stock rows now; returns the snapshot's id, time and size."""
+    snap = supabase.rpc("take_stock_snapshot", {"p_branch": current_branch()}).execute().data
+    snap = snap[0] if isinstance(snap, list) else snap
+    return {k: v for k, v in snap.items() if k != "items"}
+
+def view_stock_snapshots():
+    res = _scoped("stock_snapshots", "id,taken_at,last_audit_id,item_rows").order("taken_at", desc=True).execute()
+    return pd.DataFrame(res.data, columns=["id", "taken_at", "last_audit_id", "item_rows"])
+
+def ensure_stock_snapshot(max_age=STOCK_SNAPSHOT_INTERVAL):
+    """Take a snapshot if the latest one is older than max_age; returns it, or None if none was needed."""
+    latest = _scoped("stock_snapshots", "taken_at").order("taken_at", desc=True).limit(1).execute().data
+    if latest and pd.Timestamp(latest[0]["taken_at"]) > pd.Timestamp.now(tz="UTC") - max_age:
+        return None
+    return take_stock_snapshot()
+
+def _stock_history_rpc(name, params, columns) -> pd.DataFrame:
+    try:
+        res = supabase.rpc(name, {"p_branch": current_branch(), **params}).execute()
+    except APIError as e:
+        if e.code != "P0002":
+            raise
+        return pd.DataFrame(columns=columns)  # no snapshot taken yet
+    return pd.DataFrame(res.data, columns=columns)
+
+def stock_at(when) -> pd.DataFrame:
+    """
+    Stock rows (item, fridge, lot) with their quantity as it stood at when,
+    replayed in the database from the nearest snapshot. A naive when is shop
+    time (Asia/Manila), not UTC. Empty until the first snapshot exists.
+    """
+    from forecasting import FORECAST_TZ  # forecasting imports this module
+    when = pd.Timestamp(when)
+    if when.tzinfo is None:
+        when = when.tz_localize(FORECAST_TZ)
+    return _stock_history_rpc("stock_at", {"p_at": when.isoformat()}, STOCK_AT_COLUMNS)
+
+def stock_drift() -> pd.DataFrame:
+    """Stock rows whose live quantity differs from the latest snapshot plus the audit deltas since."""
+    return _stock_history_rpc("stock_drift", {}, STOCK_DRIFT_COLUMNS)
+
+# ---------------- CONSOLIDATED (ALL BRANCHES) ----------------
+def view_branch_rollup(start_date, end_date) -> pd.DataFrame:
+    """Daily sales totals per branch from the branch_daily_sales rollup (not branch scoped)."""
+    res = (
+        supabase.table("branch_daily_sales")
+        .select("*")
+        .gte("day", str(start_date))
+        .lte("day", str(end_date))
+        .order("day")
+        .execute()
+    )
+    return pd.DataFrame(res.data)
 
+def view_branch_stock() -> pd.DataFrame:
+    """Units on hand per branch and category (not branch scoped)."""
+    res = supabase.table("branch_stock").select("*").execute()
+    return pd.DataFrame(res.data)
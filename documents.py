@@ -0,0 +1,129 @@
+from fpdf import FPDF
+from fpdf.enums import XPos, YPos
+
+# ---------------- SETTINGS ----------------
+VENDOR = {
+    "name": "KPrime Food Solutions",
+    "address": "Blk 3 Lot 5 West Wing Villas, North Belton QC",
+    "phone": "+63 995 744 9953",
+    "email": "kprimefoodinc@gmail.com"
+}
+LOGO = "KPrime.jpg"
+
+def _letterhead(pdf, logo):
+    pdf.add_page()
+    pdf.image(logo, x=10, y=8, w=30)
+    pdf.set_font("Helvetica", 'B', 14)
+    pdf.cell(0, 10, VENDOR["name"], new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="C")
+    pdf.set_font("Helvetica", size=10)
+    pdf.multi_cell(0, 5, f"{VENDOR['address']}\nPhone: {VENDOR['phone']}\nEmail: {VENDOR['email']}", align="C")
+    pdf.ln(10)
+
+# ---------------- PURCHASE ORDER ----------------
+def po_number(order_date_sql: str, seq: int) -> str:
+    return f"PO-{order_date_sql.replace('-', '')}-{seq:03d}"
+
+def po_filename(order_date_sql: str, buyer_name: str, seq=None) -> str:
+    """File name for a PO; seq keeps several POs of one buyer on one date apart."""
+    safe_name = buyer_name.replace(" ", "_").replace("/", "_")
+    suffix = f"_{seq:03d}" if seq is not None else ""
+    return f"PO_{order_date_sql.replace('-', '')}{suffix}_{safe_name}.pdf"
+
+def build_po_pdf(number: str, order_date_sql: str, pickup_date_sql: str, buyer: dict, lines, logo=LOGO) -> bytes:
+    """
+    Purchase order PDF for one order.
+    lines is a DataFrame (or list of dicts) with item_name, quantity and selling_price.
+    """
+    pdf = FPDF()
+    _letterhead(pdf, logo)
+
+    pdf.set_font("Helvetica", 'B', 12)
+    pdf.cell(0, 10, "Purchase Order", new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="C")
+    pdf.set_font("Helvetica", size=10)
+    pdf.cell(0, 10, f"PO Number: {number}", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.cell(0, 10, f"Order Date: {order_date_sql}", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.ln(10)
+
+    # Table header
+    pdf.set_font("Helvetica", 'B', 10)
+    pdf.cell(20, 10, "No.", 1, align="C")
+    pdf.cell(80, 10, "Description", 1, align="L")
+    pdf.cell(30, 10, "Qty", 1, align="C")
+    pdf.cell(30, 10, "Unit Price", 1, align="R")
+    pdf.cell(30, 10, "Total", 1, align="R")
+    pdf.ln()
+
+    # Table rows
+    pdf.set_font("Helvetica", size=10)
+    rows = lines.to_dict("records") if hasattr(lines, "to_dict") else lines
+    subtotal = 0
+    for idx, row in enumerate(rows):
+        total = row["quantity"] * row["selling_price"]
+        subtotal += total
+        pdf.cell(20, 10, str(idx + 1), 1, align="C")
+        pdf.cell(80, 10, str(row.get("item_name", "")), 1, align="L")
+        pdf.cell(30, 10, str(row.get("quantity", "")), 1, align="C")
+        pdf.cell(30, 10, f"{row.get('selling_price', 0):,.2f}", 1, align="R")
+        pdf.cell(30, 10, f"{total:,.2f}", 1, align="R")
+        pdf.ln()
+
+    pdf.ln(5)
+    pdf.cell(0, 10, f"Subtotal: PHP {subtotal:,.2f}", new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="R")
+    pdf.cell(0, 10, "GST: PHP 0.00 (No GST)", new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="R")
+    pdf.cell(0, 10, f"Total Amount: PHP {subtotal:,.2f}", new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="R")
+    pdf.ln(10)
+
+    pdf.cell(0, 10, f"Pickup Date: {pickup_date_sql}", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.ln(20)
+    pdf.cell(0, 10, "Authorized By: ____________________", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    return bytes(pdf.output())
+
+# ---------------- STATEMENT OF ACCOUNT ----------------
+def soa_filename(customer_id, start_date, end_date) -> str:
+    return f"SOA_{customer_id}_{start_date}_{end_date}.pdf"
+
+def build_soa_pdf(customer_id, customer_name, start_date, end_date, sales, opening_balance, closing_balance, aging, logo=LOGO) -> bytes:
+    """
+    Statement of account PDF: the period's sales lines, opening and closing
+    balance, and the 30/60/90-day aging (a mapping with current, days_30, days_60, days_90).
+    """
+    pdf = FPDF()
+    _letterhead(pdf, logo)
+
+    pdf.set_font("Helvetica", size=12)
+    pdf.cell(200, 10, text="Statement of Account", new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="C")
+    pdf.cell(200, 10, text=f"Customer: {customer_name} (ID: {customer_id})", new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="C")
+    pdf.cell(200, 10, text=f"Period: {start_date} to {end_date}", new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="C")
+    pdf.ln(10)
+
+    # Table header
+    pdf.set_font("Helvetica", 'B', 10)
+    pdf.cell(20, 10, "Date", 1, align="C")
+    pdf.cell(60, 10, "Item", 1, align="L")
+    pdf.cell(20, 10, "Qty", 1, align="C")
+    pdf.cell(40, 10, "Total Sale", 1, align="R")
+    pdf.cell(40, 10, "Profit", 1, align="R")
+    pdf.ln()
+
+    # Table rows
+    pdf.set_font("Helvetica", size=10)
+    rows = sales.to_dict("records") if hasattr(sales, "to_dict") else sales
+    for row in rows:
+        pdf.cell(20, 10, str(row.get("date", "")), 1, align="C")
+        pdf.cell(60, 10, str(row.get("item_name", "")), 1, align="L")
+        pdf.cell(20, 10, str(row.get("quantity", "")), 1, align="C")
+        pdf.cell(40, 10, f"{row.get('total_sale', 0):,.2f}", 1, align="R")
+        pdf.cell(40, 10, f"{row.get('profit', 0):,.2f}", 1, align="R")
+        pdf.ln()
+
+    # Balances and aging
+    pdf.ln(5)
+    pdf.cell(0, 8, f"Opening Balance: PHP {opening_balance:,.2f}", new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="R")
+    pdf.cell(0, 8, f"Closing Balance: PHP {closing_balance:,.2f}", new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="R")
+    pdf.cell(
+        0, 8,
+        f"Current: {aging['current']:,.2f}   31-60: {aging['days_30']:,.2f}   "
+        f"61-90: {aging['days_60']:,.2f}   Over 90: {aging['days_90']:,.2f}",
+        new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="R"
+    )
+    return bytes(pdf.output())
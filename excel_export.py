@@ -0,0 +1,252 @@
+import io
+import os
+import tempfile
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.styles import Font, NamedStyle, PatternFill
+from openpyxl.utils import get_column_letter
+
+from audit_archive import read_archived_audit_log
+from db_supabase import current_branch, get_statement_of_account, stream_table_csv, use_branch
+from forecasting import FORECAST_TZ
+from table_dtypes import TABLE_DTYPES
+
+# ---------------- SETTINGS ----------------
+EXPORT_DIR = os.environ.get("KPRIME_EXPORT_DIR", os.path.join(tempfile.gettempdir(), "kprime_exports"))
+EXPORT_JOBS_KEPT = 20          # finished jobs (and their files) kept for download
+SHEET_MAX_ROWS = 1_048_575     # Excel's row limit less the header; longer exports continue on another sheet
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+MONEY_COLUMNS = {
+    "selling_price", "total_sale", "cost", "profit", "unit_cost", "price_per_unit",
+    "amount", "open_amount", "balance", "avg_cost", "opening_balance", "closing_balance"
+}
+# One named style per column kind, registered once per workbook
+STYLES = {
+    "header": {"font": Font(bold=True), "fill": PatternFill("solid", fgColor="DDEBF7")},
+    "money": {"number_format": "#,##0.00"},
+    "int": {"number_format": "#,##0"},
+    "datetime": {"number_format": "yyyy-mm-dd hh:mm:ss"}
+}
+WIDTHS = {"money": 14, "int": 10, "datetime": 20, "text": 24}
+
+# ---------------- WRITE-ONLY WORKBOOKS ----------------
+def new_workbook() -> Workbook:
+    workbook = Workbook(write_only=True)
+    for kind, attributes in STYLES.items():
+        workbook.add_named_style(NamedStyle(name=f"kp_{kind}", **attributes))
+    return workbook
+
+def column_kind(table, column) -> str:
+    if column in MONEY_COLUMNS:
+        return "money"
+    return {"int32": "int", "datetime": "datetime"}.get(TABLE_DTYPES.get(table, {}).get(column), "text")
+
+def _styled_cell(sheet, kind, value=None):
+    cell = WriteOnlyCell(sheet, value=value)
+    cell.style = f"kp_{kind}"
+    return cell
+
+def _new_sheet(workbook, title, columns, kinds):
+    sheet = workbook.create_sheet(title[:31])
+    for i, column in enumerate(columns, 1):
+        sheet.column_dimensions[get_column_letter(i)].width = WIDTHS[kinds[column]]
+    sheet.freeze_panes = "A2"
+    sheet.append([_styled_cell(sheet, "header", column) for column in columns])
+    # Text columns are written as plain values; the others reuse one styled cell per column
+    return sheet, [None if kinds[c] == "text" else _styled_cell(sheet, kinds[c]) for c in columns]
+
+def _prepare(frame, kinds):
+    """Convert a chunk column by column into values openpyxl writes directly."""
+    frame = frame.copy()
+    for column, kind in kinds.items():
+        if kind == "datetime":
+            # Excel has no time zones: write shop (Asia/Manila) wall-clock time
+            frame[column] = (
+                pd.to_datetime(frame[column], utc=True, format="ISO8601", errors="coerce")
+                .dt.tz_convert(FORECAST_TZ).dt.tz_localize(None)
+            )
+        elif kind in ("money", "int"):
+            frame[column] = pd.to_numeric(frame[column], errors="coerce")
+        elif pd.api.types.is_string_dtype(frame[column]):
+            # str columns (object or, on newer pandas, StringDtype) from read_csv
+            frame[column] = frame[column].str.replace(ILLEGAL_CHARACTERS_RE, "", regex=True)
+        elif frame[column].dtype == object:
+            frame[column] = frame[column].map(lambda v: ILLEGAL_CHARACTERS_RE.sub("", v) if isinstance(v, str) else v)
+    return frame.astype(object).where(frame.notna(), None)
+
+def _text(sheet, value):
+    if isinstance(value, str) and value.startswith("="):
+        cell = WriteOnlyCell(sheet, value=value)
+        cell.data_type = "s"  # an item named "=..." is text, not a formula
+        return cell
+    return value
+
+def write_sheet(workbook, title, frames, table=None, progress=None) -> int:
+    """
+    Stream DataFrame chunks into a new sheet of a write-only workbook and
+    return the number of rows. The first chunk fixes the columns; formats are
+    chosen per column (from the table's dtypes and the money columns) and
+    rows are written as they arrive, so memory stays at one chunk.
+    progress(n) is called with the row count of every chunk.
+    """
+    sheet, cells, columns, kinds = None, None, None, None
+    rows = sheet_rows = sheets = 0
+    for frame in frames:
+        if columns is None:
+            columns = list(frame.columns)
+            kinds = {c: column_kind(table, c) for c in columns}
+        for values in _prepare(frame.reindex(columns=columns), kinds).itertuples(index=False, name=None):
+            if sheet is None or sheet_rows == SHEET_MAX_ROWS:
+                sheets += 1
+                sheet, cells = _new_sheet(workbook, title if sheets == 1 else f"{title} ({sheets})", columns, kinds)
+                sheet_rows = 0
+            row = []
+            for cell, value in zip(cells, values):
+                if value is None or cell is None:
+                    row.append(_text(sheet, value))
+                else:
+                    cell.value = value
+                    row.append(cell)
+            sheet.append(row)
+            sheet_rows += 1
+        rows += len(frame)
+        if progress:
+            progress(len(frame))
+    if sheet is None:
+        _new_sheet(workbook, title, columns or ["No rows"], kinds or {"No rows": "text"})
+    return rows
+
+# ---------------- PAGINATED SOURCES ----------------
+def table_frames(table, params=(), order="id"):
+    """One DataFrame per page of stream_table_csv (only the first page has the header)."""
+    columns = None
+    for page in stream_table_csv(table, params, order):
+        frame = pd.read_csv(io.BytesIO(page), header=0 if columns is None else None, names=columns, dtype=str, keep_default_na=False, na_values=[""])
+        columns = list(frame.columns)
+        yield frame
+
+def shop_day_bounds(start_date, end_date):
+    """The instants the shop day start_date begins and the day after end_date begins."""
+    start = pd.Timestamp(pd.Timestamp(start_date).date()).tz_localize(FORECAST_TZ)
+    end = pd.Timestamp(pd.Timestamp(end_date).date() + timedelta(days=1)).tz_localize(FORECAST_TZ)
+    return start, end
+
+def date_params(column, start_date, end_date):
+    """PostgREST filters for an inclusive range of shop (Asia/Manila) days on column."""
+    start, end = shop_day_bounds(start_date, end_date)
+    return [(column, f"gte.{start.isoformat()}"), (column, f"lt.{end.isoformat()}")]
+
+def _audit_frames(start_date, end_date):
+    # Archived (cold) rows first, then the live table; a row caught mid-archive is written once
+    cold = read_archived_audit_log(*shop_day_bounds(start_date, end_date))
+    seen = set()
+    if not cold.empty:
+        seen = set(cold["id"])
+        yield cold.sort_values("id")
+    for frame in table_frames("audit_log", date_params("timestamp", start_date, end_date)):
+        yield frame[~pd.to_numeric(frame["id"]).isin(seen)] if seen else frame
+
+# ---------------- BACKGROUND JOBS ----------------
+class ExportJob:
+    """One Excel export running (or finished) in a background thread."""
+
+    def __init__(self, kind, label, filename):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.label = label
+        self.filename = filename
+        self.status = "running"  # running | done | failed
+        self.rows = 0
+        self.error = None
+        self.path = None
+        self.started = time.time()
+        self.finished = None
+
+    def add(self, rows):
+        self.rows += rows
+
+    def data(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+_jobs = {}  # id -> ExportJob
+_jobs_lock = threading.Lock()
+
+def _prune():
+    finished = sorted((j for j in _jobs.values() if j.status != "running"), key=lambda j: j.finished)
+    for job in finished[:-EXPORT_JOBS_KEPT]:
+        del _jobs[job.id]
+        if job.path and os.path.exists(job.path):
+            os.remove(job.path)
+
+def start_export(kind, label, filename, build) -> ExportJob:
+    """
+    Run build(workbook, job) in a background thread on the current branch
+    and save the workbook under EXPORT_DIR; poll the job for progress and
+    call job.data() once its status is done.
+    """
+    job = ExportJob(kind, label, filename)
+    branch = current_branch()
+
+    def run():
+        path = os.path.join(EXPORT_DIR, f"{job.id}.xlsx")
+        try:
+            os.makedirs(EXPORT_DIR, exist_ok=True)
+            workbook = new_workbook()
+            with use_branch(branch):
+                build(workbook, job)
+            workbook.save(path)
+            job.path, job.finished, job.status = path, time.time(), "done"
+        except Exception as e:
+            job.error, job.finished, job.status = f"{type(e).__name__}: {e}", time.time(), "failed"
+        with _jobs_lock:
+            _prune()
+
+    with _jobs_lock:
+        _jobs[job.id] = job
+    threading.Thread(target=run, name=f"excel-export-{job.id[:8]}", daemon=True).start()
+    return job
+
+def export_jobs(job_ids, kind=None) -> list:
+    """The given jobs that still exist (optionally of one kind), oldest first."""
+    with _jobs_lock:
+        jobs = [_jobs[i] for i in job_ids if i in _jobs]
+    return [j for j in jobs if kind is None or j.kind == kind]
+
+# ---------------- EXPORTS ----------------
+def export_sales(start_date, end_date) -> ExportJob:
+    def build(workbook, job):
+        frames = table_frames("sales", date_params("date", start_date, end_date))
+        write_sheet(workbook, "Sales", frames, "sales", job.add)
+    return start_export("sales", f"Sales {start_date} to {end_date}", f"sales_{start_date}_{end_date}.xlsx", build)
+
+def export_audit_log(start_date, end_date) -> ExportJob:
+    def build(workbook, job):
+        write_sheet(workbook, "Audit Log", _audit_frames(start_date, end_date), "audit_log", job.add)
+    return start_export("audit", f"Audit log {start_date} to {end_date}", f"audit_log_{start_date}_{end_date}.xlsx", build)
+
+def export_soa(customer_id, customer_name, start_date, end_date) -> ExportJob:
+    def build(workbook, job):
+        opening, ledger = get_statement_of_account(customer_id, start_date, end_date)
+        closing = ledger["balance"].iloc[-1] if not ledger.empty else opening
+        summary = pd.DataFrame([{
+            "customer_id": customer_id,
+            "customer": customer_name,
+            "period_start": str(start_date),
+            "period_end": str(end_date),
+            "opening_balance": opening,
+            "closing_balance": closing
+        }])
+        write_sheet(workbook, "Summary", [summary])
+        write_sheet(workbook, "Account Activity", [ledger], "customer_ledger", job.add)
+        sales = table_frames("sales", [("customer_id", f"eq.{customer_id}"), *date_params("date", start_date, end_date)])
+        write_sheet(workbook, "Sales", sales, "sales", job.add)
+    return start_export("soa", f"SOA {customer_name} {start_date} to {end_date}", f"SOA_{customer_id}_{start_date}_{end_date}.xlsx", build)
@@ -0,0 +1,190 @@
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from db_supabase import current_branch, read_table_csv, view_items, view_lead_times
+
+# ---------------- SETTINGS ----------------
+FORECAST_TZ = "Asia/Manila"     # sales are bucketed into local business days
+FORECAST_WINDOW_DAYS = 56       # trailing history used for rates and seasonality
+DEMAND_HALFLIFE_DAYS = 14       # recent days weigh more in the demand rate
+SEASONALITY_PRIOR_WEEKS = 4     # shrinks day-of-week factors toward 1 on thin history
+DEFAULT_LEAD_TIME_DAYS = 3      # for items without a lead_times row
+REVIEW_DAYS = 7                 # an order should cover demand until the next review
+SERVICE_Z = 1.65                # safety stock for ~95% cycle service level
+HISTORY_REBUILD_TTL = 3600      # seconds between full rebuilds of the daily history
+ID_OVERLAP = 500                # re-read this many ids back to catch late commits
+DOW_COLUMNS = [f"dow_{d}" for d in range(7)]
+PROFILE_COLUMNS = ["daily_rate", "daily_std", *DOW_COLUMNS]
+REORDER_COLUMNS = [
+    "item_name", "category", "on_hand", "fridges", "daily_rate", "lead_time_days",
+    "lead_demand", "safety_stock", "reorder_point", "days_of_cover", "suggested_qty"
+]
+
+# ---------------- DAILY DEMAND HISTORY ----------------
+class DemandHistory:
+    """
+    One branch's units sold per local day and item (rows = days, columns = item_name).
+    New sales are folded in incrementally by sale id; a full rebuild runs every
+    HISTORY_REBUILD_TTL to pick up edits and deletions.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.daily = pd.DataFrame()
+        self.version = 0            # bumps whenever the history changes
+        self._last_id = 0
+        self._recent_ids = set()    # ids within ID_OVERLAP of _last_id already counted
+        self._built_at = None
+
+    @staticmethod
+    def _pivot(sales):
+        day = (
+            pd.to_datetime(sales["date"], utc=True, format="ISO8601")
+            .dt.tz_convert(FORECAST_TZ).dt.tz_localize(None).dt.normalize()
+        )
+        return pd.pivot_table(
+            pd.DataFrame({"day": day, "item_name": sales["item_name"].astype(str), "quantity": sales["quantity"].astype(float)}),
+            index="day", columns="item_name", values="quantity", aggfunc="sum", fill_value=0.0
+        )
+
+    def _fold(self, sales):
+        if sales.empty:
+            return
+        ids = sales["id"].astype("int64")
+        fresh = ~ids.isin(self._recent_ids)
+        sales, ids = sales[fresh.to_numpy()], ids[fresh]
+        if sales.empty:
+            return
+        pivot = self._pivot(sales)
+        self.daily = pivot if self.daily.empty else self.daily.add(pivot, fill_value=0.0).sort_index()
+        self._last_id = max(self._last_id, int(ids.max()))
+        self._recent_ids = {i for i in self._recent_ids.union(ids.tolist()) if i > self._last_id - ID_OVERLAP}
+        self.version += 1
+
+    def refresh(self):
+        """Fold in sales recorded since the last call; returns (daily, version)."""
+        with self._lock:
+            if self._built_at is None or time.monotonic() - self._built_at > HISTORY_REBUILD_TTL:
+                self.daily, self._last_id, self._recent_ids = pd.DataFrame(), 0, set()
+                self._fold(read_table_csv("sales", order="id"))
+                self._built_at = time.monotonic()
+                self.version += 1
+            else:
+                # Overlap the watermark: a sale can commit after one with a higher id
+                params = [("id", f"gt.{max(self._last_id - ID_OVERLAP, 0)}")]
+                self._fold(read_table_csv("sales", params, order="id"))
+            return self.daily, self.version
+
+_histories = {}  # branch -> DemandHistory
+_histories_lock = threading.Lock()
+
+def demand_history() -> DemandHistory:
+    """The demand history of the current branch."""
+    branch = current_branch()
+    with _histories_lock:
+        if branch not in _histories:
+            _histories[branch] = DemandHistory()
+        return _histories[branch]
+
+# ---------------- DEMAND PROFILE ----------------
+def demand_profile(daily: pd.DataFrame, today) -> pd.DataFrame:
+    """
+    Per-item demand over the trailing window ending yesterday, computed on the
+    whole days × items matrix at once:
+      daily_rate  - exponentially weighted mean of units per day
+      daily_std   - day-to-day standard deviation
+      dow_0..6    - Monday..Sunday factors (weekday mean / overall mean),
+                    shrunk toward 1 when there are few weeks of history
+    """
+    today = pd.Timestamp(today).normalize()
+    days = pd.date_range(end=today - pd.Timedelta(days=1), periods=FORECAST_WINDOW_DAYS, freq="D")
+    window = daily.reindex(days, fill_value=0.0)
+
+    profile = pd.DataFrame({
+        "daily_rate": window.ewm(halflife=DEMAND_HALFLIFE_DAYS).mean().iloc[-1],
+        "daily_std": window.std(ddof=1)
+    })
+    mean = window.mean()
+    raw = window.groupby(window.index.dayofweek).mean().div(mean.where(mean > 0)).fillna(1.0)
+    weeks = FORECAST_WINDOW_DAYS / 7
+    factors = 1 + (raw - 1) * (weeks / (weeks + SEASONALITY_PRIOR_WEEKS))
+    factors = factors.reindex(range(7), fill_value=1.0)
+    for dow in range(7):
+        profile[f"dow_{dow}"] = factors.loc[dow]
+    return profile
+
+# ---------------- REORDER SUGGESTIONS ----------------
+_profile_cache = {"key": None, "profile": None}
+_profile_lock = threading.Lock()
+
+def _cached_profile(today):
+    daily, version = demand_history().refresh()
+    key = (current_branch(), version, pd.Timestamp(today).normalize())
+    with _profile_lock:
+        if _profile_cache["key"] != key:
+            _profile_cache["profile"] = (
+                demand_profile(daily, today) if not daily.empty else pd.DataFrame(columns=PROFILE_COLUMNS, dtype=float)
+            )
+            _profile_cache["key"] = key
+        return _profile_cache["profile"]
+
+def _stock_on_hand(items_df):
+    if items_df.empty:
+        return pd.DataFrame(columns=["category", "on_hand", "fridges"])
+    per_fridge = items_df.groupby(["item_name", "fridge_no"], as_index=False)["quantity"].sum()
+    per_fridge = per_fridge[per_fridge["quantity"] > 0]
+    return pd.DataFrame({
+        "category": items_df.groupby("item_name")["category"].first(),
+        "on_hand": items_df.groupby("item_name")["quantity"].sum(),
+        "fridges": per_fridge.assign(
+            label=per_fridge["fridge_no"].astype(str) + ": " + per_fridge["quantity"].astype(str)
+        ).groupby("item_name")["label"].agg(", ".join)
+    })
+
+def reorder_suggestions(today=None) -> pd.DataFrame:
+    """
+    Reorder point and suggested quantity per item.
+      lead_demand   = expected units sold during the supplier lead time
+                      (daily rate × day-of-week factors of the coming days)
+      safety_stock  = SERVICE_Z × daily_std × √lead_time
+      reorder_point = lead_demand + safety_stock
+    Items at or below their reorder point get an order that brings stock up to
+    reorder_point + the demand expected over REVIEW_DAYS.
+    """
+    today = pd.Timestamp(today or pd.Timestamp.now(tz=FORECAST_TZ).tz_localize(None)).normalize()
+    profile = _cached_profile(today)
+    stock = _stock_on_hand(view_items())
+
+    report = stock.join(profile, how="outer")
+    if report.empty:
+        return pd.DataFrame(columns=REORDER_COLUMNS)
+    report[["on_hand", "daily_rate", "daily_std"]] = report[["on_hand", "daily_rate", "daily_std"]].fillna(0.0)
+    report[DOW_COLUMNS] = report[DOW_COLUMNS].fillna(1.0)
+
+    lead_times = view_lead_times().set_index("item_name")["lead_time_days"]
+    report["lead_time_days"] = lead_times.reindex(report.index).fillna(DEFAULT_LEAD_TIME_DAYS).astype(int)
+
+    # Cumulative day-of-week factor over the coming days, one column per item
+    lead = report["lead_time_days"].to_numpy()
+    horizon = int(lead.max()) + REVIEW_DAYS
+    coming = pd.date_range(today + pd.Timedelta(days=1), periods=horizon, freq="D").dayofweek
+    cumulative = np.cumsum(report[DOW_COLUMNS].to_numpy().T[coming], axis=0)  # horizon × items
+    columns = np.arange(len(report))
+    rate = report["daily_rate"].to_numpy()
+
+    report["lead_demand"] = rate * cumulative[lead - 1, columns]
+    review_demand = rate * (cumulative[lead + REVIEW_DAYS - 1, columns] - cumulative[lead - 1, columns])
+    report["safety_stock"] = SERVICE_Z * report["daily_std"] * np.sqrt(lead)
+    report["reorder_point"] = report["lead_demand"] + report["safety_stock"]
+    report["days_of_cover"] = np.where(rate > 0, report["on_hand"] / np.where(rate > 0, rate, 1), np.inf)
+    shortfall = report["reorder_point"] + review_demand - report["on_hand"]
+    needs_order = (rate > 0) & (report["on_hand"] <= report["reorder_point"])
+    report["suggested_qty"] = np.where(needs_order, np.ceil(shortfall.clip(lower=0)), 0).astype(int)
+
+    report = report.rename_axis("item_name").reset_index()
+    return report[REORDER_COLUMNS].sort_values(
+        ["suggested_qty", "days_of_cover"], ascending=[False, True], ignore_index=True
+    )
@@ -0,0 +1,132 @@
+import difflib
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # PyMuPDF
+import pandas as pd
+
+# ---------------- SETTINGS ----------------
+INGEST_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+MATCH_CUTOFF = 0.75  # minimum similarity for a fuzzy catalogue match
+
+# Header words that identify each invoice column
+COLUMN_HINTS = {
+    "description": ("description", "item", "product", "particular"),
+    "quantity": ("qty", "quantity", "kgs", "pcs"),
+    "unit_cost": ("unit price", "unit cost", "price", "rate"),
+    "amount": ("amount", "total")
+}
+
+# ---------------- PAGE EXTRACTION (runs in worker processes) ----------------
+_worker_doc = None
+
+def _init_worker(pdf_bytes):
+    # Each worker opens the document once and then handles page numbers only
+    global _worker_doc
+    _worker_doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+
+def _to_number(value):
+    if value is None:
+        return None
+    text = re.sub(r"[^\d.\-]", "", str(value).replace(",", ""))
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+def _map_columns(header):
+    """Map our column names to positions in a table header row."""
+    mapping = {}
+    for position, cell in enumerate(header):
+        label = (cell or "").strip().lower()
+        for column, hints in COLUMN_HINTS.items():
+            if column not in mapping and any(hint in label for hint in hints):
+                mapping[column] = position
+                break
+    return mapping
+
+def _extract_page(page_no):
+    """Line items from every table on one page, plus the time it took."""
+    started = time.perf_counter()
+    page = _worker_doc[page_no]
+    lines = []
+    for table in page.find_tables().tables:
+        rows = table.extract()
+        if len(rows) < 2:
+            continue
+        columns = _map_columns(rows[0])
+        if "description" not in columns or "quantity" not in columns:
+            continue
+        for row in rows[1:]:
+            description = (row[columns["description"]] or "").strip()
+            quantity = _to_number(row[columns["quantity"]])
+            if not description or not quantity:
+                continue  # blank, subtotal or carried-forward rows
+            lines.append({
+                "page": page_no + 1,
+                "description": " ".join(description.split()),
+                "quantity": quantity,
+                "unit_cost": _to_number(row[columns["unit_cost"]]) if "unit_cost" in columns else None,
+                "amount": _to_number(row[columns["amount"]]) if "amount" in columns else None
+            })
+    return page_no + 1, lines, time.perf_counter() - started
+
+# ---------------- CATALOGUE MATCHING ----------------
+def normalize_name(name: str) -> str:
+    """Upper-case, punctuation-free, token-sorted form used for matching."""
+    tokens = re.sub(r"[^A-Z0-9]+", " ", str(name).upper()).split()
+    return " ".join(sorted(tokens))
+
+def build_name_index(items_df: pd.DataFrame) -> dict:
+    """{normalized name: (item_name, category)} for every catalogue item."""
+    if items_df.empty:
+        return {}
+    products = items_df[["item_name", "category"]].drop_duplicates("item_name")
+    return {
+        normalize_name(name): (name, category)
+        for name, category in zip(products["item_name"], products["category"])
+    }
+
+def match_item(description: str, index: dict, keys=None):
+    """Return (item_name, category, score) for an invoice description, or Nones."""
+    normalized = normalize_name(description)
+    if normalized in index:
+        return (*index[normalized], 1.0)
+    candidates = difflib.get_close_matches(normalized, keys or list(index), n=1, cutoff=MATCH_CUTOFF)
+    if not candidates:
+        return None, None, 0.0
+    score = difflib.SequenceMatcher(None, normalized, candidates[0]).ratio()
+    return (*index[candidates[0]], round(score, 3))
+
+# ---------------- PIPELINE ----------------
+def ingest_invoice(pdf_bytes: bytes, items_df: pd.DataFrame):
+    """
+    Extract line items from a supplier invoice PDF, one page per worker process,
+    and match them to the catalogue.
+    Returns (review DataFrame, per-page timings DataFrame).
+    """
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        page_count = doc.page_count
+
+    with ProcessPoolExecutor(
+        max_workers=min(INGEST_WORKERS, page_count) or 1,
+        initializer=_init_worker,
+        initargs=(pdf_bytes,)
+    ) as pool:
+        results = list(pool.map(_extract_page, range(page_count)))
+
+    index = build_name_index(items_df)
+    keys = list(index)
+    lines, timings = [], []
+    for page, page_lines, seconds in results:
+        timings.append({"page": page, "lines": len(page_lines), "seconds": round(seconds, 4)})
+        for line in page_lines:
+            item_name, category, score = match_item(line["description"], index, keys)
+            lines.append({**line, "item_name": item_name, "category": category, "match_score": score})
+
+    review = pd.DataFrame(lines, columns=[
+        "page", "description", "item_name", "category", "match_score", "quantity", "unit_cost", "amount"
+    ])
+    return review, pd.DataFrame(timings)
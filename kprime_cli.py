@@ -0,0 +1,344 @@
+"""
+Batch jobs without the Streamlit UI, e.g. for overnight schedules:
+
+    python kprime_cli.py import-items items.csv
+    python kprime_cli.py import-pricing pricing.xlsx
+    python kprime_cli.py export sales --start 2026-10-01 --end 2026-10-31 -o sales.csv
+    python kprime_cli.py export audit --start 2026-10-01 --end 2026-10-31 -o audit.xlsx
+    python kprime_cli.py soa --all --month 2026-10 -o soa/
+    python kprime_cli.py po --date 2026-10-19 -o po/
+    python kprime_cli.py snapshot --check-drift
+
+Every command works on one branch (--branch) and uses the same
+.streamlit/secrets.toml as the app. Progress and throughput go to stderr.
+"""
+import argparse
+import calendar
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, datetime
+
+# A batch job should fail loudly, not leave writes in this machine's offline journal
+os.environ.setdefault("KPRIME_OFFLINE", "0")
+
+import pandas as pd
+
+from db_supabase import (
+    BRANCHES, DEFAULT_BRANCH, use_branch,
+    add_or_update_item, upload_tiered_pricing_to_db, stream_table_csv, read_table_csv,
+    view_customers, get_statement_of_account, get_sales_by_customer, view_receivables_summary,
+    reserve_po_block, get_po_sequence, take_stock_snapshot, stock_drift
+)
+from documents import LOGO, build_po_pdf, build_soa_pdf, po_number, po_filename, soa_filename
+from excel_export import date_params, new_workbook, table_frames, write_sheet
+
+# ---------------- SETTINGS ----------------
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_WORKERS = 8
+CHUNK_ROWS = 500            # upload rows read and applied per chunk
+EXPORT_DATE_COLUMNS = {"sales": "date", "audit": "timestamp"}
+EXPORT_TABLES = {"sales": "sales", "audit": "audit_log"}
+NO_AGING = {"current": 0, "days_30": 0, "days_60": 0, "days_90": 0}
+
+# ---------------- PROGRESS ----------------
+class Progress:
+    """Done count, rate and (if known) total on one stderr line, refreshed at most 4×/s."""
+
+    def __init__(self, label, unit="rows", total=None):
+        self.label, self.unit, self.total = label, unit, total
+        self.done = 0
+        self.started = time.perf_counter()
+        self._shown = 0.0
+        self._lock = threading.Lock()
+
+    def _line(self):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        of = f"/{self.total}" if self.total is not None else ""
+        return f"{self.label}: {self.done}{of} {self.unit} in {elapsed:.1f} s ({self.done / elapsed:,.1f} {self.unit}/s)"
+
+    def add(self, n=1):
+        with self._lock:
+            self.done += n
+            now = time.perf_counter()
+            if now - self._shown >= 0.25:
+                self._shown = now
+                print("\r" + self._line(), end="", file=sys.stderr, flush=True)
+
+    def close(self):
+        print("\r" + self._line(), file=sys.stderr, flush=True)
+
+def _read_chunks(path, chunk_rows):
+    """Upload rows in chunks; CSV is streamed, Excel has to be read whole first."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        yield from pd.read_csv(path, chunksize=chunk_rows)
+    elif ext in (".xlsx", ".xls"):
+        df = pd.read_excel(path, engine="openpyxl" if ext == ".xlsx" else "xlrd")
+        for start in range(0, len(df), chunk_rows):
+            yield df.iloc[start:start + chunk_rows]
+    else:
+        raise SystemExit(f"Unsupported file format: {ext} (use CSV or Excel)")
+
+def _month_range(month: str):
+    first = datetime.strptime(month, "%Y-%m").date()
+    return first, first.replace(day=calendar.monthrange(first.year, first.month)[1])
+
+# ---------------- IMPORT ITEMS ----------------
+ITEM_COLUMNS = ["item_name", "category", "quantity", "fridge_no"]
+
+def _fridge(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return str(value).strip()
+
+def _item_lines(chunk: pd.DataFrame) -> list:
+    """
+    Normalize a chunk like the upload page does and sum quantities per stock
+    row (item, category, fridge, lot, expiry), so each row gets one write.
+    An optional unit_cost column is weighted by quantity within a row.
+    """
+    lines = pd.DataFrame({
+        "item_name": chunk["item_name"].astype(str).str.strip().str.upper(),
+        "category": chunk["category"].astype(str).str.strip().str.upper(),
+        "quantity": pd.to_numeric(chunk["quantity"]).astype(int),
+        "fridge_no": chunk["fridge_no"].map(_fridge),
+        "lot_no": chunk["lot_no"].map(lambda v: None if pd.isna(v) else str(v)) if "lot_no" in chunk else None,
+        "expiry_date": chunk["expiry_date"].map(lambda v: None if pd.isna(v) else pd.to_datetime(v).date()) if "expiry_date" in chunk else None
+    })
+    cost = pd.to_numeric(chunk["unit_cost"], errors="coerce") if "unit_cost" in chunk else pd.Series(float("nan"), index=chunk.index)
+    lines = lines.assign(costed=lines["quantity"].where(cost.notna(), 0), amount=(lines["quantity"] * cost).fillna(0))
+    keys = ["item_name", "category", "fridge_no", "lot_no", "expiry_date"]
+    grouped = lines.groupby(keys, dropna=False, sort=False)[["quantity", "costed", "amount"]].sum().reset_index()
+    grouped["unit_cost"] = (grouped["amount"] / grouped["costed"]).where(grouped["costed"] > 0)
+    return grouped.drop(columns=["costed", "amount"]).to_dict("records")
+
+def import_items(args):
+    progress = Progress("import-items")
+
+    def apply(line):
+        with use_branch(args.branch):
+            add_or_update_item(
+                None, line["item_name"], line["category"], int(line["quantity"]), line["fridge_no"], args.user,
+                None if pd.isna(line["lot_no"]) else line["lot_no"],
+                None if pd.isna(line["expiry_date"]) else line["expiry_date"],
+                None if pd.isna(line["unit_cost"]) else float(line["unit_cost"])
+            )
+
+    with ThreadPoolExecutor(args.workers) as pool:
+        for chunk in _read_chunks(args.file, args.chunk_rows):
+            missing = [c for c in ITEM_COLUMNS if c not in chunk.columns]
+            if missing:
+                raise SystemExit(f"Missing required columns: {missing}")
+            # Distinct stock rows run in parallel; a chunk finishes before the
+            # next starts, so the same row is never written by two threads
+            list(pool.map(apply, _item_lines(chunk)))
+            progress.add(len(chunk))
+    progress.close()
+
+# ---------------- IMPORT PRICING ----------------
+def import_pricing(args):
+    # Each chunk is a handful of batched round trips; chunks run in order because
+    # they can touch the same item's tiers
+    progress = Progress("import-pricing")
+    skipped = []
+    with use_branch(args.branch):
+        for chunk in _read_chunks(args.file, args.chunk_rows):
+            skipped += upload_tiered_pricing_to_db(chunk, args.user)
+            progress.add(len(chunk))
+    progress.close()
+    if skipped:
+        print(f"Skipped rows with invalid item_id(s): {sorted(set(skipped))}", file=sys.stderr)
+
+# ---------------- EXPORT ----------------
+def export(args):
+    table, column = EXPORT_TABLES[args.what], EXPORT_DATE_COLUMNS[args.what]
+    # --start/--end are shop (Asia/Manila) days
+    params = []
+    if args.start:
+        params.append(date_params(column, args.start, args.start)[0])
+    if args.end:
+        params.append(date_params(column, args.end, args.end)[1])
+
+    progress = Progress(f"export {args.what}")
+    if args.output.lower().endswith(".xlsx"):
+        # Pages are parsed one at a time into a write-only workbook
+        workbook = new_workbook()
+        with use_branch(args.branch):
+            write_sheet(workbook, args.what.title(), table_frames(table, params), table, progress.add)
+        workbook.save(args.output)
+        progress.close()
+        return
+
+    out = open(args.output, "wb") if args.output != "-" else sys.stdout.buffer
+    try:
+        # Pages go straight from the response to the file; nothing is parsed
+        first = True
+        with use_branch(args.branch):
+            for chunk in stream_table_csv(table, params, order="id"):
+                out.write(chunk)
+                progress.add(chunk.count(b"\n") - (1 if first else 0))
+                first = False
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    progress.close()
+
+# ---------------- SOA ----------------
+def _write(path, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+
+def soa(args):
+    start_date, end_date = _month_range(args.month)
+    os.makedirs(args.output, exist_ok=True)
+    with use_branch(args.branch):
+        customers = view_customers()
+        aging = view_receivables_summary()
+    if customers.empty:
+        print("No customers found.", file=sys.stderr)
+        return
+    if not args.all:
+        customers = customers[customers["id"].isin(args.customer)]
+    aging = aging.set_index("customer_id") if not aging.empty else pd.DataFrame()
+    logo = os.path.join(APP_DIR, LOGO)
+    progress = Progress("soa", unit="statements", total=len(customers))
+
+    def fetch(customer):
+        # Database reads are I/O bound: one thread per customer
+        with use_branch(args.branch):
+            opening_balance, ledger_df = get_statement_of_account(customer["id"], start_date, end_date)
+            sales = get_sales_by_customer(customer["id"], start_date, end_date)
+        if ledger_df.empty and sales.empty and not opening_balance:
+            return None  # no activity and nothing owed
+        if "date" in sales.columns:
+            sales = sales[["date"] + [c for c in sales.columns if c != "date"]]
+        closing_balance = ledger_df["balance"].iloc[-1] if not ledger_df.empty else opening_balance
+        customer_aging = aging.loc[customer["id"]].to_dict() if customer["id"] in aging.index else NO_AGING
+        return (customer["id"], customer["name"], start_date, end_date, sales,
+                opening_balance, closing_balance, customer_aging, logo)
+
+    written = 0
+    with ThreadPoolExecutor(args.workers) as threads, ProcessPoolExecutor(args.workers) as processes:
+        # PDF layout is CPU bound: rendered in worker processes as the data arrives
+        rendering = []
+        for job in threads.map(fetch, customers.to_dict("records")):
+            if job is None:
+                progress.add()
+                continue
+            rendering.append((job[0], processes.submit(build_soa_pdf, *job)))
+        for customer_id, future in rendering:
+            _write(os.path.join(args.output, soa_filename(customer_id, start_date, end_date)), future.result())
+            written += 1
+            progress.add()
+    progress.close()
+    print(f"Wrote {written} statement(s) to {args.output}", file=sys.stderr)
+
+# ---------------- PURCHASE ORDERS ----------------
+def po(args):
+    order_date_sql = args.date
+    pickup_date_sql = args.pickup or args.date
+    os.makedirs(args.output, exist_ok=True)
+
+    with use_branch(args.branch):
+        sales = read_table_csv("sales", date_params("date", order_date_sql, order_date_sql), order="id")
+        customers = view_customers()
+    if sales.empty:
+        print(f"No sales on {order_date_sql}.", file=sys.stderr)
+        return
+    sales = sales[sales["customer_id"].notna()]
+    # Cart sales share an order_id; older rows are grouped by date
+    sales["order_ref"] = sales["order_id"].astype(object).fillna(sales["date"].astype(str))
+    orders = list(sales.groupby(["customer_id", "order_ref"], sort=False))
+    buyers = customers.set_index("id").to_dict("index") if not customers.empty else {}
+
+    # ✅ One round trip reserves every PO number of the run
+    with use_branch(args.branch):
+        reserve_po_block(order_date_sql, len(orders))
+        sequences = [get_po_sequence(order_date_sql) for _ in orders]
+
+    logo = os.path.join(APP_DIR, LOGO)
+    progress = Progress("po", unit="orders", total=len(orders))
+    with ProcessPoolExecutor(args.workers) as processes:
+        rendering = []
+        for ((customer_id, _), lines), seq in zip(orders, sequences):
+            customer = buyers.get(int(customer_id), {})
+            buyer = {key: customer.get(key, "") or "" for key in ("name", "address", "phone", "email")}
+            rendering.append((
+                po_filename(order_date_sql, buyer["name"], seq),
+                processes.submit(
+                    build_po_pdf, po_number(order_date_sql, seq), order_date_sql, pickup_date_sql, buyer,
+                    lines[["item_name", "quantity", "selling_price"]].astype(object).to_dict("records"), logo
+                )
+            ))
+        for filename, future in rendering:
+            _write(os.path.join(args.output, filename), future.result())
+            progress.add()
+    progress.close()
+    print(f"Wrote {len(rendering)} purchase order(s) to {args.output}", file=sys.stderr)
+
+# ---------------- STOCK SNAPSHOT ----------------
+def snapshot(args):
+    # Run from cron (e.g. nightly) so stock history never replays more than a day of audit rows
+    with use_branch(args.branch):
+        snap = take_stock_snapshot()
+        print(f"Snapshot #{snap['id']} of {args.branch}: {snap['item_rows']} stock rows at {snap['taken_at']}", file=sys.stderr)
+        if args.check_drift:
+            drift = stock_drift()
+            if drift.empty:
+                print("No drift: live stock matches the replayed history.", file=sys.stderr)
+            else:
+                print(drift.to_string(index=False))
+                raise SystemExit(f"{len(drift)} stock row(s) drifted from the audit log")
+
+# ---------------- ENTRY POINT ----------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="KPrime batch jobs")
+    parser.add_argument("--branch", choices=sorted(BRANCHES), default=DEFAULT_BRANCH)
+    parser.add_argument("--user", default="cli", help="username recorded in the audit log")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("import-items", help="add or update stock from a CSV/Excel file")
+    p.add_argument("file")
+    p.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    p.set_defaults(run=import_items)
+
+    p = commands.add_parser("import-pricing", help="upsert pricing tiers from a CSV/Excel file")
+    p.add_argument("file")
+    p.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    p.set_defaults(run=import_pricing)
+
+    p = commands.add_parser("export", help="stream sales or the audit log to CSV (or .xlsx)")
+    p.add_argument("what", choices=sorted(EXPORT_TABLES))
+    p.add_argument("--start", help="first day (YYYY-MM-DD)")
+    p.add_argument("--end", help="last day (YYYY-MM-DD)")
+    p.add_argument("-o", "--output", default="-", help="file to write (.xlsx for Excel); - for stdout")
+    p.set_defaults(run=export)
+
+    p = commands.add_parser("soa", help="statement of account PDFs for a month")
+    who = p.add_mutually_exclusive_group(required=True)
+    who.add_argument("--all", action="store_true", help="every customer with activity or a balance")
+    who.add_argument("--customer", type=int, action="append", help="customer id (repeatable)")
+    p.add_argument("--month", default=date.today().strftime("%Y-%m"), help="YYYY-MM")
+    p.add_argument("-o", "--output", default="soa")
+    p.set_defaults(run=soa)
+
+    p = commands.add_parser("po", help="purchase order PDFs for every order on a date")
+    p.add_argument("--date", required=True, help="order date (YYYY-MM-DD)")
+    p.add_argument("--pickup", help="pickup date printed on the POs; defaults to --date")
+    p.add_argument("-o", "--output", default="po")
+    p.set_defaults(run=po)
+
+    p = commands.add_parser("snapshot", help="snapshot stock for point-in-time history")
+    p.add_argument("--check-drift", action="store_true", help="also compare live stock with the replayed audit log")
+    p.set_defaults(run=snapshot)
+
+    args = parser.parse_args(argv)
+    args.run(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+from resilience import BackendUnavailable, transport
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; replays are then only serialized within one process
+    fcntl = None
+
+# ---------------- SETTINGS ----------------
+OFFLINE_JOURNAL_PATH = os.environ.get(
+    "KPRIME_OFFLINE_JOURNAL", os.path.join(os.path.expanduser("~"), ".kprime", "offline_journal.sqlite3")
+)
+OFFLINE_ENABLED = os.environ.get("KPRIME_OFFLINE", "1") != "0"
+REPLAY_INTERVAL = 5.0   # seconds between replay passes
+REPLAY_BATCH = 50       # entries read and settled per batch
+
+# pending   - acknowledged to the user, not yet applied
+# done      - applied
+# conflict  - applied, but the result differs from what was acknowledged
+#             (e.g. a sale found less stock); needs a look
+# held      - not applied: the stock it assumed had changed since it was
+#             queued; apply it anyway (release) or drop it (resolve)
+# failed    - the database rejected it; kept so nothing is lost silently
+# discarded - a held entry dropped after review
+SCHEMA = """
+create table if not exists journal (
+    seq integer primary key autoincrement,
+    operation text not null,
+    branch text not null,
+    payload text not null,
+    expected text,
+    status text not null default 'pending',
+    detail text,
+    attempts integer not null default 0,
+    queued_at text not null,
+    synced_at text
+);
+create index if not exists journal_status_idx on journal (status, seq);
+"""
+
+def _json_default(value):
+    # numpy scalars from DataFrame rows, dates from date pickers
+    return value.item() if hasattr(value, "item") else str(value)
+
+class OfflineJournal:
+    """
+    Durable, ordered log of writes made while the database is unreachable.
+    Each entry is committed to SQLite (WAL, synchronous=FULL) before it is
+    acknowledged, so a closed browser or a restarted app loses nothing.
+    """
+
+    def __init__(self, path=OFFLINE_JOURNAL_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("pragma journal_mode=wal")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("pragma synchronous=full")
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def enqueue(self, operation: str, branch: str, params: dict, expected=None) -> int:
+        """Append a write (its arguments by name); returns the entry's seq."""
+        payload = json.dumps(params, default=_json_default)
+        with self._connect() as conn:
+            cur = conn.execute(
+                "insert into journal (operation, branch, payload, expected, queued_at) values (?, ?, ?, ?, ?)",
+                (operation, branch, payload, json.dumps(expected) if expected else None, datetime.now().isoformat())
+            )
+            return cur.lastrowid
+
+    def pending(self, limit=REPLAY_BATCH) -> list:
+        with self._connect() as conn:
+            return conn.execute(
+                "select * from journal where status = 'pending' order by seq limit ?", (limit,)
+            ).fetchall()
+
+    def pending_count(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("select count(*) from journal where status = 'pending'").fetchone()[0]
+
+    def settle(self, results):
+        """Record the outcome of a batch: (seq, status, detail) per entry."""
+        now = datetime.now().isoformat()
+        with self._connect() as conn:
+            conn.executemany(
+                "update journal set status = ?, detail = ?, attempts = attempts + 1, synced_at = ? where seq = ?",
+                [(status, detail, now if status != "pending" else None, seq) for seq, status, detail in results]
+            )
+
+    def resolve(self, seq: int):
+        """Mark a conflict or failure as reviewed; a held entry is dropped unapplied."""
+        with self._connect() as conn:
+            conn.execute(
+                "update journal set status = case status when 'held' then 'discarded' else 'done' end "
+                "where seq = ? and status in ('conflict', 'failed', 'held')", (seq,)
+            )
+
+    def release(self, seq: int):
+        """Queue a held entry again without its stock check, to be applied as it was made."""
+        with self._connect() as conn:
+            conn.execute("update journal set status = 'pending', expected = null where seq = ? and status = 'held'", (seq,))
+
+    def entries(self, statuses=("pending", "conflict", "held", "failed")) -> pd.DataFrame:
+        marks = ",".join("?" * len(statuses))
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"select seq, operation, branch, status, detail, attempts, queued_at, synced_at, payload "
+                f"from journal where status in ({marks}) order by seq", statuses
+            ).fetchall()
+        return pd.DataFrame([dict(r) for r in rows])
+
+    @contextmanager
+    def replay_lock(self):
+        """Yields True if this process may replay now (one replayer per journal file)."""
+        if fcntl is None:
+            yield True
+            return
+        with open(f"{self.path}.lock", "a+b") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+# ---------------- REPLAYER ----------------
+class Replayer:
+    """
+    Background thread that applies pending entries in order once the database
+    answers again. handlers maps an operation name to a function
+    (branch, params, expected, queued_at) -> (status, detail).
+    Entries are read and settled REPLAY_BATCH at a time; a replay pass stops at
+    the first entry that cannot reach the database, so order is never broken.
+    """
+
+    def __init__(self, journal: OfflineJournal, handlers: dict, interval=REPLAY_INTERVAL):
+        self.journal = journal
+        self.handlers = handlers
+        self.interval = interval
+        self._wake = threading.Event()
+        self._pass_lock = threading.Lock()
+        self._thread = None
+        self.stats = {"passes": 0, "applied": 0, "conflicts": 0, "held": 0, "failed": 0}
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="offline-replayer", daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.replay()
+            except Exception:
+                pass  # the next pass tries again; entries stay pending
+
+    def replay(self) -> int:
+        """Apply pending entries now; returns how many were settled."""
+        if transport.breaker.state == "open":
+            return 0
+        settled = 0
+        with self._pass_lock, self.journal.replay_lock() as allowed:
+            if not allowed:
+                return 0
+            self.stats["passes"] += 1
+            while True:
+                batch = self.journal.pending()
+                if not batch:
+                    return settled
+                results, reachable = [], True
+                for entry in batch:
+                    expected = json.loads(entry["expected"]) if entry["expected"] else None
+                    try:
+                        status, detail = self.handlers[entry["operation"]](
+                            entry["branch"], json.loads(entry["payload"]), expected, entry["queued_at"]
+                        )
+                    except BackendUnavailable:
+                        reachable = False
+                        break
+                    except Exception as e:
+                        status, detail = "failed", f"{type(e).__name__}: {e}"
+                    results.append((entry["seq"], status, detail))
+                    self.stats[{"done": "applied", "conflict": "conflicts", "held": "held", "failed": "failed"}[status]] += 1
+                self.journal.settle(results)
+                settled += len(results)
+                if not reachable:
+                    return settled
@@ -0,0 +1,346 @@
+"""
+JSON API for the counter tablets, so a sale does not cost a Streamlit rerun:
+
+    KPRIME_POS_API_KEY=... python pos_api.py --port 8502 --branch kprime
+
+    GET  /health
+    GET  /stock?item_id=12            or ?item_name=BEEF
+    GET  /customers?q=ANN             or ?id=3
+    POST /quote  {"lines": [{"item_id": 12, "quantity": 3, "override_price": null}]}
+    POST /sales  {"lines": [...], "customer_id": 3, "user": "tablet-1", "idempotency_key": "<uuid>"}
+
+Every request sends the key in an X-API-Key header. Connections are kept
+alive, reads come from the shared table snapshots, and sales arriving
+together are group-committed in one database call. A tablet that retries a
+sale with the same idempotency_key gets the original result back.
+"""
+import argparse
+import hmac
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# The API answers for the database; it must not queue sales in a local journal
+os.environ.setdefault("KPRIME_OFFLINE", "0")
+
+import streamlit as st
+
+from db_supabase import BRANCHES, DEFAULT_BRANCH, use_branch, table_snapshot, record_orders
+from resilience import BackendUnavailable, WRITE_DEADLINE, resilience_stats
+
+# ---------------- SETTINGS ----------------
+BATCH_MAX = 32          # orders per group commit
+BATCH_WAIT = 0.005      # seconds the first order of a batch waits for company
+MAX_BODY = 1 << 20      # bytes
+CUSTOMER_MATCHES = 20
+
+def _api_key():
+    key = os.environ.get("KPRIME_POS_API_KEY")
+    if key:
+        return key
+    try:
+        return st.secrets["pos"]["api_key"]
+    except (KeyError, FileNotFoundError):
+        return None
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+# ---------------- WARM INDEXES ----------------
+class WarmIndexes:
+    """
+    Lookup structures derived from the table snapshots of one branch.
+    Each is rebuilt only when its snapshot's version changes, so a request
+    is a couple of dict lookups.
+    """
+
+    def __init__(self, branch):
+        self.branch = branch
+        self._lock = threading.Lock()
+        self._built = {}  # table -> (snapshot version, index)
+
+    def _index(self, table, build):
+        with use_branch(self.branch):
+            snapshot = table_snapshot(table)
+        with self._lock:
+            version, index = self._built.get(table, (None, None))
+            if version != snapshot.version:
+                index = build(snapshot.frame)
+                self._built[table] = (snapshot.version, index)
+            return index
+
+    def stock(self):
+        def build(items):
+            by_name = {}
+            for row in items.to_dict("records") if not items.empty else []:
+                entry = by_name.setdefault(row["item_name"], {"item_name": row["item_name"], "category": row["category"], "on_hand": 0, "fridges": {}})
+                entry["on_hand"] += int(row["quantity"])
+                fridge = str(row["fridge_no"])
+                entry["fridges"][fridge] = entry["fridges"].get(fridge, 0) + int(row["quantity"])
+            ids = {int(row["item_id"]): row["item_name"] for row in items.to_dict("records")} if not items.empty else {}
+            return by_name, ids
+        return self._index("items", build)
+
+    def tiers(self):
+        def build(tiers):
+            by_item = {}
+            for tier in tiers.to_dict("records") if not tiers.empty else []:
+                max_qty = tier["max_qty"]
+                by_item.setdefault(int(tier["item_id"]), []).append(
+                    (int(tier["min_qty"]), None if max_qty is None or max_qty != max_qty else int(max_qty), float(tier["price_per_unit"]))
+                )
+            return by_item
+        return self._index("pricing_tiers", build)
+
+    def customers(self):
+        def build(customers):
+            if customers.empty:
+                return {}
+            rows = customers.astype(object).where(customers.notna(), None).to_dict("records")
+            return {int(r["id"]): r for r in rows}
+        return self._index("customers", build)
+
+    def price(self, item_id, quantity):
+        """Same rule as get_tiered_prices: the matching tier with the highest min_qty."""
+        best = None
+        for min_qty, max_qty, price in self.tiers().get(int(item_id), ()):
+            if min_qty <= quantity and (max_qty is None or max_qty >= quantity):
+                if best is None or min_qty > best[0]:
+                    best = (min_qty, price)
+        return best[1] if best else None
+
+# ---------------- GROUP COMMIT ----------------
+class OrderBatcher:
+    """
+    Collects sales from concurrent requests and records them with one
+    record_orders call: the first order waits at most BATCH_WAIT for others,
+    and orders keep arriving while a batch is in flight, so batches grow
+    with load.
+    """
+
+    def __init__(self, branch, max_size=BATCH_MAX, wait=BATCH_WAIT):
+        self.branch = branch
+        self.max_size = max_size
+        self.wait = wait
+        self._queue = queue.Queue()
+        self.stats = {"orders": 0, "batches": 0, "largest": 0}
+        threading.Thread(target=self._run, name=f"order-batcher-{branch}", daemon=True).start()
+
+    def submit(self, order) -> Future:
+        future = Future()
+        self._queue.put((order, future))
+        return future
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.wait
+        while len(batch) < self.max_size:
+            try:
+                batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                with use_branch(self.branch):
+                    results = record_orders([order for order, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.stats["orders"] += len(batch)
+            self.stats["batches"] += 1
+            self.stats["largest"] = max(self.stats["largest"], len(batch))
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+# ---------------- HANDLERS ----------------
+def _int_param(query, name):
+    try:
+        return int(query[name])
+    except ValueError:
+        raise ApiError(400, f"{name} must be an integer")
+
+def _lines(body):
+    lines = body.get("lines")
+    if not isinstance(lines, list) or not lines:
+        raise ApiError(400, "lines must be a non-empty list")
+    try:
+        parsed = [{
+            "item_id": int(line["item_id"]),
+            "quantity": int(line["quantity"]),
+            "override_price": float(line["override_price"]) if line.get("override_price") else None
+        } for line in lines]
+    except (KeyError, TypeError, ValueError):
+        raise ApiError(400, "each line needs an integer item_id and quantity")
+    if any(line["quantity"] <= 0 for line in parsed):
+        raise ApiError(400, "quantities must be positive")
+    return parsed
+
+class PosApi:
+    def __init__(self, branch):
+        self.branch = branch
+        self.indexes = WarmIndexes(branch)
+        self.batcher = OrderBatcher(branch)
+
+    def health(self, query, body):
+        return 200, {"branch": self.branch, "batches": self.batcher.stats, "database": resilience_stats()}
+
+    def stock(self, query, body):
+        by_name, ids = self.indexes.stock()
+        if "item_id" in query:
+            item_name = ids.get(_int_param(query, "item_id"))
+        else:
+            item_name = query.get("item_name", "").strip().upper()
+        if item_name not in by_name:
+            raise ApiError(404, "item not found")
+        return 200, by_name[item_name]
+
+    def customers(self, query, body):
+        customers = self.indexes.customers()
+        if "id" in query:
+            customer = customers.get(_int_param(query, "id"))
+            if customer is None:
+                raise ApiError(404, "customer not found")
+            return 200, customer
+        needle = query.get("q", "").strip().upper()
+        matches = [c for c in customers.values() if needle in str(c.get("name", "")).upper()]
+        return 200, {"customers": matches[:CUSTOMER_MATCHES]}
+
+    def quote(self, query, body):
+        _, ids = self.indexes.stock()
+        priced, total = [], 0.0
+        for line in _lines(body):
+            price = line["override_price"] or self.indexes.price(line["item_id"], line["quantity"])
+            line_total = line["quantity"] * (price or 0.0)
+            total += line_total
+            priced.append({**line, "item_name": ids.get(line["item_id"]), "price_per_unit": price, "line_total": line_total})
+        return 200, {"lines": priced, "total": total, "missing_price": any(l["price_per_unit"] is None for l in priced)}
+
+    def sales(self, query, body):
+        # Reject what the database would fail on, before it joins a batch
+        try:
+            key = uuid.UUID(str(body["idempotency_key"])) if body.get("idempotency_key") else uuid.uuid4()
+        except ValueError:
+            raise ApiError(400, "idempotency_key must be a UUID")
+        customer_id = body.get("customer_id")
+        if customer_id is not None:
+            try:
+                customer_id = int(customer_id)
+            except (TypeError, ValueError):
+                raise ApiError(400, "customer_id must be an integer")
+        order = {
+            "lines": _lines(body),
+            "customer_id": customer_id,
+            "user": str(body.get("user") or "pos"),
+            "idempotency_key": str(key)
+        }
+        order_id, consumed, message = self.batcher.submit(order).result(timeout=WRITE_DEADLINE * 2)
+        if order_id is None:
+            return 409, {"recorded": False, "message": message}
+        return 201, {"recorded": True, "order_id": order_id, "consumed": consumed, "message": message}
+
+    routes = {
+        ("GET", "/health"): health,
+        ("GET", "/stock"): stock,
+        ("GET", "/customers"): customers,
+        ("POST", "/quote"): quote,
+        ("POST", "/sales"): sales
+    }
+
+def make_handler(api: PosApi, api_key: str, verbose=False):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive: one connection per tablet
+
+        def log_message(self, fmt, *args):
+            if verbose:
+                super().log_message(fmt, *args)
+
+        def _send(self, status, payload, headers=()):
+            data = json.dumps(payload, default=str).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _handle(self, method):
+            url = urlparse(self.path)
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+            except ValueError:
+                length = -1
+            raw = self.rfile.read(length) if 0 < length <= MAX_BODY else b""
+            try:
+                # An unread body would be parsed as the next request: drop the connection
+                if length > MAX_BODY:
+                    self.close_connection = True
+                    raise ApiError(413, "request body too large")
+                if length < 0:
+                    self.close_connection = True
+                    raise ApiError(400, "Content-Length must be a non-negative integer")
+                if not hmac.compare_digest(self.headers.get("X-API-Key", ""), api_key):
+                    raise ApiError(401, "missing or wrong X-API-Key")
+                route = PosApi.routes.get((method, url.path))
+                if route is None:
+                    raise ApiError(404, "no such endpoint")
+                query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                try:
+                    body = json.loads(raw) if raw else {}
+                except ValueError:
+                    raise ApiError(400, "body is not valid JSON")
+                status, payload = route(api, query, body)
+                self._send(status, payload)
+            except ApiError as e:
+                self._send(e.status, {"error": str(e)})
+            except BackendUnavailable:
+                self._send(503, {"error": "database unavailable; retry with the same idempotency_key"}, [("Retry-After", "5")])
+            except Exception as e:
+                self._send(500, {"error": f"{type(e).__name__}: {e}"})
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_POST(self):
+            self._handle("POST")
+
+    return Handler
+
+class PosServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # tablets reconnecting at once after a network blip
+
+def serve(host, port, branch, api_key, verbose=False) -> PosServer:
+    return PosServer((host, port), make_handler(PosApi(branch), api_key, verbose))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="KPrime point-of-sale API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8502)
+    parser.add_argument("--branch", choices=sorted(BRANCHES), default=DEFAULT_BRANCH)
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    api_key = _api_key()
+    if not api_key:
+        sys.exit("Set KPRIME_POS_API_KEY (or [pos] api_key in secrets.toml) before starting the API.")
+    server = serve(args.host, args.port, args.branch, api_key, args.verbose)
+    print(f"POS API for {args.branch} on http://{args.host}:{args.port}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,91 @@
+"""
+Sustained-load test for pos_api.py. Start a local backend (supabase start)
+and the API, then:
+
+    python pos_loadtest.py --url http://127.0.0.1:8502 --items 12 13 14 --clients 16 --seconds 30
+
+Each client is one keep-alive connection that records one-line sales back to
+back (with a quote first if --quote). Prints sales per second, latency
+percentiles and the API's batching counters.
+"""
+import argparse
+import os
+import random
+import statistics
+import threading
+import time
+import uuid
+from collections import Counter
+
+import httpx
+
+def _client(args, stop, latencies, statuses, lock):
+    with httpx.Client(base_url=args.url, headers={"X-API-Key": args.key}, timeout=30) as client:
+        while not stop.is_set():
+            lines = [{"item_id": random.choice(args.items), "quantity": args.quantity}]
+            started = time.perf_counter()
+            try:
+                if args.quote:
+                    client.post("/quote", json={"lines": lines})
+                status = client.post("/sales", json={
+                    "lines": lines,
+                    "customer_id": args.customer,
+                    "user": "loadtest",
+                    "idempotency_key": str(uuid.uuid4())
+                }).status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] += 1
+
+def _percentile(values, pct):
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+def run(args) -> dict:
+    stop, lock = threading.Event(), threading.Lock()
+    latencies, statuses = [], Counter()
+    threads = [
+        threading.Thread(target=_client, args=(args, stop, latencies, statuses, lock), daemon=True)
+        for _ in range(args.clients)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    with httpx.Client(base_url=args.url, headers={"X-API-Key": args.key}) as client:
+        health = client.get("/health").json()
+    return {
+        "seconds": round(elapsed, 1),
+        "requests": len(latencies),
+        "recorded": statuses[201],
+        "sales_per_second": round(statuses[201] / elapsed, 1),
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 1),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 1) if latencies else 0.0,
+        "statuses": dict(statuses),
+        "batches": health.get("batches")
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the POS API")
+    parser.add_argument("--url", default="http://127.0.0.1:8502")
+    parser.add_argument("--key", default=os.environ.get("KPRIME_POS_API_KEY", ""))
+    parser.add_argument("--items", type=int, nargs="+", required=True, help="item ids to sell (stock gets used up!)")
+    parser.add_argument("--quantity", type=int, default=1)
+    parser.add_argument("--customer", type=int, default=None)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=30)
+    parser.add_argument("--quote", action="store_true", help="quote each sale before recording it")
+    args = parser.parse_args()
+
+    for name, value in run(args).items():
+        print(f"{name:>17}: {value}")
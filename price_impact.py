@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+
+# ---------------- SETTINGS ----------------
+IMPACT_FREQS = {"Day": "D", "Week": "W", "Month": "M"}
+
+def _utc_naive(series):
+    return pd.to_datetime(series, utc=True, format="ISO8601").dt.tz_localize(None)
+
+# ---------------- ENGINE ----------------
+def _tier_bounds(history):
+    # Rows written before tier capture (no min_qty) apply to every quantity
+    low = pd.to_numeric(history["min_qty"], errors="coerce") if "min_qty" in history else pd.Series(np.nan, index=history.index)
+    high = pd.to_numeric(history["max_qty"], errors="coerce") if "max_qty" in history else pd.Series(np.nan, index=history.index)
+    return low.fillna(0).astype(float), high.fillna(np.inf).astype(float)
+
+def align_sales_with_prices(sales_df: pd.DataFrame, history_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Attach to every sale the last price change, at or before the sale, of the
+    pricing tier the sale fell in (min_qty <= quantity <= max_qty).
+    Each sale is paired with every tier range of its item that holds its
+    quantity, as-of joined per range, and the latest change among them
+    wins. Sales made before any matching change get NaN price columns.
+    """
+    sales = sales_df[["item_id", "item_name", "quantity", "selling_price", "total_sale", "date"]].copy()
+    sales["sold_at"] = _utc_naive(sales["date"])
+    sales["item_id"] = sales["item_id"].astype("int64")
+    sales["sale_row"] = np.arange(len(sales))
+
+    history = history_df[["item_id", "timestamp", "old_selling_price", "new_selling_price"]].copy()
+    history["min_key"], history["max_key"] = _tier_bounds(history_df)
+    history["changed_at"] = _utc_naive(history["timestamp"])
+    history["item_id"] = history["item_id"].astype("int64")
+    history = history.drop(columns="timestamp").sort_values("changed_at", kind="stable")
+
+    ranges = history[["item_id", "min_key", "max_key"]].drop_duplicates()
+    candidates = sales.merge(ranges, on="item_id", how="inner")
+    quantity = candidates["quantity"].astype(float)
+    candidates = candidates[(candidates["min_key"] <= quantity) & (quantity <= candidates["max_key"])]
+    matched = pd.merge_asof(
+        candidates.sort_values("sold_at", kind="stable"), history,
+        left_on="sold_at", right_on="changed_at",
+        by=["item_id", "min_key", "max_key"], direction="backward"
+    )
+    latest = (
+        matched.dropna(subset=["changed_at"])
+        .sort_values(["changed_at"], kind="stable")
+        .drop_duplicates("sale_row", keep="last")
+    )[["sale_row", "old_selling_price", "new_selling_price", "changed_at", "min_key", "max_key"]]
+
+    aligned = sales.merge(latest, on="sale_row", how="left").rename(columns={"min_key": "tier_min_qty", "max_key": "tier_max_qty"})
+    return aligned.drop(columns="sale_row").sort_values("sold_at", kind="stable", ignore_index=True)
+
+def price_change_impact(sales_df: pd.DataFrame, history_df: pd.DataFrame, period: str = "Month") -> pd.DataFrame:
+    """
+    Revenue impact of price changes per item and period.
+    Each sale is compared with the price its tier had just before the change
+    that applied to it: revenue_delta = qty × (new price − old price).
+    A price change leaves the unit cost alone, so the margin moves by the
+    same amount. Everything is computed column-wise.
+    """
+    if sales_df.empty or history_df.empty:
+        return pd.DataFrame()
+
+    aligned = align_sales_with_prices(sales_df, history_df)
+    qty = aligned["quantity"].to_numpy(dtype=float)
+    new_price = aligned["new_selling_price"].to_numpy(dtype=float)
+    old_price = aligned["old_selling_price"].to_numpy(dtype=float)
+
+    affected = ~np.isnan(new_price)
+    aligned["affected_qty"] = np.where(affected, qty, 0.0)
+    aligned["revenue_delta"] = np.where(affected, qty * (new_price - old_price), 0.0)
+    aligned["period"] = aligned["sold_at"].dt.to_period(IMPACT_FREQS[period]).dt.start_time
+
+    report = (
+        aligned.groupby(["period", "item_id", "item_name"], as_index=False, observed=True)
+        .agg(
+            sales=("quantity", "size"),
+            quantity=("quantity", "sum"),
+            affected_qty=("affected_qty", "sum"),
+            revenue=("total_sale", "sum"),
+            revenue_delta=("revenue_delta", "sum"),
+            price_in_effect=("new_selling_price", "last")
+        )
+    )
+    return report.sort_values(["period", "item_name"], ignore_index=True)
@@ -0,0 +1,202 @@
+import contextvars
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+import httpx
+
+# ---------------- SETTINGS ----------------
+READ_DEADLINE = 8.0        # seconds a read may take, retries and hedges included
+WRITE_DEADLINE = 15.0      # seconds a write may take
+ATTEMPT_TIMEOUT = 5.0      # cap on a single attempt inside the deadline
+RETRY_ATTEMPTS = 4
+BACKOFF_BASE = 0.1         # full-jitter backoff: uniform(0, min(cap, base × 2^attempt))
+BACKOFF_CAP = 2.0
+HEDGE_AFTER = 0.4          # send a duplicate read if the first has not answered by then
+HEDGE_WORKERS = 16
+BREAKER_FAILURES = 5       # consecutive failed attempts that open the circuit
+BREAKER_COOLDOWN = 15.0    # seconds the circuit stays open before one trial request
+# Not 500: PostgREST answers 500 for errors raised by the statement itself,
+# which fail the same way on every attempt and would trip the breaker
+RETRY_STATUSES = {429, 502, 503, 504, 520}
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+READ_METHODS = {"GET", "HEAD"}
+# Read-only (stable) database functions; PostgREST calls them with POST
+READ_RPCS = {"pnl_report", "stock_at", "stock_drift"}
+RPC_PATH = "/rest/v1/rpc/"
+
+def is_read(request: httpx.Request) -> bool:
+    """GET/HEAD requests and calls of the read-only functions in READ_RPCS."""
+    if request.method in READ_METHODS:
+        return True
+    path = request.url.path
+    return request.method == "POST" and path.startswith(RPC_PATH) and path[len(RPC_PATH):] in READ_RPCS
+
+class BackendUnavailable(httpx.TransportError):
+    """The database could not be reached within the deadline, or the circuit is open."""
+
+# ---------------- DEADLINES ----------------
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+@contextmanager
+def deadline(seconds: float):
+    """Bound every request made inside the block by one overall deadline."""
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def with_idempotency_key(builder, key: str):
+    """Mark a postgrest write as safe to retry; the server must dedupe on the key."""
+    builder.request.headers[IDEMPOTENCY_HEADER] = str(key)
+    return builder
+
+# ---------------- CIRCUIT BREAKER ----------------
+class CircuitBreaker:
+    """
+    closed    - requests flow; consecutive failures are counted
+    open      - requests fail fast with BackendUnavailable until the cooldown ends
+    half-open - one trial request is let through; success closes, failure re-opens.
+                A trial that settles neither way (it raised something other
+                than a transport error) expires after another cooldown.
+    """
+
+    def __init__(self, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.failure_threshold = failures
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_at = None  # when the current half-open trial was let through
+        self.stats = {"opened": 0, "rejected": 0}
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self._opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            now = time.monotonic()
+            trial_running = self._trial_at is not None and now - self._trial_at < self.cooldown
+            if now - self._opened_at >= self.cooldown and not trial_running:
+                self._trial_at = now
+                return True
+            self.stats["rejected"] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures, self._opened_at, self._trial_at = 0, None, None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_at is not None or (self._opened_at is None and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self._trial_at = None
+                self.stats["opened"] += 1
+
+# ---------------- TRANSPORT ----------------
+class ResilientTransport(httpx.BaseTransport):
+    """
+    httpx transport under the supabase and CSV clients.
+    Every request gets a deadline (the caller's, or READ/WRITE_DEADLINE) and a
+    per-attempt timeout inside it. Reads (see is_read), and writes carrying an
+    Idempotency-Key, are retried with jittered exponential backoff on network
+    errors and RETRY_STATUSES (gateway errors and throttling); reads that are
+    slower than HEDGE_AFTER get a duplicate and the first answer wins.
+    Other writes are sent once: retrying them could apply them twice.
+    """
+
+    def __init__(self, inner=None, breaker=None):
+        self._inner = inner or httpx.HTTPTransport()
+        self.breaker = breaker or CircuitBreaker()
+        self._pool = ThreadPoolExecutor(HEDGE_WORKERS, thread_name_prefix="db-hedge")
+        self._stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "failures": 0}
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def _send(self, request, budget):
+        timeout = max(min(ATTEMPT_TIMEOUT, budget - time.monotonic()), 0.001)
+        attempt = httpx.Request(
+            request.method, request.url, headers=request.headers, content=request.content,
+            extensions={**request.extensions, "timeout": {"connect": timeout, "read": timeout, "write": timeout, "pool": timeout}}
+        )
+        response = self._inner.handle_request(attempt)
+        try:
+            response.read()  # the body counts against the attempt timeout too
+        finally:
+            response.close()
+        return response
+
+    def _hedged(self, request, budget):
+        first = self._pool.submit(self._send, request, budget)
+        done, _ = wait([first], timeout=max(min(HEDGE_AFTER, budget - time.monotonic()), 0))
+        if done:
+            return first.result()
+        self._count("hedges")
+        second = self._pool.submit(self._send, request, budget)
+        pending, error = {first, second}, None
+        while pending:
+            done, pending = wait(pending, timeout=max(budget - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+            if not done:
+                raise httpx.TimeoutException("deadline exceeded", request=request)
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        self._count("hedge_wins")
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self._count("requests")
+        if not self.breaker.allow():
+            raise BackendUnavailable("database circuit is open", request=request)
+        request.read()
+        read = is_read(request)
+        retryable = read or IDEMPOTENCY_HEADER in request.headers
+        budget = _deadline.get() or time.monotonic() + (READ_DEADLINE if read else WRITE_DEADLINE)
+        attempts = RETRY_ATTEMPTS if retryable else 1
+
+        error, response = None, None
+        for attempt in range(attempts):
+            if attempt:
+                self._count("retries")
+                pause = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+                if time.monotonic() + pause >= budget:
+                    break
+                time.sleep(pause)
+            try:
+                response = self._hedged(request, budget) if read else self._send(request, budget)
+            except httpx.TransportError as e:
+                error, response = e, None
+                self.breaker.record_failure()
+                continue
+            if response.status_code not in RETRY_STATUSES:
+                self.breaker.record_success()
+                return response
+            self.breaker.record_failure()
+
+        self._count("failures")
+        if response is not None:
+            return response  # let the client raise its usual APIError for the status
+        raise BackendUnavailable(f"database request failed: {error}", request=request) from error
+
+transport = ResilientTransport()
+
+def resilience_stats() -> dict:
+    """Counters of the shared transport plus the circuit state."""
+    return {**transport.stats, **transport.breaker.stats, "circuit": transport.breaker.state}
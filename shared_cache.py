@@ -0,0 +1,114 @@
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+from contextlib import contextmanager
+
+import pyarrow as pa
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; the shared tier is simply disabled there
+    fcntl = None
+
+# ---------------- SETTINGS ----------------
+def _default_dir():
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "kprime_cache")
+
+SHARED_CACHE_DIR = os.environ.get("KPRIME_SHARED_CACHE_DIR", _default_dir())
+SHARED_CACHE_ENABLED = os.environ.get("KPRIME_SHARED_CACHE", "1") != "0"
+GENERATION_SLOTS = 64  # tables hash into these; a collision only causes an extra reload
+
+class SharedCache:
+    """
+    Table snapshots shared by every app process on one host.
+    Each table has a generation counter in a small memory-mapped file; writers
+    bump it, and snapshots are Arrow IPC files named <table>.<generation>.arrow
+    that readers memory-map. A per-table file lock makes sure only one process
+    queries the database for a given generation.
+    """
+
+    def __init__(self, directory=SHARED_CACHE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        size = GENERATION_SLOTS * 8
+        fd = os.open(os.path.join(directory, "generations.bin"), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._generations = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    # ---- generations ----
+    def _slot(self, key):
+        return (zlib.crc32(key.encode()) % GENERATION_SLOTS) * 8
+
+    def generation(self, key: str) -> int:
+        return struct.unpack_from("<Q", self._generations, self._slot(key))[0]
+
+    @contextmanager
+    def _locked(self, name):
+        with open(os.path.join(self.directory, f"{name}.lock"), "a+b") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def invalidate(self, key: str):
+        """Tell every process that its snapshot of key is stale."""
+        with self._locked("generations"):
+            struct.pack_into("<Q", self._generations, self._slot(key), self.generation(key) + 1)
+
+    # ---- snapshot files ----
+    def _path(self, key, generation):
+        return os.path.join(self.directory, f"{key}.{generation}.arrow")
+
+    def _read(self, path):
+        # Arrow buffers keep the mapping alive, so the frame stays valid even
+        # after a newer generation replaces the file
+        source = pa.memory_map(path)
+        return pa.ipc.open_file(source).read_all().to_pandas()
+
+    def _write(self, key, path, frame):
+        try:
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            return  # mixed-type column; serve this process only
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with pa.OSFile(tmp_path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+        # Older generations are dead; processes still mapping them keep their copy
+        for name in os.listdir(self.directory):
+            if name.startswith(f"{key}.") and name.endswith(".arrow") and os.path.join(self.directory, name) != path:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def load(self, key: str, loader):
+        """Frame for key at the current generation, loading it once across processes."""
+        path = self._path(key, self.generation(key))
+        if os.path.exists(path):
+            try:
+                return self._read(path)
+            except (OSError, pa.ArrowInvalid):
+                pass  # replaced or half-written; fall through to the locked path
+
+        with self._locked(key):
+            generation = self.generation(key)
+            path = self._path(key, generation)
+            if os.path.exists(path):
+                return self._read(path)
+            frame = loader()
+            # Publish only if no writer bumped the generation during the load
+            if self.generation(key) == generation:
+                self._write(key, path, frame)
+            return frame
+
+shared_cache = SharedCache() if fcntl is not None and SHARED_CACHE_ENABLED else None
@@ -0,0 +1,126 @@
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+
+import pandas as pd
+
+from resilience import BackendUnavailable
+from shared_cache import shared_cache
+
+# Sessions share snapshot frames; with copy-on-write a shallow copy is a cheap
+# view and any write a session makes lands in its own copy. (Always on from pandas 3.)
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+# ---------------- SETTINGS ----------------
+SNAPSHOT_TTL = 30  # seconds; bounds staleness from writers outside the app (e.g. SQL edits)
+
+_versions = itertools.count(1)
+
+@dataclass(frozen=True)
+class Snapshot:
+    """One immutable load of a table; version is unique per load in this process."""
+    key: str
+    version: int
+    loaded_at: float
+    frame: pd.DataFrame
+    shared_generation: int = 0  # generation of the shared tier the frame was read at
+
+    def df(self) -> pd.DataFrame:
+        """A shallow copy sessions can add columns to without affecting others."""
+        return self.frame.copy(deep=False)
+
+class SnapshotStore:
+    """
+    Process-wide table snapshots shared by every Streamlit session.
+    Concurrent misses for the same key are coalesced (single flight): one
+    caller runs the loader and the rest wait for its result.
+    With a shared tier, misses are served from the other processes' snapshot
+    files and invalidations are broadcast to them.
+    While the database is unavailable, the last snapshot of a key is served
+    even if it is expired or invalidated.
+    """
+
+    def __init__(self, ttl=SNAPSHOT_TTL, shared=shared_cache):
+        self.ttl = ttl
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._snapshots = {}   # key -> Snapshot
+        self._inflight = {}    # (key, generation) -> Future of the load in progress
+        self._generation = {}  # key -> count of invalidations
+        self._last = {}        # key -> last snapshot loaded, kept through invalidations
+        self.stats = {"hits": 0, "loads": 0, "coalesced": 0, "stale": 0}
+
+    def _fresh(self, snapshot):
+        if time.monotonic() - snapshot.loaded_at > self.ttl:
+            return False
+        # Another process wrote to the table since we read it
+        return self.shared is None or snapshot.shared_generation == self.shared.generation(snapshot.key)
+
+    def get(self, key: str, loader) -> Snapshot:
+        with self._lock:
+            generation = self._generation.get(key, 0)
+            snapshot = self._snapshots.get(key)
+            if snapshot is not None and self._fresh(snapshot):
+                self.stats["hits"] += 1
+                return snapshot
+            # Loads started before the last invalidation are not joined
+            future = self._inflight.get((key, generation))
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[(key, generation)] = future
+                self.stats["loads"] += 1
+            else:
+                self.stats["coalesced"] += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            if self.shared is None:
+                snapshot = Snapshot(key, next(_versions), time.monotonic(), loader())
+            else:
+                # Read the generation first: a write landing mid-load makes the next get reload
+                shared_generation = self.shared.generation(key)
+                frame = self.shared.load(key, loader)
+                snapshot = Snapshot(key, next(_versions), time.monotonic(), frame, shared_generation)
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop((key, generation), None)
+                stale = self._last.get(key) if isinstance(e, BackendUnavailable) else None
+                if stale is not None:
+                    self.stats["stale"] += 1
+            if stale is None:
+                future.set_exception(e)
+                raise
+            # Not stored as fresh: the next get tries the database again
+            future.set_result(stale)
+            return stale
+        with self._lock:
+            # Keep it only if nobody wrote to the table while we were loading
+            if self._generation.get(key, 0) == generation:
+                self._snapshots[key] = snapshot
+            self._last[key] = snapshot
+            self._inflight.pop((key, generation), None)
+        future.set_result(snapshot)
+        return snapshot
+
+    def peek(self, key: str):
+        """The last snapshot loaded for key, however old; None if never loaded."""
+        with self._lock:
+            return self._last.get(key)
+
+    def invalidate(self, *keys):
+        """Drop snapshots after a write so the next read reloads, here and in other processes."""
+        with self._lock:
+            for key in keys:
+                self._generation[key] = self._generation.get(key, 0) + 1
+                self._snapshots.pop(key, None)
+        if self.shared is not None:
+            for key in keys:
+                self.shared.invalidate(key)
+
+snapshots = SnapshotStore()
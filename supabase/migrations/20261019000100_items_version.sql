@@ -0,0 +1,5 @@
+-- Row version used for optimistic (compare-and-swap) stock updates.
+-- Every quantity change bumps the version; an update that names a stale
+-- version matches no row, so concurrent writers can detect the conflict
+-- and retry instead of overwriting each other.
+alter table items add column if not exists version integer not null default 0;
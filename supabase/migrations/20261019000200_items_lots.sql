@@ -0,0 +1,9 @@
+-- Lot and expiry tracking for perishable stock.
+-- Each items row is one lot in one fridge; rows without an expiry date
+-- are allocated after every dated lot.
+alter table items add column if not exists lot_no text;
+alter table items add column if not exists expiry_date date;
+
+create index if not exists items_item_name_expiry_idx
+    on items (item_name, expiry_date, item_id)
+    where quantity > 0;
@@ -0,0 +1,14 @@
+-- Atomic PO number allocation.
+-- reserve_po_sequence() bumps the per-date counter by p_count in a single
+-- statement and returns the last number of the reserved block, so two
+-- callers can never receive the same number.
+create unique index if not exists po_sequence_date_key on po_sequence (date);
+
+create or replace function reserve_po_sequence(p_date date, p_count integer default 1)
+returns integer
+language sql
+as $$
+    insert into po_sequence (date, seq) values (p_date, p_count)
+    on conflict (date) do update set seq = po_sequence.seq + excluded.seq
+    returning seq;
+$$;
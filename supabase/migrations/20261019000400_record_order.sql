@@ -0,0 +1,45 @@
+-- Multi-line orders written in one transaction.
+-- record_order() applies every stock deduction with a version check, then
+-- inserts all sale lines and audit rows. If any lot changed since the client
+-- planned the order, the whole call rolls back with SQLSTATE 40001 so the
+-- client can re-plan and retry.
+alter table sales add column if not exists order_id uuid;
+create index if not exists sales_order_id_idx on sales (order_id);
+
+create or replace function record_order(p_deductions jsonb, p_sales jsonb, p_audit jsonb)
+returns setof items
+language plpgsql
+as $$
+declare
+    d record;
+    updated items;
+begin
+    for d in
+        select * from jsonb_to_recordset(p_deductions) as x(item_id bigint, version integer, quantity integer)
+    loop
+        update items
+           set quantity = items.quantity - d.quantity,
+               version = items.version + 1
+         where items.item_id = d.item_id
+           and items.version = d.version
+           and items.quantity >= d.quantity
+        returning * into updated;
+        if not found then
+            raise exception 'stock_conflict: item %', d.item_id using errcode = '40001';
+        end if;
+        return next updated;
+    end loop;
+
+    insert into sales (order_id, item_id, item_name, quantity, selling_price, total_sale, cost, profit, customer_id, overridden)
+    select order_id, item_id, item_name, quantity, selling_price, total_sale, cost, profit, customer_id, overridden
+      from jsonb_to_recordset(p_sales) as x(
+           order_id uuid, item_id bigint, item_name text, quantity integer, selling_price numeric,
+           total_sale numeric, cost numeric, profit numeric, customer_id bigint, overridden integer);
+
+    insert into audit_log (item_name, category, action, quantity, unit_cost, selling_price, username)
+    select item_name, category, action, quantity, unit_cost, selling_price, username
+      from jsonb_to_recordset(p_audit) as x(
+           item_name text, category text, action text, quantity integer,
+           unit_cost numeric, selling_price numeric, username text);
+end;
+$$;
@@ -0,0 +1,6 @@
+-- Tier-level detail for price history rows written by tier edits and uploads.
+alter table price_history add column if not exists tier_id bigint;
+alter table price_history add column if not exists min_qty integer;
+alter table price_history add column if not exists max_qty integer;
+
+create index if not exists price_history_item_ts_idx on price_history (item_id, timestamp);
@@ -0,0 +1,7 @@
+-- Barcode → catalogue item mapping used by scan receiving.
+create table if not exists barcodes (
+    barcode text primary key,
+    item_name text not null,
+    category text not null,
+    units_per_carton integer not null default 1
+);
@@ -0,0 +1,143 @@
+-- Customer receivables ledger.
+-- Every charge (sale) and payment is one ledger entry carrying the running
+-- balance after it. customer_balances holds the current balance so posting
+-- is O(1). open_amount is the unpaid part of a charge; payments settle the
+-- oldest charges first, so aging only has to look at open entries.
+create table if not exists customer_ledger (
+    id bigint generated by default as identity primary key,
+    customer_id bigint not null references customers (id) on delete cascade,
+    entry_date timestamptz not null default now(),
+    kind text not null check (kind in ('sale', 'payment', 'adjustment')),
+    reference text,
+    amount numeric not null,               -- charges positive, payments negative
+    open_amount numeric not null default 0,
+    balance numeric not null
+);
+create index if not exists customer_ledger_customer_date_idx on customer_ledger (customer_id, entry_date, id);
+create index if not exists customer_ledger_open_idx on customer_ledger (customer_id, entry_date) where open_amount <> 0;
+
+create table if not exists customer_balances (
+    customer_id bigint primary key references customers (id) on delete cascade,
+    balance numeric not null default 0,
+    updated_at timestamptz not null default now()
+);
+
+create or replace function ledger_post(p_customer_id bigint, p_kind text, p_amount numeric, p_reference text default null)
+returns customer_ledger
+language plpgsql
+as $$
+declare
+    v_balance numeric;
+    v_unapplied numeric := -p_amount;  -- payment still to settle against open charges
+    charge record;
+    entry customer_ledger;
+begin
+    insert into customer_balances (customer_id, balance) values (p_customer_id, p_amount)
+    on conflict (customer_id) do update
+        set balance = customer_balances.balance + excluded.balance, updated_at = now()
+    returning balance into v_balance;
+
+    if p_amount < 0 then
+        for charge in
+            select id, open_amount from customer_ledger
+             where customer_id = p_customer_id and open_amount > 0
+             order by entry_date, id
+             for update
+        loop
+            exit when v_unapplied <= 0;
+            update customer_ledger
+               set open_amount = open_amount - least(charge.open_amount, v_unapplied)
+             where id = charge.id;
+            v_unapplied := v_unapplied - least(charge.open_amount, v_unapplied);
+        end loop;
+    end if;
+
+    insert into customer_ledger (customer_id, kind, reference, amount, open_amount, balance)
+    values (
+        p_customer_id, p_kind, p_reference, p_amount,
+        case when p_amount > 0 then p_amount else -v_unapplied end,  -- overpayment stays open as a credit
+        v_balance
+    )
+    returning * into entry;
+    return entry;
+end;
+$$;
+
+-- Aging buckets from open entries only, for every customer in one query.
+create or replace view customer_receivables as
+select
+    b.customer_id,
+    c.name,
+    b.balance,
+    coalesce(sum(l.open_amount) filter (where l.entry_date >  now() - interval '30 days'), 0) as current,
+    coalesce(sum(l.open_amount) filter (where l.entry_date <= now() - interval '30 days'
+                                          and l.entry_date >  now() - interval '60 days'), 0) as days_30,
+    coalesce(sum(l.open_amount) filter (where l.entry_date <= now() - interval '60 days'
+                                          and l.entry_date >  now() - interval '90 days'), 0) as days_60,
+    coalesce(sum(l.open_amount) filter (where l.entry_date <= now() - interval '90 days'), 0) as days_90,
+    b.updated_at
+from customer_balances b
+join customers c on c.id = b.customer_id
+left join customer_ledger l on l.customer_id = b.customer_id and l.open_amount <> 0
+group by b.customer_id, c.name, b.balance, b.updated_at;
+
+-- Backfill from existing sales (only when the ledger is still empty).
+insert into customer_ledger (customer_id, entry_date, kind, reference, amount, open_amount, balance)
+select customer_id, date, 'sale', coalesce(order_id::text, id::text), total_sale, total_sale,
+       sum(total_sale) over (partition by customer_id order by date, id)
+  from sales
+ where customer_id is not null
+   and not exists (select 1 from customer_ledger);
+
+insert into customer_balances (customer_id, balance)
+select customer_id, sum(amount) from customer_ledger group by customer_id
+on conflict (customer_id) do nothing;
+
+-- record_order now also posts one ledger charge per customer in the order.
+create or replace function record_order(p_deductions jsonb, p_sales jsonb, p_audit jsonb)
+returns setof items
+language plpgsql
+as $$
+declare
+    d record;
+    c record;
+    updated items;
+begin
+    for d in
+        select * from jsonb_to_recordset(p_deductions) as x(item_id bigint, version integer, quantity integer)
+    loop
+        update items
+           set quantity = items.quantity - d.quantity,
+               version = items.version + 1
+         where items.item_id = d.item_id
+           and items.version = d.version
+           and items.quantity >= d.quantity
+        returning * into updated;
+        if not found then
+            raise exception 'stock_conflict: item %', d.item_id using errcode = '40001';
+        end if;
+        return next updated;
+    end loop;
+
+    insert into sales (order_id, item_id, item_name, quantity, selling_price, total_sale, cost, profit, customer_id, overridden)
+    select order_id, item_id, item_name, quantity, selling_price, total_sale, cost, profit, customer_id, overridden
+      from jsonb_to_recordset(p_sales) as x(
+           order_id uuid, item_id bigint, item_name text, quantity integer, selling_price numeric,
+           total_sale numeric, cost numeric, profit numeric, customer_id bigint, overridden integer);
+
+    insert into audit_log (item_name, category, action, quantity, unit_cost, selling_price, username)
+    select item_name, category, action, quantity, unit_cost, selling_price, username
+      from jsonb_to_recordset(p_audit) as x(
+           item_name text, category text, action text, quantity integer,
+           unit_cost numeric, selling_price numeric, username text);
+
+    for c in
+        select customer_id, order_id, sum(total_sale) as total
+          from jsonb_to_recordset(p_sales) as x(order_id uuid, customer_id bigint, total_sale numeric)
+         where customer_id is not null
+         group by customer_id, order_id
+    loop
+        perform ledger_post(c.customer_id, 'sale', c.total, c.order_id::text);
+    end loop;
+end;
+$$;
@@ -0,0 +1,7 @@
+-- Supplier lead time per catalogue item, used for reorder points.
+-- Items without a row use the default in forecasting.py.
+create table if not exists lead_times (
+    item_name text primary key,
+    lead_time_days integer not null check (lead_time_days > 0),
+    updated_at timestamptz not null default now()
+);
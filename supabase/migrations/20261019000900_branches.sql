@@ -0,0 +1,200 @@
+-- Branch partitioning.
+-- Every operational table carries the branch that owns the row and the app
+-- filters every query on it. Rows that existed before this migration belong
+-- to 'kprime'. Cross-branch reporting reads the per-branch rollups at the end.
+create table if not exists branches (
+    code text primary key,
+    name text not null
+);
+insert into branches (code, name) values
+    ('kprime', 'KPrime Food Solutions'),
+    ('steakhaven', 'Steak Haven')
+on conflict (code) do nothing;
+
+alter table items          add column if not exists branch text not null default 'kprime' references branches (code);
+alter table sales          add column if not exists branch text not null default 'kprime' references branches (code);
+alter table audit_log      add column if not exists branch text not null default 'kprime' references branches (code);
+alter table customers      add column if not exists branch text not null default 'kprime' references branches (code);
+alter table pricing_tiers  add column if not exists branch text not null default 'kprime' references branches (code);
+alter table price_history  add column if not exists branch text not null default 'kprime' references branches (code);
+alter table barcodes       add column if not exists branch text not null default 'kprime' references branches (code);
+alter table lead_times     add column if not exists branch text not null default 'kprime' references branches (code);
+alter table po_sequence    add column if not exists branch text not null default 'kprime' references branches (code);
+
+-- Branch-leading indexes so each location only scans its own rows
+create index if not exists items_branch_name_idx on items (branch, item_name);
+create index if not exists sales_branch_date_idx on sales (branch, date);
+create index if not exists sales_branch_customer_idx on sales (branch, customer_id);
+create index if not exists audit_log_branch_ts_idx on audit_log (branch, timestamp);
+create index if not exists customers_branch_idx on customers (branch);
+create index if not exists pricing_tiers_branch_item_idx on pricing_tiers (branch, item_id);
+create index if not exists price_history_branch_item_ts_idx on price_history (branch, item_id, timestamp);
+
+-- Lookup tables are keyed per branch
+alter table barcodes drop constraint if exists barcodes_pkey;
+alter table barcodes add primary key (branch, barcode);
+alter table lead_times drop constraint if exists lead_times_pkey;
+alter table lead_times add primary key (branch, item_name);
+
+-- PO numbers run per branch and date
+do $$
+declare
+    pk text;
+begin
+    select c.conname into pk
+      from pg_constraint c
+     where c.conrelid = 'po_sequence'::regclass and c.contype = 'p'
+       and c.conkey = array[(select attnum from pg_attribute where attrelid = 'po_sequence'::regclass and attname = 'date')];
+    if pk is not null then
+        execute format('alter table po_sequence drop constraint %I', pk);
+    end if;
+end;
+$$;
+drop index if exists po_sequence_date_key;
+create unique index if not exists po_sequence_branch_date_key on po_sequence (branch, date);
+
+drop function if exists reserve_po_sequence(date, integer);
+create or replace function reserve_po_sequence(p_branch text, p_date date, p_count integer default 1)
+returns integer
+language sql
+as $$
+    insert into po_sequence (branch, date, seq) values (p_branch, p_date, p_count)
+    on conflict (branch, date) do update set seq = po_sequence.seq + excluded.seq
+    returning seq;
+$$;
+
+-- record_order writes sale and audit rows for the caller's branch and only
+-- deducts that branch's stock.
+drop function if exists record_order(jsonb, jsonb, jsonb);
+create or replace function record_order(p_deductions jsonb, p_sales jsonb, p_audit jsonb, p_branch text)
+returns setof items
+language plpgsql
+as $$
+declare
+    d record;
+    c record;
+    updated items;
+begin
+    for d in
+        select * from jsonb_to_recordset(p_deductions) as x(item_id bigint, version integer, quantity integer)
+    loop
+        update items
+           set quantity = items.quantity - d.quantity,
+               version = items.version + 1
+         where items.item_id = d.item_id
+           and items.branch = p_branch
+           and items.version = d.version
+           and items.quantity >= d.quantity
+        returning * into updated;
+        if not found then
+            raise exception 'stock_conflict: item %', d.item_id using errcode = '40001';
+        end if;
+        return next updated;
+    end loop;
+
+    insert into sales (branch, order_id, item_id, item_name, quantity, selling_price, total_sale, cost, profit, customer_id, overridden)
+    select p_branch, order_id, item_id, item_name, quantity, selling_price, total_sale, cost, profit, customer_id, overridden
+      from jsonb_to_recordset(p_sales) as x(
+           order_id uuid, item_id bigint, item_name text, quantity integer, selling_price numeric,
+           total_sale numeric, cost numeric, profit numeric, customer_id bigint, overridden integer);
+
+    insert into audit_log (branch, item_name, category, action, quantity, unit_cost, selling_price, username)
+    select p_branch, item_name, category, action, quantity, unit_cost, selling_price, username
+      from jsonb_to_recordset(p_audit) as x(
+           item_name text, category text, action text, quantity integer,
+           unit_cost numeric, selling_price numeric, username text);
+
+    for c in
+        select customer_id, order_id, sum(total_sale) as total
+          from jsonb_to_recordset(p_sales) as x(order_id uuid, customer_id bigint, total_sale numeric)
+         where customer_id is not null
+         group by customer_id, order_id
+    loop
+        perform ledger_post(c.customer_id, 'sale', c.total, c.order_id::text);
+    end loop;
+end;
+$$;
+
+-- Receivables carry the customer's branch so the app can filter on it
+create or replace view customer_receivables as
+select
+    b.customer_id,
+    c.name,
+    b.balance,
+    coalesce(sum(l.open_amount) filter (where l.entry_date >  now() - interval '30 days'), 0) as current,
+    coalesce(sum(l.open_amount) filter (where l.entry_date <= now() - interval '30 days'
+                                          and l.entry_date >  now() - interval '60 days'), 0) as days_30,
+    coalesce(sum(l.open_amount) filter (where l.entry_date <= now() - interval '60 days'
+                                          and l.entry_date >  now() - interval '90 days'), 0) as days_60,
+    coalesce(sum(l.open_amount) filter (where l.entry_date <= now() - interval '90 days'), 0) as days_90,
+    b.updated_at,
+    c.branch
+from customer_balances b
+join customers c on c.id = b.customer_id
+left join customer_ledger l on l.customer_id = b.customer_id and l.open_amount <> 0
+group by b.customer_id, c.name, b.balance, b.updated_at, c.branch;
+
+-- ---------------- Per-branch rollups ----------------
+-- Daily sales totals per branch, kept current by a trigger on sales so the
+-- consolidated report never scans raw sales rows.
+create table if not exists branch_daily_sales (
+    branch text not null references branches (code),
+    day date not null,
+    lines integer not null default 0,
+    units numeric not null default 0,
+    total_sale numeric not null default 0,
+    cost numeric not null default 0,
+    profit numeric not null default 0,
+    primary key (branch, day)
+);
+
+create or replace function branch_daily_sales_apply(p_branch text, p_day date, p_sign integer,
+                                                    p_units numeric, p_total numeric, p_cost numeric, p_profit numeric)
+returns void
+language sql
+as $$
+    insert into branch_daily_sales (branch, day, lines, units, total_sale, cost, profit)
+    values (p_branch, p_day, p_sign, p_sign * p_units, p_sign * p_total, p_sign * p_cost, p_sign * p_profit)
+    on conflict (branch, day) do update set
+        lines = branch_daily_sales.lines + excluded.lines,
+        units = branch_daily_sales.units + excluded.units,
+        total_sale = branch_daily_sales.total_sale + excluded.total_sale,
+        cost = branch_daily_sales.cost + excluded.cost,
+        profit = branch_daily_sales.profit + excluded.profit;
+$$;
+
+create or replace function branch_daily_sales_trigger()
+returns trigger
+language plpgsql
+as $$
+begin
+    if tg_op in ('UPDATE', 'DELETE') then
+        perform branch_daily_sales_apply(old.branch, old.date::date, -1,
+            old.quantity, coalesce(old.total_sale, 0), coalesce(old.cost, 0), coalesce(old.profit, 0));
+    end if;
+    if tg_op in ('INSERT', 'UPDATE') then
+        perform branch_daily_sales_apply(new.branch, new.date::date, 1,
+            new.quantity, coalesce(new.total_sale, 0), coalesce(new.cost, 0), coalesce(new.profit, 0));
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists sales_branch_rollup on sales;
+create trigger sales_branch_rollup
+after insert or update or delete on sales
+for each row execute function branch_daily_sales_trigger();
+
+-- Backfill from existing sales (only when the rollup is still empty)
+insert into branch_daily_sales (branch, day, lines, units, total_sale, cost, profit)
+select branch, date::date, count(*), sum(quantity), sum(coalesce(total_sale, 0)), sum(coalesce(cost, 0)), sum(coalesce(profit, 0))
+  from sales
+ where not exists (select 1 from branch_daily_sales)
+ group by branch, date::date;
+
+-- Stock on hand per branch and category
+create or replace view branch_stock as
+select branch, category, count(distinct item_name) as products, sum(quantity) as units
+  from items
+ where quantity > 0
+ group by branch, category;
@@ -0,0 +1,81 @@
+-- Idempotent order recording.
+-- The app sends one key per checkout; a repeated call with the same key (a
+-- double-clicked button, a request retried after a timeout) returns the
+-- current item rows without deducting stock or inserting sales again.
+
+create table if not exists idempotency_keys (
+    key uuid primary key,
+    operation text not null,
+    branch text not null references branches (code),
+    created_at timestamptz not null default now()
+);
+
+-- Keys only need to outlive client retries; old ones can be purged, e.g.
+--   delete from idempotency_keys where created_at < now() - interval '7 days';
+create index if not exists idempotency_keys_created_at_idx on idempotency_keys (created_at);
+
+drop function if exists record_order(jsonb, jsonb, jsonb, text);
+create or replace function record_order(
+    p_deductions jsonb, p_sales jsonb, p_audit jsonb, p_branch text, p_idempotency_key uuid default null
+)
+returns setof items
+language plpgsql
+as $$
+declare
+    d record;
+    c record;
+    updated items;
+begin
+    if p_idempotency_key is not null then
+        -- The key row commits together with the order, or not at all
+        insert into idempotency_keys (key, operation, branch)
+        values (p_idempotency_key, 'record_order', p_branch)
+        on conflict (key) do nothing;
+        if not found then
+            return query
+                select i.* from items i
+                 where i.branch = p_branch
+                   and i.item_id in (select x.item_id from jsonb_to_recordset(p_deductions) as x(item_id bigint));
+            return;
+        end if;
+    end if;
+
+    for d in
+        select * from jsonb_to_recordset(p_deductions) as x(item_id bigint, version integer, quantity integer)
+    loop
+        update items
+           set quantity = items.quantity - d.quantity,
+               version = items.version + 1
+         where items.item_id = d.item_id
+           and items.branch = p_branch
+           and items.version = d.version
+           and items.quantity >= d.quantity
+        returning * into updated;
+        if not found then
+            raise exception 'stock_conflict: item %', d.item_id using errcode = '40001';
+        end if;
+        return next updated;
+    end loop;
+
+    insert into sales (branch, order_id, item_id, item_name, quantity, selling_price, total_sale, cost, profit, customer_id, overridden)
+    select p_branch, order_id, item_id, item_name, quantity, selling_price, total_sale, cost, profit, customer_id, overridden
+      from jsonb_to_recordset(p_sales) as x(
+           order_id uuid, item_id bigint, item_name text, quantity integer, selling_price numeric,
+           total_sale numeric, cost numeric, profit numeric, customer_id bigint, overridden integer);
+
+    insert into audit_log (branch, item_name, category, action, quantity, unit_cost, selling_price, username)
+    select p_branch, item_name, category, action, quantity, unit_cost, selling_price, username
+      from jsonb_to_recordset(p_audit) as x(
+           item_name text, category text, action text, quantity integer,
+           unit_cost numeric, selling_price numeric, username text);
+
+    for c in
+        select customer_id, order_id, sum(total_sale) as total
+          from jsonb_to_recordset(p_sales) as x(order_id uuid, customer_id bigint, total_sale numeric)
+         where customer_id is not null
+         group by customer_id, order_id
+    loop
+        perform ledger_post(c.customer_id, 'sale', c.total, c.order_id::text);
+    end loop;
+end;
+$$;
@@ -0,0 +1,27 @@
+-- Group commit for the POS API: many orders in one call.
+-- Each order runs record_order in its own subtransaction, so a stock
+-- conflict rolls back that order only; the caller re-runs it on its own.
+-- Returns one {key, ok, rows | code} object per order, in input order.
+
+create or replace function record_orders(p_orders jsonb, p_branch text)
+returns jsonb
+language plpgsql
+as $$
+declare
+    o jsonb;
+    updated jsonb;
+    results jsonb := '[]'::jsonb;
+begin
+    for o in select value from jsonb_array_elements(p_orders)
+    loop
+        begin
+            select coalesce(jsonb_agg(to_jsonb(r)), '[]'::jsonb) into updated
+              from record_order(o -> 'deductions', o -> 'sales', o -> 'audit', p_branch, (o ->> 'idempotency_key')::uuid) r;
+            results := results || jsonb_build_object('key', o ->> 'idempotency_key', 'ok', true, 'rows', updated);
+        exception when sqlstate '40001' then
+            results := results || jsonb_build_object('key', o ->> 'idempotency_key', 'ok', false, 'code', '40001');
+        end;
+    end loop;
+    return results;
+end;
+$$;
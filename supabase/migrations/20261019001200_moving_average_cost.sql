@@ -0,0 +1,94 @@
+-- Moving-average cost per item.
+-- item_costs keeps, per branch and item_name, the units on hand and their
+-- average unit cost. on_hand follows every stock change through a trigger on
+-- items; avg_cost moves only when stock is received with a cost. Both are
+-- O(1) updates, so sales can record cost and profit when they are written
+-- and the P&L never has to reconstruct historical costs.
+
+create table if not exists item_costs (
+    branch text not null references branches (code),
+    item_name text not null,
+    on_hand numeric not null default 0,
+    avg_cost numeric not null default 0,
+    updated_at timestamptz not null default now(),
+    primary key (branch, item_name)
+);
+
+create or replace function item_costs_on_hand_apply(p_branch text, p_item_name text, p_delta numeric)
+returns void
+language sql
+as $$
+    insert into item_costs (branch, item_name, on_hand)
+    values (p_branch, p_item_name, p_delta)
+    on conflict (branch, item_name) do update set
+        on_hand = item_costs.on_hand + excluded.on_hand;
+$$;
+
+create or replace function item_costs_on_hand_trigger()
+returns trigger
+language plpgsql
+as $$
+begin
+    if tg_op = 'UPDATE' and old.branch = new.branch and old.item_name = new.item_name then
+        if new.quantity <> old.quantity then
+            perform item_costs_on_hand_apply(new.branch, new.item_name, new.quantity - old.quantity);
+        end if;
+        return null;
+    end if;
+    if tg_op in ('UPDATE', 'DELETE') then
+        perform item_costs_on_hand_apply(old.branch, old.item_name, -old.quantity);
+    end if;
+    if tg_op in ('INSERT', 'UPDATE') then
+        perform item_costs_on_hand_apply(new.branch, new.item_name, new.quantity);
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists items_cost_on_hand on items;
+create trigger items_cost_on_hand
+after insert or update or delete on items
+for each row execute function item_costs_on_hand_trigger();
+
+-- Backfill on_hand from existing stock (costs start at 0 until the next receipt)
+insert into item_costs (branch, item_name, on_hand)
+select branch, item_name, sum(quantity)
+  from items
+ where not exists (select 1 from item_costs)
+ group by branch, item_name;
+
+-- Fold received stock into the average. Call it after the stock rows are
+-- written: the trigger has already counted the received units, so the units
+-- held before the receipt are on_hand - quantity.
+--   p_lines: [{item_name, quantity, unit_cost}]
+create or replace function receive_cost(p_lines jsonb, p_branch text)
+returns setof item_costs
+language plpgsql
+as $$
+declare
+    l record;
+    held numeric;
+    updated item_costs;
+begin
+    for l in
+        select * from jsonb_to_recordset(p_lines) as x(item_name text, quantity numeric, unit_cost numeric)
+         where x.quantity > 0 and x.unit_cost is not null
+    loop
+        insert into item_costs (branch, item_name, on_hand)
+        values (p_branch, l.item_name, l.quantity)
+        on conflict (branch, item_name) do nothing;
+
+        select greatest(c.on_hand - l.quantity, 0) into held
+          from item_costs c
+         where c.branch = p_branch and c.item_name = l.item_name
+           for update;
+
+        update item_costs
+           set avg_cost = (item_costs.avg_cost * held + l.unit_cost * l.quantity) / (held + l.quantity),
+               updated_at = now()
+         where item_costs.branch = p_branch and item_costs.item_name = l.item_name
+        returning * into updated;
+        return next updated;
+    end loop;
+end;
+$$;
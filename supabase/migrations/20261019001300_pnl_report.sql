@@ -0,0 +1,59 @@
+-- Period P&L aggregated in the database.
+-- pnl_report returns one row per group for a branch and an inclusive date
+-- range, so the app downloads a few aggregated rows instead of every sale.
+--   p_group: day | week | month  - from the branch_daily_sales rollup
+--            item | category | customer - from the sales rows in range
+-- key is the group's sort key (period start, item or category name,
+-- customer id) and label is what the report shows.
+
+create or replace function pnl_report(p_branch text, p_start date, p_end date, p_group text default 'day')
+returns table (key text, label text, lines bigint, units numeric, total_sale numeric, cost numeric, profit numeric)
+language plpgsql
+stable
+as $$
+begin
+    if p_group in ('day', 'week', 'month') then
+        return query
+            select to_char(date_trunc(p_group, r.day), 'YYYY-MM-DD'),
+                   to_char(date_trunc(p_group, r.day), case p_group when 'month' then 'YYYY-MM' else 'YYYY-MM-DD' end),
+                   sum(r.lines)::bigint, sum(r.units), sum(r.total_sale), sum(r.cost), sum(r.profit)
+              from branch_daily_sales r
+             where r.branch = p_branch and r.day between p_start and p_end
+             group by 1, 2
+             order by 1;
+    elsif p_group = 'item' then
+        return query
+            select s.item_name, s.item_name,
+                   count(*), sum(s.quantity)::numeric, sum(coalesce(s.total_sale, 0))::numeric, sum(coalesce(s.cost, 0))::numeric, sum(coalesce(s.profit, 0))::numeric
+              from sales s
+             where s.branch = p_branch and s.date >= p_start and s.date < p_end + 1
+             group by s.item_name
+             order by 1;
+    elsif p_group = 'category' then
+        return query
+            select coalesce(c.category, 'UNCATEGORIZED'), coalesce(c.category, 'UNCATEGORIZED'),
+                   count(*), sum(s.quantity)::numeric, sum(coalesce(s.total_sale, 0))::numeric, sum(coalesce(s.cost, 0))::numeric, sum(coalesce(s.profit, 0))::numeric
+              from sales s
+              left join (
+                  select distinct on (i.item_name) i.item_name, i.category
+                    from items i
+                   where i.branch = p_branch
+                   order by i.item_name, i.item_id desc
+              ) c on c.item_name = s.item_name
+             where s.branch = p_branch and s.date >= p_start and s.date < p_end + 1
+             group by 1, 2
+             order by 1;
+    elsif p_group = 'customer' then
+        return query
+            select coalesce(s.customer_id::text, ''), coalesce(cu.name, 'WALK-IN'),
+                   count(*), sum(s.quantity)::numeric, sum(coalesce(s.total_sale, 0))::numeric, sum(coalesce(s.cost, 0))::numeric, sum(coalesce(s.profit, 0))::numeric
+              from sales s
+              left join customers cu on cu.id = s.customer_id
+             where s.branch = p_branch and s.date >= p_start and s.date < p_end + 1
+             group by 1, 2
+             order by 2;
+    else
+        raise exception 'pnl_report: unknown group %', p_group using errcode = '22023';
+    end if;
+end;
+$$;
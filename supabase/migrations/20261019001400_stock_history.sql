@@ -0,0 +1,180 @@
+-- Point-in-time stock ("what was in fridge 3 last Tuesday?").
+-- Audit rows that move stock now say which items row they moved
+-- (item_id, fridge_no) and by how much (qty_delta, signed). Compact
+-- snapshots of items are taken periodically; stock at time T is the
+-- nearest snapshot plus (or minus) the audit deltas between it and T, so a
+-- query replays at most one snapshot interval of history.
+
+alter table audit_log add column if not exists item_id bigint;
+alter table audit_log add column if not exists fridge_no text;
+alter table audit_log add column if not exists qty_delta integer;
+create index if not exists audit_log_branch_id_idx on audit_log (branch, id);
+
+create table if not exists stock_snapshots (
+    id bigserial primary key,
+    branch text not null references branches (code),
+    taken_at timestamptz not null default now(),
+    last_audit_id bigint not null default 0,  -- audit rows up to this id are reflected in items
+    item_rows integer not null,
+    items jsonb not null                      -- [[item_id, item_name, category, fridge_no, lot_no, quantity], ...]
+);
+create index if not exists stock_snapshots_branch_taken_idx on stock_snapshots (branch, taken_at);
+
+-- Snapshots are a few KB per day per branch; old ones can be thinned out, e.g.
+--   delete from stock_snapshots where taken_at < now() - interval '1 year' and extract(day from taken_at) <> 1;
+
+-- Record the order's audit rows with the items row, fridge and signed delta
+-- of each lot it took from (otherwise as in 20261019001000_idempotency.sql)
+create or replace function record_order(
+    p_deductions jsonb, p_sales jsonb, p_audit jsonb, p_branch text, p_idempotency_key uuid default null
+)
+returns setof items
+language plpgsql
+as $$
+declare
+    d record;
+    c record;
+    updated items;
+begin
+    if p_idempotency_key is not null then
+        -- The key row commits together with the order, or not at all
+        insert into idempotency_keys (key, operation, branch)
+        values (p_idempotency_key, 'record_order', p_branch)
+        on conflict (key) do nothing;
+        if not found then
+            return query
+                select i.* from items i
+                 where i.branch = p_branch
+                   and i.item_id in (select x.item_id from jsonb_to_recordset(p_deductions) as x(item_id bigint));
+            return;
+        end if;
+    end if;
+
+    for d in
+        select * from jsonb_to_recordset(p_deductions) as x(item_id bigint, version integer, quantity integer)
+    loop
+        update items
+           set quantity = items.quantity - d.quantity,
+               version = items.version + 1
+         where items.item_id = d.item_id
+           and items.branch = p_branch
+           and items.version = d.version
+           and items.quantity >= d.quantity
+        returning * into updated;
+        if not found then
+            raise exception 'stock_conflict: item %', d.item_id using errcode = '40001';
+        end if;
+        return next updated;
+    end loop;
+
+    insert into sales (branch, order_id, item_id, item_name, quantity, selling_price, total_sale, cost, profit, customer_id, overridden)
+    select p_branch, order_id, item_id, item_name, quantity, selling_price, total_sale, cost, profit, customer_id, overridden
+      from jsonb_to_recordset(p_sales) as x(
+           order_id uuid, item_id bigint, item_name text, quantity integer, selling_price numeric,
+           total_sale numeric, cost numeric, profit numeric, customer_id bigint, overridden integer);
+
+    insert into audit_log (branch, item_name, category, action, quantity, unit_cost, selling_price, username, item_id, fridge_no, qty_delta)
+    select p_branch, item_name, category, action, quantity, unit_cost, selling_price, username, item_id, fridge_no, qty_delta
+      from jsonb_to_recordset(p_audit) as x(
+           item_name text, category text, action text, quantity integer,
+           unit_cost numeric, selling_price numeric, username text,
+           item_id bigint, fridge_no text, qty_delta integer);
+
+    for c in
+        select customer_id, order_id, sum(total_sale) as total
+          from jsonb_to_recordset(p_sales) as x(order_id uuid, customer_id bigint, total_sale numeric)
+         where customer_id is not null
+         group by customer_id, order_id
+    loop
+        perform ledger_post(c.customer_id, 'sale', c.total, c.order_id::text);
+    end loop;
+end;
+$$;
+
+-- Copy the branch's non-empty stock rows and the audit high-water mark in one statement
+create or replace function take_stock_snapshot(p_branch text)
+returns stock_snapshots
+language plpgsql
+as $$
+declare
+    snap stock_snapshots;
+begin
+    insert into stock_snapshots (branch, last_audit_id, item_rows, items)
+    select p_branch,
+           coalesce((select max(a.id) from audit_log a where a.branch = p_branch), 0),
+           count(*),
+           coalesce(jsonb_agg(jsonb_build_array(i.item_id, i.item_name, i.category, i.fridge_no::text, i.lot_no, i.quantity)
+                              order by i.item_id), '[]'::jsonb)
+      from items i
+     where i.branch = p_branch and i.quantity <> 0
+    returning * into snap;
+    return snap;
+end;
+$$;
+
+-- Stock rows as they stood at p_at. Uses the latest snapshot at or before
+-- p_at and adds the deltas logged after it; before the first snapshot it
+-- starts from that snapshot and takes back the deltas logged after p_at.
+create or replace function stock_at(p_branch text, p_at timestamptz)
+returns table (item_id bigint, item_name text, category text, fridge_no text, lot_no text, quantity bigint,
+               snapshot_id bigint, snapshot_at timestamptz)
+language plpgsql
+stable
+as $$
+declare
+    snap stock_snapshots;
+    forward boolean := true;
+begin
+    select * into snap from stock_snapshots s
+     where s.branch = p_branch and s.taken_at <= p_at
+     order by s.taken_at desc limit 1;
+    if not found then
+        forward := false;
+        select * into snap from stock_snapshots s
+         where s.branch = p_branch
+         order by s.taken_at limit 1;
+        if not found then
+            raise exception 'stock_at: no stock snapshot for branch %', p_branch using errcode = 'P0002';
+        end if;
+    end if;
+
+    return query
+        with base as (
+            select (e ->> 0)::bigint as b_item_id, e ->> 1 as b_item_name, e ->> 2 as b_category,
+                   e ->> 3 as b_fridge_no, e ->> 4 as b_lot_no, (e ->> 5)::bigint as b_quantity
+              from jsonb_array_elements(snap.items) e
+        ), moves as (
+            select a.item_id as m_item_id, max(a.item_name) as m_item_name, max(a.category) as m_category,
+                   max(a.fridge_no) as m_fridge_no,
+                   sum(a.qty_delta) * (case when forward then 1 else -1 end) as m_delta
+              from audit_log a
+             where a.branch = p_branch and a.item_id is not null and a.qty_delta is not null
+               and case when forward then a.id > snap.last_audit_id and a.timestamp <= p_at
+                        else a.id <= snap.last_audit_id and a.timestamp > p_at end
+             group by a.item_id
+        )
+        select coalesce(b.b_item_id, m.m_item_id), coalesce(b.b_item_name, m.m_item_name),
+               coalesce(b.b_category, m.m_category), coalesce(b.b_fridge_no, m.m_fridge_no), b.b_lot_no,
+               (coalesce(b.b_quantity, 0) + coalesce(m.m_delta, 0))::bigint, snap.id, snap.taken_at
+          from base b
+          full join moves m on m.m_item_id = b.b_item_id
+         where coalesce(b.b_quantity, 0) + coalesce(m.m_delta, 0) <> 0
+         order by 2, 4, 1;
+end;
+$$;
+
+-- Items rows whose live quantity differs from the latest snapshot plus every
+-- delta logged since: a stock change that skipped the audit log, or an
+-- audit row with a wrong delta.
+create or replace function stock_drift(p_branch text)
+returns table (item_id bigint, item_name text, fridge_no text, replayed bigint, live bigint, difference bigint)
+language sql
+stable
+as $$
+    select coalesce(i.item_id, r.item_id), coalesce(i.item_name, r.item_name), coalesce(i.fridge_no::text, r.fridge_no),
+           coalesce(r.quantity, 0), coalesce(i.quantity, 0)::bigint, (coalesce(i.quantity, 0) - coalesce(r.quantity, 0))::bigint
+      from stock_at(p_branch, 'infinity') r
+      full join (select * from items where items.branch = p_branch and items.quantity <> 0) i on i.item_id = r.item_id
+     where coalesce(r.quantity, 0) <> coalesce(i.quantity, 0)
+     order by 2, 3, 1;
+$$;
@@ -0,0 +1,32 @@
+-- record_orders: an order the database rejects for any reason (a bad key or
+-- customer_id cast, a missing customer, a check constraint) rolls back on
+-- its own and comes back as {key, ok: false, code, error}, instead of
+-- failing the call and with it every other order in the batch.
+-- Stock conflicts still return code 40001 so the caller re-runs them.
+
+create or replace function record_orders(p_orders jsonb, p_branch text)
+returns jsonb
+language plpgsql
+as $$
+declare
+    o jsonb;
+    updated jsonb;
+    results jsonb := '[]'::jsonb;
+begin
+    for o in select value from jsonb_array_elements(p_orders)
+    loop
+        begin
+            select coalesce(jsonb_agg(to_jsonb(r)), '[]'::jsonb) into updated
+              from record_order(o -> 'deductions', o -> 'sales', o -> 'audit', p_branch, (o ->> 'idempotency_key')::uuid) r;
+            results := results || jsonb_build_object('key', o ->> 'idempotency_key', 'ok', true, 'rows', updated);
+        exception
+            when sqlstate '40001' then
+                results := results || jsonb_build_object('key', o ->> 'idempotency_key', 'ok', false, 'code', '40001');
+            when others then
+                results := results || jsonb_build_object(
+                    'key', o ->> 'idempotency_key', 'ok', false, 'code', sqlstate, 'error', sqlerrm);
+        end;
+    end loop;
+    return results;
+end;
+$$;
@@ -0,0 +1,125 @@
+-- Idempotent stock and customer writes.
+-- Writes the offline journal may replay (and the transport may retry after a
+-- lost response) carry an idempotency key, as record_order does: the key row
+-- commits together with the write, so a repeated call returns the first
+-- call's rows instead of applying the write again. Stock rows and their
+-- audit rows are written in the same transaction.
+
+alter table idempotency_keys add column if not exists result jsonb;  -- rows returned by the first call
+
+-- Add stock: each line either adds to an existing items row (item_id) or
+-- becomes a new row (item_id null, or the row is gone).
+--   p_lines: [{item_id, item_name, category, quantity, fridge_no, lot_no,
+--              expiry_date, action, unit_cost, username}]
+create or replace function receive_stock(p_lines jsonb, p_branch text, p_idempotency_key uuid default null)
+returns setof items
+language plpgsql
+as $$
+declare
+    e jsonb;
+    updated items;
+    written jsonb := '[]'::jsonb;
+begin
+    if p_idempotency_key is not null then
+        insert into idempotency_keys (key, operation, branch)
+        values (p_idempotency_key, 'receive_stock', p_branch)
+        on conflict (key) do nothing;
+        if not found then
+            return query
+                select r.* from idempotency_keys k
+                 cross join jsonb_populate_recordset(null::items, k.result) r
+                 where k.key = p_idempotency_key;
+            return;
+        end if;
+    end if;
+
+    for e in select value from jsonb_array_elements(p_lines)
+    loop
+        updated := null;
+        if e ->> 'item_id' is not null then
+            update items
+               set quantity = items.quantity + (e ->> 'quantity')::integer,
+                   version = items.version + 1
+             where items.item_id = (e ->> 'item_id')::bigint
+               and items.branch = p_branch
+            returning * into updated;
+        end if;
+        if updated.item_id is null then
+            -- jsonb_populate_record casts fridge_no, expiry_date ... to the items column types
+            insert into items (branch, item_name, category, quantity, fridge_no, lot_no, expiry_date)
+            select p_branch, r.item_name, r.category, r.quantity, r.fridge_no, r.lot_no, r.expiry_date
+              from jsonb_populate_record(null::items, e - 'item_id') r
+            returning * into updated;
+        end if;
+
+        insert into audit_log (branch, item_name, category, action, quantity, unit_cost, selling_price, username,
+                               item_id, fridge_no, qty_delta)
+        values (p_branch, updated.item_name, updated.category, e ->> 'action', (e ->> 'quantity')::integer,
+                coalesce((e ->> 'unit_cost')::numeric, 0), 0, e ->> 'username',
+                updated.item_id, updated.fridge_no::text, (e ->> 'quantity')::integer);
+
+        written := written || jsonb_build_array(to_jsonb(updated));
+        return next updated;
+    end loop;
+
+    if p_idempotency_key is not null then
+        update idempotency_keys set result = written where key = p_idempotency_key;
+    end if;
+end;
+$$;
+
+-- Remove one stock row and log it in one transaction. Deleting twice finds
+-- nothing the second time, so this needs no key.
+create or replace function delete_stock(p_item_id bigint, p_username text, p_branch text)
+returns setof items
+language plpgsql
+as $$
+declare
+    removed items;
+begin
+    delete from items
+     where items.item_id = p_item_id and items.branch = p_branch
+    returning * into removed;
+    if not found then
+        return;
+    end if;
+    insert into audit_log (branch, item_name, category, action, quantity, unit_cost, selling_price, username,
+                           item_id, fridge_no, qty_delta)
+    values (p_branch, removed.item_name, removed.category, 'Delete', removed.quantity, 0, 0, p_username,
+            removed.item_id, removed.fridge_no::text, -removed.quantity);
+    return next removed;
+end;
+$$;
+
+-- Add a customer once per key
+create or replace function insert_customer(p_customer jsonb, p_branch text, p_idempotency_key uuid default null)
+returns setof customers
+language plpgsql
+as $$
+declare
+    added customers;
+begin
+    if p_idempotency_key is not null then
+        insert into idempotency_keys (key, operation, branch)
+        values (p_idempotency_key, 'insert_customer', p_branch)
+        on conflict (key) do nothing;
+        if not found then
+            return query
+                select c.* from idempotency_keys k
+                  join customers c on c.id = (k.result ->> 'id')::bigint
+                 where k.key = p_idempotency_key;
+            return;
+        end if;
+    end if;
+
+    insert into customers (branch, name, phone, email, address)
+    select p_branch, r.name, r.phone, r.email, r.address
+      from jsonb_populate_record(null::customers, p_customer) r
+    returning * into added;
+
+    if p_idempotency_key is not null then
+        update idempotency_keys set result = jsonb_build_object('id', added.id) where key = p_idempotency_key;
+    end if;
+    return next added;
+end;
+$$;
@@ -0,0 +1,134 @@
+-- Moving-average cost that ignores stock of unknown cost.
+-- Stock that was on hand before costs were tracked (the backfill in
+-- 20261019001200) has no cost; averaging it in at 0 dragged the first real
+-- costs towards zero. costed_units counts the units on hand that carry a
+-- cost, and only those weigh in the average:
+--   costed receipt    avg = (avg × costed_units + cost × qty) / (costed_units + qty)
+--   uncosted receipt  valued at the current average, if there is one
+--   stock going out   takes uncosted units first (they are the oldest)
+-- avg_cost is null until the first costed receipt. The fold now runs inside
+-- receive_stock, in the same transaction as the stock rows, as one update
+-- of the item_costs row (which the on-hand trigger has already locked).
+
+alter table item_costs add column if not exists costed_units numeric not null default 0;
+alter table item_costs alter column avg_cost drop not null;
+alter table item_costs alter column avg_cost drop default;
+
+-- Rows still at the backfilled 0 have never had a costed receipt. Rows that
+-- have keep their average (it may be diluted by legacy stock) and count
+-- their stock as costed from now on.
+update item_costs set avg_cost = null, costed_units = 0 where avg_cost = 0;
+update item_costs set costed_units = greatest(on_hand, 0) where avg_cost is not null;
+
+create or replace function item_costs_on_hand_apply(p_branch text, p_item_name text, p_delta numeric)
+returns void
+language sql
+as $$
+    insert into item_costs (branch, item_name, on_hand)
+    values (p_branch, p_item_name, p_delta)
+    on conflict (branch, item_name) do update set
+        on_hand = item_costs.on_hand + excluded.on_hand,
+        costed_units = greatest(least(item_costs.costed_units, item_costs.on_hand + excluded.on_hand), 0);
+$$;
+
+-- Fold one received line into the average; call after its stock row is written
+create or replace function item_costs_receive(p_branch text, p_item_name text, p_quantity numeric, p_unit_cost numeric)
+returns item_costs
+language sql
+as $$
+    insert into item_costs (branch, item_name, on_hand)
+    values (p_branch, p_item_name, 0)
+    on conflict (branch, item_name) do nothing;
+
+    update item_costs c
+       set avg_cost = case
+               when p_unit_cost is null then c.avg_cost
+               else (coalesce(c.avg_cost, 0) * c.costed_units + p_unit_cost * p_quantity) / (c.costed_units + p_quantity)
+           end,
+           costed_units = case
+               when p_unit_cost is null and c.avg_cost is null then c.costed_units
+               else least(c.costed_units + p_quantity, c.on_hand)
+           end,
+           updated_at = now()
+     where c.branch = p_branch and c.item_name = p_item_name
+    returning c.*;
+$$;
+
+-- Kept for callers that record costs on their own
+create or replace function receive_cost(p_lines jsonb, p_branch text)
+returns setof item_costs
+language plpgsql
+as $$
+declare
+    l record;
+begin
+    for l in
+        select * from jsonb_to_recordset(p_lines) as x(item_name text, quantity numeric, unit_cost numeric)
+         where x.quantity > 0 and x.unit_cost is not null
+    loop
+        return next item_costs_receive(p_branch, l.item_name, l.quantity, l.unit_cost);
+    end loop;
+end;
+$$;
+
+-- As in 20261019001600_keyed_stock_writes.sql, plus the cost fold per line
+create or replace function receive_stock(p_lines jsonb, p_branch text, p_idempotency_key uuid default null)
+returns setof items
+language plpgsql
+as $$
+declare
+    e jsonb;
+    updated items;
+    written jsonb := '[]'::jsonb;
+begin
+    if p_idempotency_key is not null then
+        insert into idempotency_keys (key, operation, branch)
+        values (p_idempotency_key, 'receive_stock', p_branch)
+        on conflict (key) do nothing;
+        if not found then
+            return query
+                select r.* from idempotency_keys k
+                 cross join jsonb_populate_recordset(null::items, k.result) r
+                 where k.key = p_idempotency_key;
+            return;
+        end if;
+    end if;
+
+    for e in select value from jsonb_array_elements(p_lines)
+    loop
+        updated := null;
+        if e ->> 'item_id' is not null then
+            update items
+               set quantity = items.quantity + (e ->> 'quantity')::integer,
+                   version = items.version + 1
+             where items.item_id = (e ->> 'item_id')::bigint
+               and items.branch = p_branch
+            returning * into updated;
+        end if;
+        if updated.item_id is null then
+            -- jsonb_populate_record casts fridge_no, expiry_date ... to the items column types
+            insert into items (branch, item_name, category, quantity, fridge_no, lot_no, expiry_date)
+            select p_branch, r.item_name, r.category, r.quantity, r.fridge_no, r.lot_no, r.expiry_date
+              from jsonb_populate_record(null::items, e - 'item_id') r
+            returning * into updated;
+        end if;
+
+        if (e ->> 'quantity')::integer > 0 then
+            perform item_costs_receive(p_branch, updated.item_name, (e ->> 'quantity')::numeric, (e ->> 'unit_cost')::numeric);
+        end if;
+
+        insert into audit_log (branch, item_name, category, action, quantity, unit_cost, selling_price, username,
+                               item_id, fridge_no, qty_delta)
+        values (p_branch, updated.item_name, updated.category, e ->> 'action', (e ->> 'quantity')::integer,
+                coalesce((e ->> 'unit_cost')::numeric, 0), 0, e ->> 'username',
+                updated.item_id, updated.fridge_no::text, (e ->> 'quantity')::integer);
+
+        written := written || jsonb_build_array(to_jsonb(updated));
+        return next updated;
+    end loop;
+
+    if p_idempotency_key is not null then
+        update idempotency_keys set result = written where key = p_idempotency_key;
+    end if;
+end;
+$$;
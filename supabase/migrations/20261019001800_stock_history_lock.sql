@@ -0,0 +1,96 @@
+-- Consistent stock snapshots.
+-- A snapshot pairs the items rows with max(audit_log.id), so every stock
+-- change must be both in the rows and at or below that id, or neither.
+-- Stock rows and their audit rows are written in one transaction
+-- (record_order, receive_stock, delete_stock, delete_all_stock), and every
+-- such transaction holds a shared advisory lock per branch, taken by the
+-- triggers below, until it commits. take_stock_snapshot takes the same lock
+-- exclusively: it waits for in-flight stock writes to commit (whatever order
+-- their audit ids were handed out in) and holds new ones back until the
+-- snapshot is written.
+
+create or replace function stock_history_lock_key(p_branch text)
+returns bigint
+language sql
+immutable
+as $$
+    select hashtextextended('stock_history:' || p_branch, 0);
+$$;
+
+create or replace function stock_history_lock_trigger()
+returns trigger
+language plpgsql
+as $$
+begin
+    if tg_op = 'DELETE' then
+        perform pg_advisory_xact_lock_shared(stock_history_lock_key(old.branch));
+        return old;
+    end if;
+    perform pg_advisory_xact_lock_shared(stock_history_lock_key(new.branch));
+    if tg_op = 'UPDATE' and old.branch <> new.branch then
+        perform pg_advisory_xact_lock_shared(stock_history_lock_key(old.branch));
+    end if;
+    return new;
+end;
+$$;
+
+drop trigger if exists items_stock_history_lock on items;
+create trigger items_stock_history_lock
+before insert or delete or update of quantity, branch on items
+for each row execute function stock_history_lock_trigger();
+
+drop trigger if exists audit_log_stock_history_lock on audit_log;
+create trigger audit_log_stock_history_lock
+before insert on audit_log
+for each row when (new.qty_delta is not null)
+execute function stock_history_lock_trigger();
+
+create or replace function take_stock_snapshot(p_branch text)
+returns stock_snapshots
+language plpgsql
+as $$
+declare
+    snap stock_snapshots;
+begin
+    perform pg_advisory_xact_lock(stock_history_lock_key(p_branch));
+    -- A new statement, so it sees every stock write that committed while we waited
+    insert into stock_snapshots (branch, last_audit_id, item_rows, items)
+    select p_branch,
+           coalesce((select max(a.id) from audit_log a where a.branch = p_branch), 0),
+           count(*),
+           coalesce(jsonb_agg(jsonb_build_array(i.item_id, i.item_name, i.category, i.fridge_no::text, i.lot_no, i.quantity)
+                              order by i.item_id), '[]'::jsonb)
+      from items i
+     where i.branch = p_branch and i.quantity <> 0
+    returning * into snap;
+    return snap;
+end;
+$$;
+
+-- Clear a branch's stock with one audit row per non-empty stock row (or a
+-- single summary row when there was nothing), in one transaction
+create or replace function delete_all_stock(p_branch text, p_username text default 'System')
+returns integer
+language plpgsql
+as $$
+declare
+    logged integer;
+begin
+    with removed as (
+        delete from items i where i.branch = p_branch returning i.*
+    )
+    insert into audit_log (branch, item_name, category, action, quantity, unit_cost, selling_price, username,
+                           item_id, fridge_no, qty_delta)
+    select p_branch, r.item_name, r.category, 'Delete All Inventory', r.quantity, 0, 0, p_username,
+           r.item_id, r.fridge_no::text, -r.quantity
+      from removed r
+     where r.quantity <> 0;
+    get diagnostics logged = row_count;
+
+    if logged = 0 then
+        insert into audit_log (branch, item_name, category, action, quantity, unit_cost, selling_price, username)
+        values (p_branch, 'ALL ITEMS', 'ALL CATEGORIES', 'Delete All Inventory', 0, 0, 0, p_username);
+    end if;
+    return logged;
+end;
+$$;
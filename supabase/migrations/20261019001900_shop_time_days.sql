@@ -0,0 +1,91 @@
+-- Business days are shop days (Asia/Manila), not UTC days.
+-- sales.date is a timestamptz, so a sale rung up at 07:30 in the shop was
+-- landing on the previous UTC day in branch_daily_sales and in the
+-- pnl_report ranges. The rollup trigger now buckets by the shop-time date,
+-- the rollup is rebuilt from sales, and pnl_report filters on shop-day
+-- boundaries. The raw-sales ranges compare sales.date against the instants
+-- the shop days start, which is the same as
+-- (s.date at time zone 'Asia/Manila')::date between p_start and p_end
+-- but keeps sales_branch_date_idx usable.
+
+create or replace function branch_daily_sales_trigger()
+returns trigger
+language plpgsql
+as $$
+begin
+    if tg_op in ('UPDATE', 'DELETE') then
+        perform branch_daily_sales_apply(old.branch, (old.date at time zone 'Asia/Manila')::date, -1,
+            old.quantity, coalesce(old.total_sale, 0), coalesce(old.cost, 0), coalesce(old.profit, 0));
+    end if;
+    if tg_op in ('INSERT', 'UPDATE') then
+        perform branch_daily_sales_apply(new.branch, (new.date at time zone 'Asia/Manila')::date, 1,
+            new.quantity, coalesce(new.total_sale, 0), coalesce(new.cost, 0), coalesce(new.profit, 0));
+    end if;
+    return null;
+end;
+$$;
+
+-- Rebuild the rollup in shop days; the lock (held until the migration
+-- commits) keeps sales writes from adding trigger deltas to replaced rows.
+lock table sales in share row exclusive mode;
+delete from branch_daily_sales;
+insert into branch_daily_sales (branch, day, lines, units, total_sale, cost, profit)
+select branch, (date at time zone 'Asia/Manila')::date, count(*), sum(quantity),
+       sum(coalesce(total_sale, 0)), sum(coalesce(cost, 0)), sum(coalesce(profit, 0))
+  from sales
+ group by branch, (date at time zone 'Asia/Manila')::date;
+
+create or replace function pnl_report(p_branch text, p_start date, p_end date, p_group text default 'day')
+returns table (key text, label text, lines bigint, units numeric, total_sale numeric, cost numeric, profit numeric)
+language plpgsql
+stable
+as $$
+declare
+    v_from timestamptz := p_start::timestamp at time zone 'Asia/Manila';
+    v_to timestamptz := (p_end + 1)::timestamp at time zone 'Asia/Manila';
+begin
+    if p_group in ('day', 'week', 'month') then
+        return query
+            select to_char(date_trunc(p_group, r.day), 'YYYY-MM-DD'),
+                   to_char(date_trunc(p_group, r.day), case p_group when 'month' then 'YYYY-MM' else 'YYYY-MM-DD' end),
+                   sum(r.lines)::bigint, sum(r.units), sum(r.total_sale), sum(r.cost), sum(r.profit)
+              from branch_daily_sales r
+             where r.branch = p_branch and r.day between p_start and p_end
+             group by 1, 2
+             order by 1;
+    elsif p_group = 'item' then
+        return query
+            select s.item_name, s.item_name,
+                   count(*), sum(s.quantity)::numeric, sum(coalesce(s.total_sale, 0))::numeric, sum(coalesce(s.cost, 0))::numeric, sum(coalesce(s.profit, 0))::numeric
+              from sales s
+             where s.branch = p_branch and s.date >= v_from and s.date < v_to
+             group by s.item_name
+             order by 1;
+    elsif p_group = 'category' then
+        return query
+            select coalesce(c.category, 'UNCATEGORIZED'), coalesce(c.category, 'UNCATEGORIZED'),
+                   count(*), sum(s.quantity)::numeric, sum(coalesce(s.total_sale, 0))::numeric, sum(coalesce(s.cost, 0))::numeric, sum(coalesce(s.profit, 0))::numeric
+              from sales s
+              left join (
+                  select distinct on (i.item_name) i.item_name, i.category
+                    from items i
+                   where i.branch = p_branch
+                   order by i.item_name, i.item_id desc
+              ) c on c.item_name = s.item_name
+             where s.branch = p_branch and s.date >= v_from and s.date < v_to
+             group by 1, 2
+             order by 1;
+    elsif p_group = 'customer' then
+        return query
+            select coalesce(s.customer_id::text, ''), coalesce(cu.name, 'WALK-IN'),
+                   count(*), sum(s.quantity)::numeric, sum(coalesce(s.total_sale, 0))::numeric, sum(coalesce(s.cost, 0))::numeric, sum(coalesce(s.profit, 0))::numeric
+              from sales s
+              left join customers cu on cu.id = s.customer_id
+             where s.branch = p_branch and s.date >= v_from and s.date < v_to
+             group by 1, 2
+             order by 2;
+    else
+        raise exception 'pnl_report: unknown group %', p_group using errcode = '22023';
+    end if;
+end;
+$$;
@@ -0,0 +1,53 @@
+-- Replay arithmetic of stock_at (20261019001400_stock_history.sql).
+-- Run with `supabase test db`; everything is rolled back.
+begin;
+create extension if not exists pgtap with schema extensions;
+select plan(5);
+
+insert into branches (code, name) values ('pgtap', 'pgTAP');
+
+-- Logged before the snapshot: +10 TUNA
+insert into audit_log (branch, item_name, category, action, quantity, unit_cost, selling_price, username,
+                       item_id, fridge_no, qty_delta, timestamp)
+values ('pgtap', 'TUNA', 'FISH', 'Add Stock', 10, 0, 0, 'pgtap', 1, '3', 10, '2026-01-05 09:00+08');
+
+insert into stock_snapshots (branch, taken_at, last_audit_id, item_rows, items)
+select 'pgtap', '2026-01-10 00:00+08', max(id), 2,
+       '[[1, "TUNA", "FISH", "3", null, 10], [2, "BEEF", "MEAT", "1", null, 4]]'::jsonb
+  from audit_log where branch = 'pgtap';
+
+-- Logged after it: -3 TUNA, -4 BEEF, +6 PORK
+insert into audit_log (branch, item_name, category, action, quantity, unit_cost, selling_price, username,
+                       item_id, fridge_no, qty_delta, timestamp)
+values ('pgtap', 'TUNA', 'FISH', 'Sale', 3, 0, 0, 'pgtap', 1, '3', -3, '2026-01-12 09:00+08'),
+       ('pgtap', 'BEEF', 'MEAT', 'Sale', 4, 0, 0, 'pgtap', 2, '1', -4, '2026-01-15 09:00+08'),
+       ('pgtap', 'PORK', 'MEAT', 'Add Stock', 6, 0, 0, 'pgtap', 3, '2', 6, '2026-01-16 09:00+08');
+
+select results_eq(
+    $$ select item_id, quantity from stock_at('pgtap', '2026-01-11 00:00+08') order by item_id $$,
+    $$ values (1::bigint, 10::bigint), (2, 4) $$,
+    'between the snapshot and the next move: the snapshot as taken'
+);
+select results_eq(
+    $$ select item_id, quantity from stock_at('pgtap', '2026-01-12 09:00+08') order by item_id $$,
+    $$ values (1::bigint, 7::bigint), (2, 4) $$,
+    'a move logged exactly at p_at is included'
+);
+select results_eq(
+    $$ select item_id, quantity from stock_at('pgtap', '2026-01-15 12:00+08') order by item_id $$,
+    $$ values (1::bigint, 7::bigint) $$,
+    'rows replayed down to zero are left out'
+);
+select results_eq(
+    $$ select item_id, quantity from stock_at('pgtap', '2026-01-20 00:00+08') order by item_id $$,
+    $$ values (1::bigint, 7::bigint), (3, 6) $$,
+    'rows first stocked after the snapshot are added'
+);
+select results_eq(
+    $$ select item_id, quantity from stock_at('pgtap', '2026-01-04 00:00+08') order by item_id $$,
+    $$ values (2::bigint, 4::bigint) $$,
+    'before the first snapshot, later moves are taken back'
+);
+
+select * from finish();
+rollback;
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+
+# ---------------- SETTINGS ----------------
+# Compact dtype per column for the large, read-mostly tables:
+#   category - low-cardinality strings (stored once, rows hold small codes)
+#   int32    - ids and counts; falls back to float32/float64 for fractional values
+#   float32  - only when every value survives the round trip, otherwise float64
+#   datetime - ISO strings parsed into tz-aware UTC datetime64
+# Money columns are not listed: they stay float64 so totals add up exactly as before.
+TABLE_DTYPES = {
+    "sales": {
+        "id": "int32", "item_id": "int32", "customer_id": "int32",
+        "item_name": "category", "category": "category", "fridge_no": "category",
+        "quantity": "int32", "date": "datetime"
+    },
+    "audit_log": {
+        "id": "int32", "item_id": "int32",
+        "item_name": "category", "category": "category", "fridge_no": "category",
+        "action": "category", "username": "category",
+        "quantity": "int32", "timestamp": "datetime"
+    },
+    "price_history": {
+        "id": "int32", "item_id": "int32", "tier_id": "int32",
+        "min_qty": "int32", "max_qty": "int32",
+        "item_name": "category", "category": "category", "username": "category",
+        "timestamp": "datetime"
+    },
+    "customer_ledger": {
+        "kind": "category", "entry_date": "datetime"
+    }
+}
+
+INT32_MIN, INT32_MAX = np.iinfo(np.int32).min, np.iinfo(np.int32).max
+
+# table -> {"rows", "before_bytes", "after_bytes"} of the last load
+memory_stats = {}
+
+# ---------------- CONVERSION ----------------
+def _to_float(series):
+    values = pd.to_numeric(series, errors="coerce").astype("float64")
+    narrow = values.astype("float32")
+    lossless = np.array_equal(narrow.astype("float64").to_numpy(), values.to_numpy(), equal_nan=True)
+    return narrow if lossless else values
+
+def _to_int32(series):
+    values = pd.to_numeric(series, errors="coerce")
+    present = values.dropna()
+    if present.empty:
+        return values.astype("Int32")
+    if (present % 1 != 0).any():
+        return _to_float(values)
+    if present.min() < INT32_MIN or present.max() > INT32_MAX:
+        return values  # leave out-of-range ids as they came
+    return values.astype("Int32" if values.isna().any() else "int32")
+
+def _to_datetime(series):
+    return pd.to_datetime(series, utc=True, format="ISO8601", errors="coerce")
+
+CONVERTERS = {
+    "category": lambda s: s.astype("category"),
+    "int32": _to_int32,
+    "float32": _to_float,
+    "datetime": _to_datetime
+}
+
+def compact_frame(df: pd.DataFrame, table: str) -> pd.DataFrame:
+    """Convert the columns listed for table in TABLE_DTYPES, recording memory before and after."""
+    schema = TABLE_DTYPES.get(table)
+    if not schema or df.empty:
+        return df
+    before = int(df.memory_usage(deep=True).sum())
+    for column, kind in schema.items():
+        if column in df.columns:
+            df[column] = CONVERTERS[kind](df[column])
+    memory_stats[table] = {
+        "rows": len(df),
+        "before_bytes": before,
+        "after_bytes": int(df.memory_usage(deep=True).sum())
+    }
+    return df
+
+def to_frame(table: str, rows) -> pd.DataFrame:
+    """Build a DataFrame from PostgREST rows with the table's compact dtypes."""
+    return compact_frame(pd.DataFrame(rows), table)
+
+def memory_report() -> pd.DataFrame:
+    """Memory use of the last load of each table, before and after conversion."""
+    report = pd.DataFrame.from_dict(memory_stats, orient="index")
+    if report.empty:
+        return report
+    report["saved_pct"] = (1 - report["after_bytes"] / report["before_bytes"]).mul(100).round(1)
+    return report.rename_axis("table").reset_index()
@@ -0,0 +1,96 @@
+import os
+import sys
+import types
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class _Query:
+    """Just enough of the PostgREST builder for archive_audit_log."""
+
+    def __init__(self, table):
+        self.table, self.filters, self.op, self.count = table, [], "select", None
+
+    def select(self, *columns):
+        return self
+
+    def delete(self):
+        self.op = "delete"
+        return self
+
+    def lt(self, column, value):
+        self.filters.append(lambda r: r[column] < value)
+        return self
+
+    def gte(self, column, value):
+        self.filters.append(lambda r: r[column] >= value)
+        return self
+
+    def lte(self, column, value):
+        self.filters.append(lambda r: r[column] <= value)
+        return self
+
+    def is_(self, column, value):
+        assert value == "null"
+        self.filters.append(lambda r: r[column] is None)
+        return self
+
+    def order(self, column):
+        return self
+
+    def limit(self, count):
+        self.count = count
+        return self
+
+    def execute(self):
+        rows = [r for r in self.table if all(f(r) for f in self.filters)]
+        if self.op == "delete":
+            self.table[:] = [r for r in self.table if r not in rows]
+        return types.SimpleNamespace(data=rows[:self.count])
+
+class _Client:
+    def __init__(self):
+        self.audit_log = []
+
+    def table(self, name):
+        assert name == "audit_log"
+        return _Query(self.audit_log)
+
+# Other test modules may have put their own stub in first; only add what is missing
+_db = sys.modules.setdefault("db_supabase", types.ModuleType("db_supabase"))
+vars(_db).setdefault("DEFAULT_BRANCH", "kprime")
+vars(_db).setdefault("current_branch", lambda: "kprime")
+vars(_db).setdefault("view_audit_log", lambda start_date=None, end_date=None: pd.DataFrame())
+vars(_db).setdefault("supabase", _Client())
+
+import audit_archive  # noqa: E402
+
+def _row(id, timestamp, qty_delta=None):
+    return {
+        "id": id, "timestamp": timestamp, "branch": "kprime", "item_name": "TUNA", "action": "Sale",
+        "quantity": 2, "item_id": 7 if qty_delta is not None else None, "qty_delta": qty_delta,
+    }
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    client = _Client()
+    monkeypatch.setattr(audit_archive, "supabase", client)
+    monkeypatch.setattr(audit_archive, "current_branch", lambda: "kprime")
+    monkeypatch.setattr(audit_archive, "AUDIT_ARCHIVE_DIR", str(tmp_path))
+    return client
+
+def test_stock_moves_stay_in_the_live_log(client):
+    client.audit_log[:] = [
+        _row(1, "2025-01-05T03:00:00+00:00"),
+        _row(2, "2025-01-06T03:00:00+00:00", qty_delta=-2),
+        _row(3, "2025-02-07T03:00:00+00:00"),
+        _row(4, "2099-01-01T03:00:00+00:00"),
+    ]
+    result = audit_archive.archive_audit_log(retention_days=90)
+
+    assert result["archived"] == 2
+    assert [r["id"] for r in client.audit_log] == [2, 4]
+    cold = audit_archive.read_archived_audit_log("2025-01-01", "2025-03-01")
+    assert sorted(cold["id"]) == [1, 3]
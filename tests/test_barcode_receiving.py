@@ -0,0 +1,52 @@
+import os
+import sys
+import types
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Counting needs no database; other test modules may share the stub
+_db = sys.modules.setdefault("db_supabase", types.ModuleType("db_supabase"))
+vars(_db).setdefault("current_branch", lambda: "kprime")
+vars(_db).setdefault("view_barcodes", lambda: pd.DataFrame(columns=["barcode", "item_name", "category", "units_per_carton"]))
+
+import cv2  # noqa: E402
+
+import barcode_receiving  # noqa: E402
+
+WIDTH, HEIGHT = 800, 600
+CODE = "0109501101530003"
+
+def _pallet(seed=1):
+    rng = np.random.default_rng(seed)
+    return cv2.GaussianBlur((rng.random((900, 2400)) * 255).astype(np.uint8), (9, 9), 0)
+
+def _pan_across(cartons, step=40, drop_every=0, seed=2):
+    """Frames of a camera panning right over the pallet, with the labels a decoder would report."""
+    pallet, rng = _pallet(), np.random.default_rng(seed)
+    top = 150
+    frames, labels = [], []
+    for n, left in enumerate(range(0, pallet.shape[1] - WIDTH, step)):
+        frames.append(pallet[top:top + HEIGHT, left:left + WIDTH].copy())
+        found = [
+            (payload, x - left + rng.normal(0, 3), y - top + rng.normal(0, 3))
+            for x, y, payload in cartons
+            if 20 < x - left < WIDTH - 20 and 20 < y - top < HEIGHT - 20
+        ]
+        if drop_every and n % drop_every == 2:
+            found = found[1:]  # a missed decode now and then
+        labels.append(found)
+    return frames, labels
+
+def test_identical_cartons_count_separately():
+    cartons = [(200 + col * 400, 250 + row * 200, CODE) for col in range(5) for row in range(3)]
+    frames, labels = _pan_across(cartons, drop_every=5)
+    assert barcode_receiving.count_video_cartons(frames, labels) == {CODE: 15}
+
+def test_carton_seen_in_many_frames_counts_once():
+    cartons = [(1200, 450, CODE), (1300, 450, "OTHER")]
+    frames, labels = _pan_across(cartons)
+    assert sum(1 for found in labels if found) > 5
+    assert barcode_receiving.count_video_cartons(frames, labels) == {CODE: 1, "OTHER": 1}
@@ -0,0 +1,40 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chart_data  # noqa: E402
+
+def test_short_series_are_kept_whole():
+    assert list(chart_data.lttb(range(5), [3, 1, 4, 1, 5], 5)) == [0, 1, 2, 3, 4]
+    assert list(chart_data.lttb(range(5), [3, 1, 4, 1, 5], 2)) == [0, 1, 2, 3, 4]
+
+def test_one_point_per_bucket_with_both_ends():
+    x = np.arange(1000)
+    y = np.sin(x / 40.0)
+    kept = chart_data.lttb(x, y, 50)
+    assert len(kept) == 50
+    assert kept[0] == 0 and kept[-1] == 999
+    assert (np.diff(kept) > 0).all()
+    edges = np.linspace(1, 999, 49).astype(int)
+    assert all(edges[i] <= kept[i + 1] < edges[i + 1] for i in range(48))
+
+def test_spikes_survive_downsampling():
+    y = np.zeros(1000)
+    y[503], y[777] = 50.0, -80.0
+    kept = chart_data.lttb(np.arange(1000), y, 40)
+    assert 503 in kept and 777 in kept
+
+def test_uneven_timestamps_are_used_as_x():
+    dates = pd.to_datetime(["2026-01-01", "2026-01-02", "2026-03-01", "2026-03-02", "2026-03-03", "2026-06-01"])
+    kept = chart_data.lttb(dates.astype("int64"), [1, 2, 9, 2, 1, 3], 4)
+    assert list(kept) == [0, 2, 4, 5]
+
+def test_long_trend_is_downsampled_to_max_points():
+    days = pd.date_range("2024-01-01", periods=900, freq="D", tz="UTC")
+    sales = pd.DataFrame({"date": days.strftime("%Y-%m-%dT03:00:00+00:00"), "total_sale": 100.0, "profit": np.arange(900.0)})
+    fig = chart_data.profit_trend_figure(sales, "Day", max_points=120)
+    assert len(fig.data[0].x) == 120
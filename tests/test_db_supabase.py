@@ -0,0 +1,157 @@
+import importlib.util
+import os
+import sys
+import types
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ["KPRIME_OFFLINE"] = "0"  # no journal file or replayer thread
+
+import streamlit as st  # noqa: E402
+
+def _load_data_layer():
+    # The real module reads its connection from Streamlit secrets on import;
+    # it is loaded under its own name so other tests can stub db_supabase
+    secrets = st.secrets
+    st.secrets = {"supabase": {"url": "http://127.0.0.1:9", "service_role_key": "test"}}
+    try:
+        spec = importlib.util.spec_from_file_location("db_supabase_under_test", os.path.join(ROOT, "db_supabase.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    finally:
+        st.secrets = secrets
+
+db = _load_data_layer()
+
+class _Query:
+    def __init__(self, rows):
+        self.rows, self.filters = rows, []
+
+    def select(self, *columns):
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda r: r[column] == value)
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda r: r[column] > value)
+        return self
+
+    def execute(self):
+        return types.SimpleNamespace(data=[dict(r) for r in self.rows if all(f(r) for f in self.filters)])
+
+class _Client:
+    """Items rows and the reserve_po_sequence counter, in memory."""
+
+    def __init__(self):
+        self.items, self.sequences, self.rpc_calls = [], {}, []
+
+    def table(self, name):
+        assert name == "items"
+        return _Query(self.items)
+
+    def rpc(self, name, params):
+        assert name == "reserve_po_sequence"
+        self.rpc_calls.append(params)
+        key = (params["p_branch"], params["p_date"])
+        self.sequences[key] = self.sequences.get(key, 0) + params["p_count"]
+        return types.SimpleNamespace(execute=lambda: types.SimpleNamespace(data=self.sequences[key]))
+
+@pytest.fixture
+def client(monkeypatch):
+    client = _Client()
+    monkeypatch.setattr(db, "supabase", client)
+    monkeypatch.setattr(db, "_lot_indexes", {})
+    return client
+
+def _lot(item_id, quantity, expiry_date=None, item_name="TUNA"):
+    return {
+        "item_id": item_id, "item_name": item_name, "category": "FISH", "quantity": quantity,
+        "fridge_no": "1", "lot_no": f"L{item_id}", "expiry_date": expiry_date, "version": 0, "branch": "kprime",
+    }
+
+def _taken(picks):
+    return [(row["item_id"], take) for row, take in picks]
+
+# ---------------- FEFO LOTS ----------------
+def test_plan_takes_the_first_expiring_lots_without_writing(client):
+    client.items += [_lot(1, 5, "2026-12-01"), _lot(2, 4, "2026-11-01"), _lot(3, 9)]
+    lots = db.LotIndex("kprime")
+    assert _taken(lots.plan("TUNA", 12)) == [(2, 4), (1, 5), (3, 3)]
+    assert _taken(lots.plan("TUNA", 3)) == [(2, 3)]
+
+def test_updated_row_is_taken_once(client):
+    client.items.append(_lot(1, 5, "2026-12-01"))
+    lots = db.LotIndex("kprime")
+    lots.plan("TUNA", 1)
+    row = lots.row(1)
+    lots.update({**row, "quantity": 0})
+    lots.update({**row, "quantity": 4})
+    lots.update({**row, "quantity": 4, "expiry_date": "2026-10-25"})
+    assert _taken(lots.plan("TUNA", 50)) == [(1, 4)]
+
+def test_exhausted_lot_is_skipped(client):
+    client.items += [_lot(1, 5, "2026-11-01"), _lot(2, 5, "2026-12-01")]
+    lots = db.LotIndex("kprime")
+    lots.plan("TUNA", 1)
+    lots.update({**lots.row(1), "quantity": 0})
+    assert _taken(lots.plan("TUNA", 3)) == [(2, 3)]
+
+def test_shortfall_is_planned_again_on_fresh_lots(client):
+    client.items.append(_lot(1, 5, "2026-11-01"))
+    assert db._plan_order({"TUNA": 3})[2] == {}
+    # Another process receives a lot the cached index has not seen
+    client.items.append(_lot(9, 20, "2026-12-01"))
+    deductions, consumed, shortfall = db._plan_order({"TUNA": 12})
+    assert shortfall == {}
+    assert [(d["item_id"], d["quantity"]) for d in deductions] == [(1, 5), (9, 7)]
+
+def test_near_expiry_lists_only_lots_inside_the_window(client):
+    soon = (date.today() + timedelta(days=2)).isoformat()
+    later = (date.today() + timedelta(days=30)).isoformat()
+    client.items += [_lot(1, 5, later), _lot(2, 5, soon), _lot(3, 5), _lot(4, 0, soon)]
+    assert [row["item_id"] for row in db.LotIndex("kprime").near_expiry(7)] == [2]
+
+# ---------------- PO NUMBERS ----------------
+def test_po_numbers_come_from_reserved_blocks(client):
+    allocator = db.PoSequenceAllocator(block_size=3)
+    assert [allocator.next("2026-10-19") for _ in range(4)] == [1, 2, 3, 4]
+    assert [c["p_count"] for c in client.rpc_calls] == [3, 3]
+    assert allocator.next("2026-10-20") == 1
+
+def test_po_numbers_run_per_branch(client):
+    allocator = db.PoSequenceAllocator(block_size=2)
+    assert allocator.next("2026-10-19") == 1
+    with db.use_branch("steakhaven"):
+        assert allocator.next("2026-10-19") == 1
+    assert allocator.next("2026-10-19") == 2
+
+def test_prefetch_reserves_only_what_is_missing(client):
+    allocator = db.PoSequenceAllocator(block_size=2)
+    allocator.next("2026-10-19")
+    assert allocator.prefetch("2026-10-19", 4) == [2, 3, 4, 5]
+    assert [c["p_count"] for c in client.rpc_calls] == [2, 3]
+    assert allocator.next("2026-10-19") == 2
+
+# ---------------- RECEIPTS ----------------
+def test_receipt_cost_weighs_only_costed_units():
+    frame = pd.DataFrame({
+        "item_name": ["TUNA", "TUNA", "TUNA", "BEEF"],
+        "category": ["FISH", "FISH", "FISH", "MEAT"],
+        "quantity": [10, 30, 5, "2"],
+        "unit_cost": [100, 120, None, ""],
+    })
+    lines = {line["item_name"]: line for line in db.receipt_lines(frame)}
+    assert lines["TUNA"]["quantity"] == 45
+    assert lines["TUNA"]["unit_cost"] == pytest.approx(115)
+    assert lines["BEEF"] == {"item_name": "BEEF", "category": "MEAT", "quantity": 2, "unit_cost": None}
+
+def test_receipt_without_cost_column():
+    frame = pd.DataFrame({"item_name": ["TUNA"], "category": ["FISH"], "quantity": [3]})
+    assert db.receipt_lines(frame) == [{"item_name": "TUNA", "category": "FISH", "quantity": 3, "unit_cost": None}]
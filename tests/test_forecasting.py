@@ -0,0 +1,52 @@
+import os
+import sys
+import types
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# forecasting only needs these reads from the data layer; the real module
+# connects to Supabase on import. Other test modules share the stub.
+_db = sys.modules.setdefault("db_supabase", types.ModuleType("db_supabase"))
+vars(_db).setdefault("current_branch", lambda: "test")
+_db.read_table_csv = lambda table, params=(), order=None: _db.sales
+_db.view_items = lambda: _db.items
+_db.view_lead_times = lambda: pd.DataFrame(columns=["item_name", "lead_time_days"])
+
+import forecasting  # noqa: E402
+
+ITEM_COLUMNS = ["item_id", "item_name", "category", "quantity", "fridge_no"]
+SALE_COLUMNS = ["id", "date", "item_name", "quantity"]
+
+@pytest.fixture(autouse=True)
+def fresh_history(monkeypatch):
+    monkeypatch.setattr(sys.modules["db_supabase"], "sales", pd.DataFrame(columns=SALE_COLUMNS), raising=False)
+    monkeypatch.setattr(sys.modules["db_supabase"], "items", pd.DataFrame(columns=ITEM_COLUMNS), raising=False)
+    forecasting._histories.clear()
+    forecasting._profile_cache.update(key=None, profile=None)
+
+def test_no_items_and_no_sales_gives_empty_report():
+    report = forecasting.reorder_suggestions(today="2026-10-19")
+    assert report.empty
+    assert list(report.columns) == forecasting.REORDER_COLUMNS
+
+def test_items_without_sales_need_no_order():
+    sys.modules["db_supabase"].items = pd.DataFrame(
+        [[1, "TUNA", "FISH", 12, 3], [2, "BEEF", "MEAT", 0, 1]], columns=ITEM_COLUMNS
+    )
+    report = forecasting.reorder_suggestions(today="2026-10-19")
+    assert list(report.columns) == forecasting.REORDER_COLUMNS
+    assert sorted(report["item_name"]) == ["BEEF", "TUNA"]
+    assert (report["daily_rate"] == 0).all()
+    assert (report["suggested_qty"] == 0).all()
+
+def test_sales_without_stock_suggest_an_order():
+    sys.modules["db_supabase"].sales = pd.DataFrame(
+        [[i + 1, f"2026-10-{i + 1:02d}T03:00:00+00:00", "TUNA", 5] for i in range(18)], columns=SALE_COLUMNS
+    )
+    report = forecasting.reorder_suggestions(today="2026-10-19")
+    tuna = report.set_index("item_name").loc["TUNA"]
+    assert tuna["on_hand"] == 0
+    assert tuna["suggested_qty"] > 0
@@ -0,0 +1,58 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import price_impact  # noqa: E402
+
+SALE_COLUMNS = ["item_id", "item_name", "quantity", "selling_price", "total_sale", "date"]
+HISTORY_COLUMNS = ["item_id", "tier_id", "min_qty", "max_qty", "timestamp", "old_selling_price", "new_selling_price"]
+
+def _history(*rows):
+    return pd.DataFrame(list(rows), columns=HISTORY_COLUMNS)
+
+def _sales(*rows):
+    return pd.DataFrame(list(rows), columns=SALE_COLUMNS)
+
+def test_change_to_one_tier_leaves_other_tiers_alone():
+    history = _history(
+        [1, 10, 1, 9, "2026-10-01T00:00:00+00:00", 110, 100],
+        [1, 11, 10, None, "2026-10-05T00:00:00+00:00", 95, 90],
+    )
+    sales = _sales(
+        [1, "TUNA", 1, 100, 100, "2026-10-06T00:00:00+00:00"],
+        [1, "TUNA", 10, 90, 900, "2026-10-06T01:00:00+00:00"],
+    )
+    aligned = price_impact.align_sales_with_prices(sales, history)
+    assert list(aligned["new_selling_price"]) == [100, 90]
+    assert list(aligned["old_selling_price"]) == [110, 95]
+
+    impact = price_impact.price_change_impact(sales.iloc[[0]], history)
+    assert impact["revenue_delta"].sum() == -10
+    assert "margin_delta" not in impact
+
+def test_change_applies_from_its_timestamp_on():
+    history = _history([1, 10, None, None, "2026-10-05T00:00:00+00:00", 100, 90])
+    sales = _sales(
+        [1, "TUNA", 2, 100, 200, "2026-10-04T23:59:59+00:00"],
+        [1, "TUNA", 3, 90, 270, "2026-10-05T00:00:00+00:00"],
+    )
+    aligned = price_impact.align_sales_with_prices(sales, history)
+    assert aligned["new_selling_price"].isna().tolist() == [True, False]
+
+    impact = price_impact.price_change_impact(sales, history, period="Day")
+    assert impact["affected_qty"].sum() == 3
+    assert impact["revenue_delta"].sum() == -30
+
+def test_latest_change_of_the_matching_tier_wins():
+    history = _history(
+        [1, 10, 1, 9, "2026-10-01T00:00:00+00:00", 120, 110],
+        [1, 10, 1, 9, "2026-10-03T00:00:00+00:00", 110, 100],
+        [1, 11, 10, None, "2026-10-04T00:00:00+00:00", 95, 90],
+    )
+    sales = _sales([1, "TUNA", 4, 100, 400, "2026-10-06T00:00:00+00:00"])
+    aligned = price_impact.align_sales_with_prices(sales, history)
+    assert aligned.loc[0, "old_selling_price"] == 110
+    assert aligned.loc[0, "new_selling_price"] == 100
@@ -0,0 +1,57 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import table_dtypes  # noqa: E402
+
+def _sales(**columns):
+    rows = {
+        "id": [1, 2, 3], "item_name": ["TUNA", "TUNA", "BEEF"], "quantity": [1, 2, 3],
+        "date": ["2026-10-01T03:00:00+00:00", "2026-10-01T11:30:00.5+08:00", None],
+        "total_sale": [100.1, 200.2, 300.3],
+    }
+    return pd.DataFrame({**rows, **columns})
+
+def test_listed_columns_get_compact_dtypes():
+    df = table_dtypes.compact_frame(_sales(), "sales")
+    assert df["id"].dtype == "int32"
+    assert df["quantity"].dtype == "int32"
+    assert isinstance(df["item_name"].dtype, pd.CategoricalDtype)
+    assert isinstance(df["date"].dtype, pd.DatetimeTZDtype) and str(df["date"].dt.tz) == "UTC"
+    assert df["date"].iloc[1] == pd.Timestamp("2026-10-01T03:30:00.5", tz="UTC")
+    assert pd.isna(df["date"].iloc[2])
+
+def test_money_columns_stay_float64():
+    df = table_dtypes.compact_frame(_sales(), "sales")
+    assert df["total_sale"].dtype == "float64"
+    assert df["total_sale"].tolist() == [100.1, 200.2, 300.3]
+
+def test_missing_ids_become_nullable_int32():
+    df = table_dtypes.compact_frame(_sales(customer_id=[7, None, 9]), "sales")
+    assert df["customer_id"].dtype == "Int32"
+    assert df["customer_id"].isna().tolist() == [False, True, False]
+
+def test_values_that_do_not_fit_int32_are_not_truncated():
+    df = table_dtypes.compact_frame(_sales(quantity=[1.5, 2, 3], item_id=[1, 2, 2**40]), "sales")
+    assert df["quantity"].tolist() == [1.5, 2, 3]
+    assert df["item_id"].tolist() == [1, 2, 2**40]
+
+def test_float32_only_when_lossless():
+    assert table_dtypes._to_float(pd.Series([0.5, 1.25])).dtype == np.float32
+    assert table_dtypes._to_float(pd.Series([0.1, 1.25])).dtype == np.float64
+
+def test_empty_and_unlisted_tables_are_left_alone():
+    empty = pd.DataFrame(columns=["id", "date"])
+    assert table_dtypes.compact_frame(empty, "sales") is empty
+    items = pd.DataFrame({"item_id": [1], "quantity": [5]})
+    assert table_dtypes.compact_frame(items, "items")["item_id"].dtype == "int64"
+
+def test_memory_before_and_after_is_recorded():
+    table_dtypes.to_frame("audit_log", [{"id": 1, "action": "Sale", "timestamp": "2026-10-01T03:00:00+00:00"}] * 50)
+    report = table_dtypes.memory_report().set_index("table")
+    assert report.loc["audit_log", "rows"] == 50
+    assert report.loc["audit_log", "after_bytes"] < report.loc["audit_log", "before_bytes"]